@@ -0,0 +1,64 @@
+"""
+Blocks/sec indexed by the local address index on synthetic raw blocks, size of the database per transaction and
+latency of balance lookups.
+usage: python benchmarks/bench_addrindex.py [n_blocks] [txs_per_block]
+"""
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from btc.addrindex import AddressIndex
+from btc.script import sha256d
+from btc.transaction import Transaction, TxIn, TxOut, write_varint
+
+
+def fake_blocks(rnd: random.Random, n_blocks: int, txs_per_block: int, scripts: list):
+    unspent = []
+    previous = bytes(32)
+    for height in range(n_blocks):
+        txs = [Transaction(2, [TxIn(bytes(32), 0xffffffff, struct.pack("<I", height))],
+                           [TxOut(625000000, rnd.choice(scripts))])]
+        for _ in range(min(txs_per_block - 1, len(unspent) // 2)):
+            inputs = [unspent.pop(rnd.randrange(len(unspent))) for _ in range(2)]
+            txs.append(Transaction(2, [TxIn(txid, vout) for txid, vout in inputs],
+                                   [TxOut(rnd.randrange(10 ** 4, 10 ** 8), rnd.choice(scripts)) for _ in range(2)]))
+        for tx in txs:
+            unspent += [(tx._stripped_hash(), vout) for vout in range(len(tx.outputs))]
+        header = struct.pack("<i32s32sIII", 4, previous, bytes(32), 0, 0, height)
+        block = header + write_varint(len(txs)) + b"".join(tx.serialize() for tx in txs)
+        previous = sha256d(header)
+        yield block, height
+
+
+def main():
+    n_blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    txs_per_block = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rnd = random.Random(0)
+    scripts = [b"\x00\x14" + rnd.randbytes(20) for _ in range(5000)]
+    blocks = list(fake_blocks(rnd, n_blocks, txs_per_block, scripts))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "addrindex.sqlite")
+        with AddressIndex(path) as index:
+            start = time.perf_counter()
+            index.connect_blocks(blocks)
+            elapsed = time.perf_counter() - start
+            n_txs = index._db.execute("SELECT COUNT(*) FROM txs").fetchone()[0]
+            print("{} blocks of {} txs: {:.1f} blocks/s, {:.0f} txs/s".format(
+                n_blocks, txs_per_block, n_blocks / elapsed, n_blocks * txs_per_block / elapsed))
+            index._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            print("database {:.1f} MB, {:.0f} bytes per transaction".format(
+                os.path.getsize(path) / 1e6, os.path.getsize(path) / n_txs))
+            lookups = scripts[:1000]
+            start = time.perf_counter()
+            for script in lookups:
+                index.balance(script)
+            print("balance: {:.2f} ms per address".format((time.perf_counter() - start) * 1000 / len(lookups)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Blocks/sec applied to the local UTXO set on synthetic raw blocks, batched coin lookups per second and the
+cost of the set statistics, which are kept up to date instead of scanned.
+usage: python benchmarks/bench_chainstate.py [n_blocks] [txs_per_block]
+"""
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from btc.chainstate import ChainState
+from btc.script import sha256d
+from btc.transaction import Transaction, TxIn, TxOut, write_varint
+
+
+def fake_blocks(rnd: random.Random, n_blocks: int, txs_per_block: int, unspent: list):
+    previous = bytes(32)
+    for height in range(n_blocks):
+        txs = [Transaction(2, [TxIn(bytes(32), 0xffffffff, struct.pack("<I", height))],
+                           [TxOut(625000000, b"\x00\x14" + rnd.randbytes(20))])]
+        for _ in range(min(txs_per_block - 1, len(unspent) // 2)):
+            inputs = [unspent.pop(rnd.randrange(len(unspent))) for _ in range(2)]
+            txs.append(Transaction(2, [TxIn(txid, vout) for txid, vout in inputs],
+                                   [TxOut(rnd.randrange(10 ** 4, 10 ** 8), b"\x00\x14" + rnd.randbytes(20))
+                                    for _ in range(3)]))
+        if height:
+            # the outputs of the genesis block are not spendable
+            for tx in txs:
+                unspent += [(tx._stripped_hash(), vout) for vout in range(len(tx.outputs))]
+        header = struct.pack("<i32s32sIII", 4, previous, bytes(32), 0, 0, height)
+        yield header + write_varint(len(txs)) + b"".join(tx.serialize() for tx in txs), height
+        previous = sha256d(header)
+
+
+def main():
+    n_blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    txs_per_block = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rnd = random.Random(0)
+    unspent = []
+    blocks = list(fake_blocks(rnd, n_blocks, txs_per_block, unspent))
+    with tempfile.TemporaryDirectory() as directory:
+        with ChainState(os.path.join(directory, "chainstate.sqlite")) as chainstate:
+            start = time.perf_counter()
+            chainstate.connect_blocks(blocks)
+            elapsed = time.perf_counter() - start
+            print("{} blocks of {} txs: {:.1f} blocks/s, {} coins".format(
+                n_blocks, txs_per_block, n_blocks / elapsed, len(chainstate)))
+            outpoints = [(txid[::-1].hex(), vout) for txid, vout in rnd.sample(unspent, min(len(unspent), 10000))]
+            start = time.perf_counter()
+            coins = chainstate.get_coins(outpoints)
+            elapsed = time.perf_counter() - start
+            assert all(coin is not None for coin in coins)
+            print("get_coins: {:.1f} us per outpoint".format(elapsed * 1e6 / len(outpoints)))
+            start = time.perf_counter()
+            info = chainstate.get_tx_out_set_info()
+            print("get_tx_out_set_info: {:.1f} ms, muhash {}".format((time.perf_counter() - start) * 1000,
+                                                                      info["muhash"]))
+
+
+if __name__ == "__main__":
+    main()
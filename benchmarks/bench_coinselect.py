@@ -0,0 +1,63 @@
+"""
+Payouts per second of the local coin selection algorithms on a list_unspent result, each payout removing the
+selected coins from the set like consecutive send_many would.
+usage: python benchmarks/bench_coinselect.py [n_utxos] [n_payouts]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from btc.coinselect import CoinSelector, InsufficientFunds
+from btc.models import UtxoSet
+from btc.script import script_address
+
+
+def fake_unspent(rnd: random.Random, n_utxo: int) -> list:
+    scripts = [b"\x00\x14" + rnd.randbytes(20) for _ in range(max(n_utxo // 20, 1))]
+    scripts += [b"\x51\x20" + rnd.randbytes(32) for _ in range(max(n_utxo // 100, 1))]
+    entries = []
+    for _ in range(n_utxo):
+        script = rnd.choice(scripts)
+        entries.append({"txid": rnd.randbytes(32).hex(), "vout": rnd.randrange(4), "address": script_address(script),
+                        "scriptPubKey": script.hex(), "amount": rnd.randrange(1000, 10 ** 7) / 1e8,
+                        "confirmations": rnd.randrange(1, 10 ** 4), "spendable": True, "solvable": True,
+                        "safe": True})
+    return entries
+
+
+def run(utxos: UtxoSet, payouts: list, algorithm: str):
+    selector = CoinSelector(utxos, fee_rate=8, long_term_fee_rate=10, seed=0)
+    used = {}
+    inputs = 0
+    start = time.perf_counter()
+    for outputs in payouts:
+        try:
+            selection = selector.select(outputs, algorithm)
+        except InsufficientFunds:
+            continue
+        assert selection.value == sum(outputs.values()) + selection.fee + selection.change
+        used[selection.algorithm] = used.get(selection.algorithm, 0) + 1
+        inputs += len(selection.indexes)
+    elapsed = time.perf_counter() - start
+    print("{:<14}{:>10.0f} payouts/s {:>8} inputs  {}".format(algorithm, len(payouts) / elapsed, inputs, used))
+
+
+def main():
+    n_utxo = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    n_payouts = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    rnd = random.Random(0)
+    utxos = UtxoSet(fake_unspent(rnd, n_utxo))
+    payouts = []
+    for _ in range(n_payouts):
+        script = b"\x00\x14" + rnd.randbytes(20)
+        payouts.append({script_address(script): rnd.randrange(10 ** 4, 5 * 10 ** 6)})
+    print("{} utxos, {} payouts".format(n_utxo, n_payouts))
+    for algorithm in ("largest_first", "knapsack", "bnb", "auto"):
+        run(utxos, payouts, algorithm)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Decode throughput of JSONBaseProvider on a large verbosity 2 getblock response, for every installed JSON backend.
+usage: python benchmarks/bench_decode.py [n_tx]
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from btc.encoding import FriendlyCode, JSON_BACKENDS
+from btc.providers import JSONBaseProvider
+
+
+class RawResponse:
+    def __init__(self, content: bytes):
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+
+def fake_tx(rnd: random.Random) -> dict:
+    def hex_str(n):
+        return "%0*x" % (n * 2, rnd.getrandbits(n * 8))
+
+    return {
+        "txid": hex_str(32), "hash": hex_str(32), "version": 2, "size": 225, "vsize": 144, "weight": 573,
+        "locktime": 0,
+        "vin": [{"txid": hex_str(32), "vout": rnd.randrange(4),
+                 "scriptSig": {"asm": "", "hex": ""},
+                 "txinwitness": [hex_str(71), hex_str(33)], "sequence": 4294967293}
+                for _ in range(rnd.randrange(1, 4))],
+        "vout": [{"value": rnd.randrange(1, 10 ** 9) / 1e8, "n": n,
+                  "scriptPubKey": {"asm": "0 " + hex_str(20), "hex": "0014" + hex_str(20),
+                                   "address": "bc1q" + hex_str(19), "type": "witness_v0_keyhash"}}
+                 for n in range(rnd.randrange(1, 4))],
+        "fee": rnd.randrange(1, 10 ** 5) / 1e8,
+        "hex": hex_str(225),
+    }
+
+
+def fake_block_response(n_tx: int) -> bytes:
+    rnd = random.Random(0)
+    block = {"hash": "00" * 32, "confirmations": 10, "height": 700000, "version": 536870912,
+             "merkleroot": "11" * 32, "time": 1631000000, "mediantime": 1631000000, "nonce": 1,
+             "bits": "170e92aa", "difficulty": 18415156832118.24, "nTx": n_tx,
+             "tx": [fake_tx(rnd) for _ in range(n_tx)]}
+    return json.dumps({"result": block, "error": None, "id": 1}).encode()
+
+
+def measure(func, payload: bytes, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return len(payload) / best / 1e6
+
+
+def main():
+    n_tx = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    payload = fake_block_response(n_tx)
+    response = RawResponse(payload)
+    print("getblock verbosity 2, {} txs, {:.2f} MB".format(n_tx, len(payload) / 1e6))
+
+    # the decode path before the pluggable backends: str decode plus a new FriendlyCode per call
+    print("{:<24}{:>10.1f} MB/s".format("text + json (old)", measure(
+        lambda: FriendlyCode().json_decode(response.text), payload)))
+    for name in JSON_BACKENDS:
+        provider = JSONBaseProvider(name)
+        print("{:<24}{:>10.1f} MB/s".format("bytes + " + name, measure(
+            lambda: provider.decode_rpc_response(response), payload)))
+
+
+if __name__ == "__main__":
+    main()
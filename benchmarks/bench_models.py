@@ -0,0 +1,83 @@
+"""
+Memory held by verbosity 2 blocks and list_unspent results as decoded dicts and as compact models,
+and a check that to_dict gives back the original results.
+usage: python benchmarks/bench_models.py [n_blocks] [n_utxos]
+"""
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from btc.models import BlockModel, UtxoSet
+from btc.script import script_address
+from btc.transaction import Transaction, TxIn, TxOut
+
+
+def fake_block(rnd: random.Random, height: int, n_tx: int) -> bytes:
+    txs = []
+    for _ in range(n_tx):
+        inputs = [TxIn(rnd.randbytes(32), rnd.randrange(4), b"", 0xfffffffd,
+                       [rnd.randbytes(71), b"\x02" + rnd.randbytes(32)]) for _ in range(rnd.randrange(1, 4))]
+        outputs = [TxOut(rnd.randrange(1, 10 ** 9), b"\x00\x14" + rnd.randbytes(20))
+                   for _ in range(rnd.randrange(1, 4))]
+        tx = Transaction(2, inputs, outputs)
+        decoded = tx.to_dict()
+        decoded["fee"] = rnd.randrange(1, 10 ** 5) / 1e8
+        decoded["hex"] = tx.serialize().hex()
+        txs.append(decoded)
+    block = {"hash": rnd.randbytes(32).hex(), "confirmations": 10, "height": height, "version": 536870912,
+             "versionHex": "20000000", "merkleroot": rnd.randbytes(32).hex(), "time": 1631000000,
+             "mediantime": 1631000000, "nonce": 1, "bits": "170e92aa", "difficulty": 18415156832118.24,
+             "chainwork": rnd.randbytes(32).hex(), "nTx": n_tx, "previousblockhash": rnd.randbytes(32).hex(),
+             "strippedsize": 900000, "size": 1300000, "weight": 3993000, "tx": txs}
+    return json.dumps(block).encode()
+
+
+def fake_unspent(rnd: random.Random, n_utxo: int) -> bytes:
+    # a wallet's outputs pay to a smaller set of addresses, each with its own descriptor
+    scripts = [(b"\x00\x14" + rnd.randbytes(20), rnd.randbytes(32).hex()) for _ in range(max(n_utxo // 20, 1))]
+    entries = []
+    for _ in range(n_utxo):
+        script, pubkey = rnd.choice(scripts)
+        entries.append({"txid": rnd.randbytes(32).hex(), "vout": rnd.randrange(4),
+                        "address": script_address(script), "label": "", "scriptPubKey": script.hex(),
+                        "amount": rnd.randrange(1, 10 ** 9) / 1e8, "confirmations": rnd.randrange(1, 10 ** 5),
+                        "spendable": True, "solvable": True,
+                        "desc": "wpkh([d34db33f/84'/0'/0'/0/1]02" + pubkey + ")#abcdefgh",
+                        "parent_descs": [], "safe": True})
+    return json.dumps(entries).encode()
+
+
+def held(build) -> (object, int):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def compare(label: str, payloads: list, to_model):
+    dicts, dict_bytes = held(lambda: [json.loads(payload) for payload in payloads])
+    models, model_bytes = held(lambda: [to_model(json.loads(payload)) for payload in payloads])
+    assert [model.to_dict() for model in models] == dicts, "to_dict differs from the decoded result"
+    print("{:<28}{:>10.1f} MB dicts {:>10.1f} MB models  {:.1f}x smaller".format(
+        label, dict_bytes / 1e6, model_bytes / 1e6, dict_bytes / model_bytes))
+
+
+def main():
+    n_blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    n_utxo = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    rnd = random.Random(0)
+    blocks = [fake_block(rnd, 700000 + i, 500) for i in range(n_blocks)]
+    compare("{} blocks of 500 txs".format(n_blocks), blocks, BlockModel.from_dict)
+    compare("{} utxos".format(n_utxo), [fake_unspent(rnd, n_utxo)], UtxoSet)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Blocks/sec of the process pool pipeline against parsing in the calling process, for 1 to n processes.
+Throughput grows with the number of cores until the copy into shared memory in the calling process dominates.
+usage: python benchmarks/bench_pipeline.py [n_blocks] [txs_per_block]
+"""
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from btc.block import Block
+from btc.pipeline import BlockPipeline, block_summary
+from btc.transaction import Transaction, TxIn, TxOut, write_varint
+
+
+def fake_blocks(rnd: random.Random, n_blocks: int, txs_per_block: int) -> list:
+    blocks = []
+    for height in range(n_blocks):
+        txs = [Transaction(2, [TxIn(rnd.randbytes(32), rnd.randrange(4), b"", 0xfffffffd,
+                                    [rnd.randbytes(71), b"\x02" + rnd.randbytes(32)]) for _ in range(2)],
+                           [TxOut(rnd.randrange(10 ** 4, 10 ** 8), b"\x00\x14" + rnd.randbytes(20)) for _ in range(2)])
+               for _ in range(txs_per_block)]
+        header = struct.pack("<i32s32sIII", 4, rnd.randbytes(32), bytes(32), 0, 0, height)
+        blocks.append((height, header + write_varint(len(txs)) + b"".join(tx.serialize() for tx in txs)))
+    return blocks
+
+
+def main():
+    n_blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    txs_per_block = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    blocks = fake_blocks(random.Random(0), n_blocks, txs_per_block)
+    start = time.perf_counter()
+    for height, raw in blocks:
+        block_summary(Block(raw), height)
+    print("{:<14}{:>8.1f} blocks/s".format("in process", n_blocks / (time.perf_counter() - start)))
+    processes = 1
+    while processes <= (os.cpu_count() or 1):
+        pipeline = BlockPipeline(extract=block_summary, processes=processes)
+        start = time.perf_counter()
+        for _ in pipeline.map(blocks):
+            pass
+        print("{:<14}{:>8.1f} blocks/s".format("{} processes".format(processes),
+                                               n_blocks / (time.perf_counter() - start)))
+        processes *= 2
+
+
+if __name__ == "__main__":
+    main()
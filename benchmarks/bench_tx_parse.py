@@ -0,0 +1,77 @@
+"""
+Throughput of the local transaction parser in txs/sec.
+With BITCOIN_RPC_USER and BITCOIN_RPC_PASSWORD set (and optionally BITCOIN_HTTP_PROVIDER_URI), the transactions
+of the node's best block are used instead of synthetic ones, and every local decode is compared with the node's
+decoderawtransaction output.
+usage: python benchmarks/bench_tx_parse.py [n_tx]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from btc.transaction import Transaction, TxIn, TxOut
+
+
+def fake_transactions(n_tx: int) -> list:
+    rnd = random.Random(0)
+    txs = []
+    for _ in range(n_tx):
+        inputs = [TxIn(rnd.randbytes(32), rnd.randrange(4), b"", 0xfffffffd,
+                       [rnd.randbytes(71), b"\x02" + rnd.randbytes(32)]) for _ in range(rnd.randrange(1, 4))]
+        outputs = [TxOut(rnd.randrange(1, 10 ** 9), b"\x00\x14" + rnd.randbytes(20))
+                   for _ in range(rnd.randrange(1, 4))]
+        txs.append(Transaction(2, inputs, outputs).serialize().hex())
+    return txs
+
+
+def node_transactions():
+    from btc.bitcoin import BitCoin
+    bitcoin = BitCoin(BitCoin.HttpProvider(os.environ["BITCOIN_RPC_USER"], os.environ["BITCOIN_RPC_PASSWORD"]))
+    network = {"main": "main", "test": "test", "testnet4": "testnet4", "signet": "signet",
+               "regtest": "regtest"}[bitcoin.chain.get_block_chain_info()["chain"]]
+    block = bitcoin.chain.get_block(bitcoin.chain.get_latest_block_hash(), 2)
+    return bitcoin, network, [tx["hex"] for tx in block["tx"]]
+
+
+def validate(bitcoin, network: str, txs: list):
+    mismatches = 0
+    for hex_string in txs:
+        local = Transaction.parse(hex_string).to_dict(network)
+        remote = bitcoin.raw.decode_raw_transaction(hex_string)
+        if local != remote:
+            mismatches += 1
+            if mismatches <= 3:
+                print("mismatch", local["txid"])
+                for key in remote:
+                    if local.get(key) != remote[key]:
+                        print("  {}: local={!r} node={!r}".format(key, local.get(key), remote[key]))
+    print("validated {} txs against the node, {} mismatches".format(len(txs), mismatches))
+
+
+def rate(label: str, func, txs: list):
+    start = time.perf_counter()
+    for hex_string in txs:
+        func(hex_string)
+    elapsed = time.perf_counter() - start
+    print("{:<28}{:>12,.0f} txs/sec".format(label, len(txs) / elapsed))
+
+
+def main():
+    if "BITCOIN_RPC_USER" in os.environ:
+        bitcoin, network, txs = node_transactions()
+        validate(bitcoin, network, txs)
+    else:
+        network = "main"
+        txs = fake_transactions(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
+    raw = [bytes.fromhex(hex_string) for hex_string in txs]
+    print("{} transactions".format(len(txs)))
+    rate("parse (bytes)", Transaction.parse, raw)
+    rate("parse + txid + wtxid", lambda data: (lambda tx: (tx.txid, tx.wtxid))(Transaction.parse(data)), raw)
+    rate("parse + to_dict (hex)", lambda data: Transaction.parse(data).to_dict(network), txs)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,5 +20,5 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     package_dir={"": "src"},
-    python_requires=">=3.6"
+    python_requires=">=3.8"
 )
@@ -0,0 +1,351 @@
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+from btc.block import block_transactions
+from btc.ecc import hash160
+from btc.follower import ChainEvent, CONNECT
+from btc.script import OP_RETURN, address_to_script
+
+"""
+Local address index: every scriptPubKey is keyed by its 20 bytes HASH160 and mapped to the outputs paying it
+and the inputs spending them, so history, balance and unspent outputs of an address are answered without the
+node's wallet (no importaddress and rescan).
+"""
+
+# an outpoint is stored as tx number << VOUT_BITS | vout, a transaction has less than 2^20 outputs
+VOUT_BITS = 20
+
+_SPEND = 1
+
+
+def script_key(script: Union[bytes, memoryview]) -> bytes:
+    """
+    Key of a scriptPubKey in the index
+    :param script:
+    :return: 20 bytes HASH160 of the script
+    """
+    return hash160(bytes(script))
+
+
+def pack_varints(values: Iterable[int]) -> bytes:
+    """
+    LEB128 encoding of non negative integers, 7 bits per byte
+    """
+    out = bytearray()
+    for value in values:
+        while value > 0x7f:
+            out.append(value & 0x7f | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def unpack_varints(data: bytes) -> Iterator[int]:
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        yield value
+        value = 0
+        shift = 0
+
+
+def _encode_postings(entries: List[Tuple[int, int, int, int, int]], base: int) -> bytes:
+    # entry: (tx number, vout, spend flag, value, funding tx number), tx numbers as deltas from the previous entry
+    values = []
+    previous = base
+    for tx_num, vout, spend, value, funding in entries:
+        values += (tx_num - previous, vout << 1 | spend, value)
+        if spend:
+            values.append(tx_num - funding)
+        previous = tx_num
+    return pack_varints(values)
+
+
+def _decode_postings(data: bytes, base: int) -> Iterator[Tuple[int, int, int, int, int]]:
+    values = unpack_varints(data)
+    tx_num = base
+    for delta in values:
+        tx_num += delta
+        flags = next(values)
+        value = next(values)
+        spend = flags & _SPEND
+        funding = tx_num - next(values) if spend else tx_num
+        yield tx_num, flags >> 1, spend, value, funding
+
+
+class AddressIndex:
+    """
+        Address (scriptPubKey) index built from blocks in chain order, from getblock verbosity 0 or 2 results
+        or ChainEvent of a ChainFollower (see attach).
+        History is stored in ``history`` rows keyed by (HASH160 of the script, height) whose value is a varint
+        packed list of postings: the outputs paying the script and the inputs spending them, with their
+        value. Transactions are numbered in chain order, ``txs`` maps numbers to txids. Unspent outputs are kept
+        in ``utxos`` to resolve the scripts of inputs, the spends recorded in the history are enough to undo a
+        block: the keys a block touched are kept for the last ``undo_depth`` blocks, which can be disconnected.
+        Outputs created before the first indexed block are unknown, their spends are not recorded.
+        :param path: sqlite database file, created if missing
+        :param network: chain of the addresses given to the lookups, "main", "test", "signet" or "regtest"
+        :param undo_depth: number of recent blocks that can be disconnected by a reorg
+    """
+
+    def __init__(self, path: str, network: str = "main", undo_depth: int = 100):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.network = network
+        self.undo_depth = undo_depth
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS blocks (
+                height INTEGER PRIMARY KEY, hash TEXT NOT NULL, first_tx INTEGER NOT NULL, keys BLOB);
+            CREATE TABLE IF NOT EXISTS txs (num INTEGER PRIMARY KEY, txid BLOB NOT NULL);
+            CREATE INDEX IF NOT EXISTS txs_txid ON txs (txid);
+            CREATE TABLE IF NOT EXISTS utxos (outpoint INTEGER PRIMARY KEY, key BLOB NOT NULL, value INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS history (
+                key BLOB NOT NULL, height INTEGER NOT NULL, postings BLOB NOT NULL,
+                PRIMARY KEY (key, height)) WITHOUT ROWID;
+        """)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def tip(self) -> Union[Tuple[int, str], None]:
+        """
+        (height, hash) of the last indexed block
+        """
+        with self._lock:
+            row = self._db.execute("SELECT height, hash FROM blocks ORDER BY height DESC LIMIT 1").fetchone()
+        return tuple(row) if row else None
+
+    def _next_tx_num(self) -> int:
+        row = self._db.execute("SELECT MAX(num) FROM txs").fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def _find_tx(self, txid: bytes) -> Union[int, None]:
+        # the latest of duplicated txids (BIP30) is the spendable one
+        row = self._db.execute("SELECT MAX(num) FROM txs WHERE txid = ?", (txid,)).fetchone()
+        return row[0]
+
+    def _connect(self, block: Any, height: int = None):
+        block_hash, previous, block_height, txs = block_transactions(block)
+        height = block_height if height is None else height
+        tip = self.tip
+        if tip is not None:
+            if height != tip[0] + 1:
+                raise ValueError("block {} at height {} does not follow the index tip {}".format(
+                    block_hash, height, tip[0]))
+            if previous is not None and previous != tip[1]:
+                raise ValueError("block {} does not extend the index tip {}".format(block_hash, tip[1]))
+        elif height is None:
+            raise ValueError("height of block {} is unknown".format(block_hash))
+        first = self._next_tx_num()
+        # postings of the block by script key, outputs created in this block by outpoint
+        postings = {}
+        created = {}
+        block_txs = {}
+        for tx_num, (txid, inputs, outputs) in enumerate(txs, first):
+            for prev_txid, vout in inputs:
+                funding = block_txs.get(prev_txid)
+                if funding is None:
+                    funding = self._find_tx(prev_txid)
+                    if funding is None:
+                        continue
+                outpoint = funding << VOUT_BITS | vout
+                spent = created.pop(outpoint, None)
+                if spent is None:
+                    row = self._db.execute("SELECT key, value FROM utxos WHERE outpoint = ?", (outpoint,)).fetchone()
+                    if row is None:
+                        continue
+                    self._db.execute("DELETE FROM utxos WHERE outpoint = ?", (outpoint,))
+                    spent = (bytes(row[0]), row[1])
+                key, value = spent
+                postings.setdefault(key, []).append((tx_num, vout, _SPEND, value, funding))
+            for vout, (value, script) in enumerate(outputs):
+                if script[:1] == bytes([OP_RETURN]):
+                    continue
+                key = script_key(script)
+                created[tx_num << VOUT_BITS | vout] = (key, value)
+                postings.setdefault(key, []).append((tx_num, vout, 0, value, tx_num))
+            block_txs[txid] = tx_num
+        self._db.executemany("INSERT INTO txs VALUES (?, ?)", [(num, txid) for txid, num in block_txs.items()])
+        self._db.executemany("INSERT INTO utxos VALUES (?, ?, ?)",
+                             [(outpoint, key, value) for outpoint, (key, value) in created.items()])
+        self._db.executemany("INSERT INTO history VALUES (?, ?, ?)",
+                             [(key, height, _encode_postings(entries, first)) for key, entries in postings.items()])
+        self._db.execute("INSERT INTO blocks VALUES (?, ?, ?, ?)", (height, block_hash, first, b"".join(postings)))
+        self._db.execute("UPDATE blocks SET keys = NULL WHERE height = ?", (height - self.undo_depth,))
+
+    def connect_block(self, block: Any, height: int = None):
+        """
+        Index the block following the tip
+        :param block: getblock result of verbosity 0 (hex) or 2, raw bytes or a Block
+        :param height: height of the block, required for raw blocks unless the index is not empty
+        :return:
+        """
+        self.connect_blocks([(block, height)])
+
+    def connect_blocks(self, blocks: Iterable[Tuple[Any, int]], commit_every: int = 100) -> int:
+        """
+        Index consecutive blocks, committing every ``commit_every`` blocks
+        :param blocks: (block, height) pairs, see connect_block
+        :param commit_every:
+        :return: number of blocks indexed
+        """
+        count = 0
+        with self._lock:
+            try:
+                for block, height in blocks:
+                    if height is None and self.tip is not None:
+                        height = self.tip[0] + 1
+                    self._connect(block, height)
+                    count += 1
+                    if count % commit_every == 0:
+                        self._db.commit()
+            except BaseException:
+                # the current block may be half written
+                self._db.rollback()
+                raise
+            self._db.commit()
+        return count
+
+    def disconnect_from(self, height: int):
+        """
+        Remove the blocks from ``height`` on after a reorg, the outputs they spent are unspent again
+        :param height:
+        :return:
+        """
+        with self._lock:
+            with self._db:
+                row = self._db.execute("SELECT MIN(first_tx) FROM blocks WHERE height >= ?", (height,)).fetchone()
+                first = row[0]
+                if first is None:
+                    return
+                restored = []
+                for row_height, base, keys in self._db.execute(
+                        "SELECT height, first_tx, keys FROM blocks WHERE height >= ?", (height,)).fetchall():
+                    if keys is None:
+                        raise ValueError("block {} is deeper than the undo depth {}".format(
+                            row_height, self.undo_depth))
+                    for i in range(0, len(keys), 20):
+                        key = bytes(keys[i:i + 20])
+                        data = self._db.execute("SELECT postings FROM history WHERE key = ? AND height = ?",
+                                                (key, row_height)).fetchone()[0]
+                        for tx_num, vout, spend, value, funding in _decode_postings(data, base):
+                            if spend and funding < first:
+                                restored.append((funding << VOUT_BITS | vout, key, value))
+                        self._db.execute("DELETE FROM history WHERE key = ? AND height = ?", (key, row_height))
+                self._db.execute("DELETE FROM utxos WHERE outpoint >= ?", (first << VOUT_BITS,))
+                self._db.executemany("INSERT INTO utxos VALUES (?, ?, ?)", restored)
+                self._db.execute("DELETE FROM txs WHERE num >= ?", (first,))
+                self._db.execute("DELETE FROM blocks WHERE height >= ?", (height,))
+
+    def apply(self, event: ChainEvent):
+        """
+        Apply a ChainFollower event, the follower must use verbosity 0 or 2
+        :param event:
+        :return:
+        """
+        if event.kind == CONNECT:
+            self.connect_block(event.block, event.height)
+        else:
+            self.disconnect_from(event.height)
+
+    def attach(self, follower):
+        """
+        Keep the index up to date with the events of a ChainFollower (poll or a notification callback)
+        :param follower:
+        :return:
+        """
+        follower.on_connect(self.apply)
+        follower.on_disconnect(self.apply)
+
+    def _key(self, address_or_script: Union[str, bytes]) -> bytes:
+        if isinstance(address_or_script, str):
+            return script_key(address_to_script(address_or_script, self.network))
+        return script_key(address_or_script)
+
+    def _postings(self, address_or_script: Union[str, bytes]) -> Iterator[Tuple[int, int, int, int, int, int]]:
+        # (height, tx number, vout, spend flag, value, funding tx number) in chain order
+        with self._lock:
+            rows = self._db.execute("SELECT h.height, b.first_tx, h.postings FROM history h "
+                                    "JOIN blocks b ON b.height = h.height WHERE h.key = ? ORDER BY h.height",
+                                    (self._key(address_or_script),)).fetchall()
+        for height, base, data in rows:
+            for entry in _decode_postings(data, base):
+                yield (height,) + entry
+
+    def _txids(self, tx_nums: Iterable[int]) -> Dict[int, str]:
+        tx_nums = list(set(tx_nums))
+        out = {}
+        with self._lock:
+            # keep under the default limit of sqlite host parameters
+            for start in range(0, len(tx_nums), 500):
+                chunk = tx_nums[start:start + 500]
+                query = "SELECT num, txid FROM txs WHERE num IN ({})".format(",".join("?" * len(chunk)))
+                for num, txid in self._db.execute(query, chunk):
+                    out[num] = bytes(txid)[::-1].hex()
+        return out
+
+    def history(self, address_or_script: Union[str, bytes]) -> List[dict]:
+        """
+        Confirmed transactions paying or spending from an address, in chain order
+        :param address_or_script: address or scriptPubKey bytes
+        :return: [{"txid", "height", "received", "sent"}], amounts in satoshis
+        """
+        entries = list(self._postings(address_or_script))
+        txids = self._txids(entry[1] for entry in entries)
+        out = []
+        for height, tx_num, vout, spend, value, funding in entries:
+            if not out or out[-1][0] != tx_num:
+                out.append((tx_num, {"txid": txids[tx_num], "height": height, "received": 0, "sent": 0}))
+            out[-1][1]["sent" if spend else "received"] += value
+        return [item for _, item in out]
+
+    def unspent(self, address_or_script: Union[str, bytes]) -> List[dict]:
+        """
+        Confirmed unspent outputs of an address
+        :param address_or_script: address or scriptPubKey bytes
+        :return: [{"txid", "vout", "height", "value"}], value in satoshis
+        """
+        funded = {}
+        for height, tx_num, vout, spend, value, funding in self._postings(address_or_script):
+            if spend:
+                funded.pop((funding, vout), None)
+            else:
+                funded[(tx_num, vout)] = (height, value)
+        txids = self._txids(tx_num for tx_num, _ in funded)
+        return [{"txid": txids[tx_num], "vout": vout, "height": height, "value": value}
+                for (tx_num, vout), (height, value) in funded.items()]
+
+    def balance(self, address_or_script: Union[str, bytes]) -> dict:
+        """
+        Confirmed balance of an address
+        :param address_or_script: address or scriptPubKey bytes
+        :return: {"received", "sent", "balance", "tx_count"}, amounts in satoshis
+        """
+        received = sent = 0
+        tx_nums = set()
+        for height, tx_num, vout, spend, value, funding in self._postings(address_or_script):
+            if spend:
+                sent += value
+            else:
+                received += value
+            tx_nums.add(tx_num)
+        return {"received": received, "sent": sent, "balance": received - sent, "tx_count": len(tx_nums)}
@@ -0,0 +1,293 @@
+import asyncio
+import inspect
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Tuple
+from btc.async_providers import AsyncHttpProvider
+from btc.block import Block
+from btc.chain import Chain
+from btc.spv import HeaderChain
+from btc.store import BlockStore
+from btc.wallet import SinceBlockCursor, Wallet, _entry_key, _new_entries
+from btc.raw_transaction import Raw
+from btc.utils import Utils
+from btc.rpc_abi import RPC
+from btc.types_btc import RPCEndpoint
+
+"""
+The plain helpers of Chain, Wallet, Raw and Utils return what the provider's make_request returns,
+with AsyncHttpProvider that is a coroutine, so the same classes are reused and their methods are awaitable.
+The helpers which post-process the node result, read the BlockStore, answer locally or send batch requests
+are overridden here as coroutines (or async generators for the iterators).
+"""
+
+
+async def _resolve(value: Any) -> Any:
+    # result of a helper that answers locally or calls the node depending on its arguments
+    return await value if inspect.isawaitable(value) else value
+
+
+class AsyncChain(Chain):
+
+    async def get_block_hash(self, height: int):
+        if self._store is not None:
+            block_hash = self._store.get_block_hash(height)
+            if block_hash is not None:
+                return block_hash
+        return await self._provider.make_request(RPC.chain_getBlockHash, [height])
+
+    async def get_block(self, block_hash: str, verbosity: int):
+        if self._store is not None:
+            block = self._store.get_block(block_hash, verbosity, self._provider.codec)
+            if block is not None:
+                return block
+        block = await self._provider.make_request(RPC.chain_getBLock, [block_hash, verbosity])
+        if self._store is not None and isinstance(block, (str, dict)):
+            self._store.put_block(block_hash, verbosity, block)
+        return block
+
+    async def get_raw_block(self, block_hash: str) -> Block:
+        if self._store is not None:
+            payload = self._store.read_block_bytes(block_hash)
+            if payload is not None:
+                return Block(payload)
+        return Block(await self.get_block(block_hash, 0))
+
+    async def iter_blocks(self, start: int, stop: int, verbosity: int = 1, workers: int = 4,
+                          prefetch: int = None) -> AsyncIterator[Any]:
+        """
+        Async generator of the blocks of heights [start, stop) in height order, see Chain.iter_blocks.
+        At most ``workers`` getblock calls are in flight.
+        """
+        if prefetch is None:
+            prefetch = workers * 4
+        prefetch = max(prefetch, 1)
+        semaphore = asyncio.Semaphore(max(workers, 1))
+
+        async def fetch(block_hash):
+            async with semaphore:
+                return await self.get_block(block_hash, verbosity)
+
+        next_height = start
+        pending = deque()
+        try:
+            while True:
+                if next_height < stop and len(pending) <= prefetch // 2:
+                    heights = range(next_height, min(stop, next_height + prefetch - len(pending)))
+                    next_height = heights.stop
+                    responses = await self._provider.make_batch_request(
+                        [(RPC.chain_getBlockHash, [height]) for height in heights])
+                    for response in responses:
+                        pending.append(asyncio.ensure_future(fetch(response.result())))
+                if not pending:
+                    break
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_block_stats_many(self, hashes_or_heights: List[Any], stats: List[str] = None,
+                                   batch_size: int = 100) -> List[dict]:
+        out = []
+        for start in range(0, len(hashes_or_heights), batch_size):
+            chunk = hashes_or_heights[start:start + batch_size]
+            responses = await self._provider.make_batch_request(
+                [(RPC.chain_getBlockStats, [item] if stats is None else [item, stats]) for item in chunk])
+            out += [response.result() for response in responses]
+        return out
+
+    async def stats_range(self, start: int, stop: int, fields: List[str], batch_size: int = 100, cache=None,
+                          chunk: int = 1000):
+        out, fields, missing = self._stats_from_cache(start, stop, fields, cache)
+        tip = await self.get_block_count() if cache is not None and missing else None
+        requested = fields + [field for field in ("height", "blockhash") if field not in fields]
+        for offset in range(0, len(missing), chunk):
+            stats = await self.get_block_stats_many(list(missing[offset:offset + chunk]), requested, batch_size)
+            if cache is not None:
+                cache.put(stats, fields, tip)
+            self._fill_stats(out, start, fields, stats)
+        return out
+
+    async def verify_tx_out_proof(self, proof: str, headers: HeaderChain = None):
+        return await _resolve(super(AsyncChain, self).verify_tx_out_proof(proof, headers))
+
+
+class AsyncSinceBlockCursor(SinceBlockCursor):
+
+    async def next(self) -> Tuple[List[dict], List[dict]]:
+        result = await self._fetch(self.block_hash)
+        self.block_hash = result["lastblock"]
+        return result["transactions"], result.get("removed", [])
+
+    async def follow(self, interval: float = 5.0) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        Async generator of new entries, see SinceBlockCursor.follow
+        """
+        seen = set()
+        pending = asyncio.ensure_future(self._fetch(self.block_hash))
+        try:
+            while True:
+                result = await pending
+                self.block_hash = result["lastblock"]
+                new, seen = _new_entries(result, seen)
+                if not new:
+                    await asyncio.sleep(interval)
+                pending = asyncio.ensure_future(self._fetch(self.block_hash))
+                for item in new:
+                    yield item
+        finally:
+            pending.cancel()
+
+
+class AsyncWallet(Wallet):
+
+    async def dump_wallet(self, wallet: str, filename: str) -> str:
+        """
+        Dumps all wallet keys in a human-readable format to a server-side file. This does not allow overwriting existing files.
+        :param filename:
+        :param wallet
+        :return: Absolute path of dumpfile
+        """
+        resp = await self._provider.make_request(RPC.wallet_dumpWallet, [filename], wallet)
+        return resp.get("filename")
+
+    async def fan_out(self, wallets: List[str], calls: List[Tuple[RPCEndpoint, Any]],
+                      max_workers: int = 8) -> Tuple[Dict[str, list], Dict[str, Exception]]:
+        semaphore = asyncio.Semaphore(max(1, max_workers))
+
+        async def query(wallet):
+            async with semaphore:
+                responses = await self._provider.make_batch_request(calls, wallet)
+            return [response.result() for response in responses]
+
+        outcomes = await asyncio.gather(*[query(wallet) for wallet in wallets], return_exceptions=True)
+        results = {}
+        errors = {}
+        for wallet, outcome in zip(wallets, outcomes):
+            if isinstance(outcome, Exception):
+                errors[wallet] = outcome
+            else:
+                results[wallet] = outcome
+        return results, errors
+
+    async def get_balances(self, wallets: List[str], dummy: str = "*", min_conf: int = 0,
+                           include_watch_only: bool = False,
+                           max_workers: int = 8) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+        results, errors = await self.fan_out(
+            wallets, [(RPC.wallet_getBalance, [dummy, min_conf, include_watch_only])], max_workers)
+        return self._first_results(results), errors
+
+    async def list_unspent_many(self, wallets: List[str], min_conf: int = 1, max_conf: int = 9999999,
+                                addresses: list = [], include_unsafe: bool = True, query_options: dict = None,
+                                max_workers: int = 8) -> Tuple[List[dict], Dict[str, Exception]]:
+        results, errors = await self.fan_out(
+            wallets, [(RPC.wallet_listUnspent, [min_conf, max_conf, addresses, include_unsafe, query_options])],
+            max_workers)
+        return self._merge_unspent(self._first_results(results)), errors
+
+    async def iter_transactions(self, wallet: str, page_size: int = 1000, label: str = "*",
+                                include_watch_only: bool = False) -> AsyncIterator[dict]:
+        """
+        Async generator of every list_transactions entry, see Wallet.iter_transactions
+        """
+        def fetch(skip):
+            return asyncio.ensure_future(self._provider.make_request(
+                RPC.wallet_listTransactions, [label, page_size, skip, include_watch_only], wallet))
+
+        seen = set()
+        skip = 0
+        page = fetch(0)
+        try:
+            while True:
+                entries = await page
+                skip += page_size
+                if len(entries) == page_size:
+                    page = fetch(skip)
+                keys = set()
+                for entry in reversed(entries):
+                    key = _entry_key(entry)
+                    keys.add(key)
+                    if key not in seen:
+                        yield entry
+                seen = keys
+                if len(entries) < page_size:
+                    return
+        finally:
+            page.cancel()
+
+    def since_block_cursor(self, wallet: str, block_hash: str = None, target_confirmations: int = 1,
+                           include_watch_only: bool = False, include_removed: bool = True) -> AsyncSinceBlockCursor:
+        return AsyncSinceBlockCursor(self, wallet, block_hash, target_confirmations, include_watch_only,
+                                     include_removed)
+
+
+class AsyncRaw(Raw):
+
+    async def get_raw_transaction(self, tx_id: str) -> str:
+        if self._store is not None:
+            hex_string = self._store.get_transaction(tx_id)
+            if hex_string is not None:
+                return hex_string
+        hex_string = await self._provider.make_request(RPC.raw_getRawTransaction, [tx_id])
+        if self._store is not None and isinstance(hex_string, str):
+            self._store.put_transaction(tx_id, hex_string)
+        return hex_string
+
+    async def decode_raw_transaction(self, tran_info_hex: str, local: bool = False, network: str = "main") -> dict:
+        return await _resolve(super(AsyncRaw, self).decode_raw_transaction(tran_info_hex, local, network))
+
+    async def create_raw_transaction(self, inputs: list, outputs: list, lock_time: int = 0,
+                                     replaceable: bool = False, local: bool = False, network: str = "main"):
+        return await _resolve(super(AsyncRaw, self).create_raw_transaction(
+            inputs, outputs, lock_time, replaceable, local, network))
+
+    async def combine_raw_transaction(self, transactions: [str], local: bool = False) -> str:
+        return await _resolve(super(AsyncRaw, self).combine_raw_transaction(transactions, local))
+
+    async def sign_raw_transaction(self, hex_string: str, private_keys: list, prev_txs: list,
+                                   sign_hash_type: str = "ALL", local: bool = False):
+        return await _resolve(super(AsyncRaw, self).sign_raw_transaction(
+            hex_string, private_keys, prev_txs, sign_hash_type, local))
+
+
+class AsyncUtils(Utils):
+
+    async def validate_address(self, address: str) -> bool:
+        res = await self._provider.make_request(RPC.util_validateAddress, [address])
+        return res.get("isvalid")
+
+
+class AsyncBitCoin:
+    HttpProvider = AsyncHttpProvider
+
+    def __init__(self, provider: AsyncHttpProvider, store: BlockStore = None):
+        self.provider = provider
+        self.store = store
+        self._wallet = AsyncWallet(self)
+        self._chain = AsyncChain(self)
+        self._raw = AsyncRaw(self)
+        self._utils = AsyncUtils(self)
+
+    @property
+    def wallet(self):
+        return self._wallet
+
+    @property
+    def chain(self):
+        return self._chain
+
+    @property
+    def raw(self):
+        return self._raw
+
+    @property
+    def utils(self):
+        return self._utils
+
+    async def close(self):
+        await self.provider.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -0,0 +1,118 @@
+from typing import Any, Union, Iterable, List, Tuple
+import os
+import asyncio
+import aiohttp
+from btc.cache import RPCCache
+from btc.providers import JSONBaseProvider, BatchResponse
+from btc.rpc_abi import IDEMPOTENT_METHODS
+from btc.types_btc import RPCEndpoint
+
+
+class AsyncHttpProvider(JSONBaseProvider):
+    """
+        An asyncio HTTP Provider for API request, make_request is a coroutine.
+        Connections are kept alive and reused, at most ``max_concurrency`` requests are in flight at the same time.
+        Like HttpProvider, idempotent methods are sent again on connection errors, timeouts and 502/503/504.
+        :param endpoint_uri: HTTP API URL base. Default value is ``"http://127.0.0.1:8332"``. Can also be configured via the ``BITCOIN_HTTP_PROVIDER_URI`` environment variable.
+        :param max_concurrency: Maximum number of in-flight requests (and open connections)
+        :param keepalive_timeout: Seconds an idle connection is kept open for reuse
+        :param json_backend: JSON decoder, "orjson", "ujson" or "json", default is the fastest installed one
+        :param amount_mode: "float", "decimal" or "satoshi", see encoding.get_json_backend
+        :param cache: optional RPCCache for the results of immutable calls
+        :param retries: Maximum number of retries of idempotent methods
+        :param backoff_factor: the n-th retry waits backoff_factor * 2 ** n seconds
+        :return:
+    """
+
+    def __init__(self, rpcuser: str, rpcpassword: str, endpoint_uri: Union[str, dict] = None,
+                 max_concurrency: int = 100, keepalive_timeout: float = 30, json_backend: str = None,
+                 amount_mode: str = "float", cache: RPCCache = None, retries: int = 3, backoff_factor: float = 0.2):
+        super(AsyncHttpProvider, self).__init__(json_backend, amount_mode, cache)
+        if endpoint_uri is None:
+            self.endpoint_uri = os.environ.get("BITCOIN_HTTP_PROVIDER_URI", "http://127.0.0.1:8332")
+        elif isinstance(endpoint_uri, (str,)):
+            self.endpoint_uri = endpoint_uri
+        else:
+            raise TypeError("unknown endpoint uri {}".format(endpoint_uri))
+
+        self.max_concurrency = max_concurrency
+        self.keepalive_timeout = keepalive_timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.auth = aiohttp.BasicAuth(rpcuser, rpcpassword)
+        self.sess = None
+        self._semaphore = None
+
+    async def _session(self) -> aiohttp.ClientSession:
+        # the session and semaphore are bound to the running loop, so they are created on first use
+        if self.sess is None or self.sess.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=self.keepalive_timeout)
+            self.sess = aiohttp.ClientSession(connector=connector, auth=self.auth,
+                                              headers={"Content-Type": "application/json"})
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.sess
+
+    async def _post(self, uri: str, payload: Any, timeout: int, retries: int = 0) -> bytes:
+        sess = await self._session()
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    async with sess.post(uri, json=payload, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                        # 503 is returned when the node's work queue is full
+                        if resp.status not in (502, 503, 504) or attempt >= retries:
+                            return await resp.read()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= retries:
+                    raise
+            # the semaphore is released while waiting
+            await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+            attempt += 1
+
+    async def make_request(self, method: RPCEndpoint, params: Any = None, rpcwallet: str = None,
+                           timeout: int = None) -> Any:
+        found, res = self.cache_lookup(method, params, rpcwallet)
+        if found:
+            return res
+        json_dict = self.encode_rpc_request(method, params)
+        retries = self.retries if method in IDEMPOTENT_METHODS else 0
+        body = await self._post(self.wallet_uri(rpcwallet), json_dict, self.request_timeout(method, timeout), retries)
+        res = self.decode_rpc_body(body)
+        self.cache_store(method, params, rpcwallet, res, len(body))
+        return res
+
+    async def make_batch_request(self, calls: Iterable[Tuple[RPCEndpoint, Any]], rpcwallet: str = None,
+                                 timeout: int = None) -> List[BatchResponse]:
+        """
+        Send many calls in one JSON-RPC array POST
+        :param calls: (method, params) pairs
+        :param rpcwallet: wallet endpoint used for all calls
+        :param timeout:
+        :return: BatchResponse list in the order of calls, call result() on each to get its result or error
+        """
+        responses = [BatchResponse(method, params, rpcwallet, timeout) for method, params in calls]
+        await self.send_batch(responses)
+        return responses
+
+    async def send_batch(self, responses: List[BatchResponse]):
+        async def send_group(rpcwallet, group):
+            payload, requests_by_id = self.encode_rpc_batch(group)
+            timeout = max(self.request_timeout(response.method, response.timeout) for response in group)
+            retries = self.retries if all(response.method in IDEMPOTENT_METHODS for response in group) else 0
+            body = await self._post(self.wallet_uri(rpcwallet), payload, timeout, retries)
+            self.decode_rpc_batch_body(body, requests_by_id)
+            self.cache_store_batch(group, len(body))
+
+        await asyncio.gather(*(send_group(rpcwallet, group)
+                               for rpcwallet, group in self.group_batch(self.resolve_cached(responses)).items()))
+
+    async def close(self):
+        if self.sess is not None:
+            await self.sess.close()
+            self.sess = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
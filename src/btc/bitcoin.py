@@ -3,6 +3,7 @@ from btc.chain import Chain
 from btc.wallet import Wallet
 from btc.raw_transaction import Raw
 from btc.utils import Utils
+from btc.store import BlockStore
 
 """
 reference:  https://developer.bitcoin.org/reference/rpc/
@@ -11,8 +12,9 @@ reference:  https://developer.bitcoin.org/reference/rpc/
 class BitCoin:
     HttpProvider = HttpProvider
 
-    def __init__(self, provider: HttpProvider):
+    def __init__(self, provider: HttpProvider, store: BlockStore = None):
         self.provider = provider
+        self.store = store
         self._wallet = Wallet(self)
         self._chain = Chain(self)
         self._raw = Raw(self)
@@ -34,4 +36,11 @@ class BitCoin:
     def utils(self):
         return self._utils
 
+    def batch(self):
+        """
+        Send all calls made inside the with block in one request, see HttpProvider.batch
+        :return:
+        """
+        return self.provider.batch()
+
 
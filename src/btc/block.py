@@ -0,0 +1,282 @@
+import struct
+from typing import Any, Iterator, List, Tuple, Union
+from btc.encoding import as_satoshi
+from btc.script import sha256d
+from btc.transaction import COINBASE_TXID, Transaction, TxOut, as_buffer, read_varint
+from btc.types_check import is_dict
+
+"""
+Lazy deserializer of raw (getblock verbosity 0) blocks, the header is decoded up front and transactions
+are only parsed when they are iterated, so callers that need a few transactions or only the outputs
+can skip the rest of the block.
+"""
+
+HEADER_SIZE = 80
+
+_unpack_header = struct.Struct("<i32s32sIII").unpack_from
+_unpack_u64 = struct.Struct("<Q").unpack_from
+
+
+def bits_to_target(bits: int) -> int:
+    exponent = bits >> 24
+    mantissa = bits & 0x007fffff
+    if exponent <= 3:
+        return mantissa >> (8 * (3 - exponent))
+    return mantissa << (8 * (exponent - 3))
+
+
+def bits_to_difficulty(bits: int) -> float:
+    # same arithmetic as GetDifficulty of the node
+    shift = (bits >> 24) & 0xff
+    difficulty = 0x0000ffff / (bits & 0x00ffffff)
+    while shift < 29:
+        difficulty *= 256.0
+        shift += 1
+    while shift > 29:
+        difficulty /= 256.0
+        shift -= 1
+    return difficulty
+
+
+def skip_transaction(buf: memoryview, offset: int) -> int:
+    """
+    Walk over a serialized transaction without building any object
+    :return: offset after the transaction
+    """
+    offset += 4
+    segwit = buf[offset] == 0 and buf[offset + 1] != 0
+    if segwit:
+        offset += 2
+    n_in, offset = read_varint(buf, offset)
+    for _ in range(n_in):
+        length, offset = read_varint(buf, offset + 36)
+        offset += length + 4
+    n_out, offset = read_varint(buf, offset)
+    for _ in range(n_out):
+        length, offset = read_varint(buf, offset + 8)
+        offset += length
+    if segwit:
+        for _ in range(n_in):
+            n_items, offset = read_varint(buf, offset)
+            for _ in range(n_items):
+                length, offset = read_varint(buf, offset)
+                offset += length
+    return offset + 4
+
+
+class BlockHeader:
+    __slots__ = ("version", "prev_block", "merkle_root", "time", "bits", "nonce", "raw", "_hash")
+
+    def __init__(self, version: int, prev_block: bytes, merkle_root: bytes, time: int, bits: int, nonce: int,
+                 raw: Union[bytes, memoryview] = None):
+        # prev_block and merkle_root are in serialization (little endian) order
+        self.version = version
+        self.prev_block = prev_block
+        self.merkle_root = merkle_root
+        self.time = time
+        self.bits = bits
+        self.nonce = nonce
+        self.raw = raw
+        self._hash = None
+
+    @classmethod
+    def parse(cls, data: Union[bytes, bytearray, memoryview, str], offset: int = 0) -> "BlockHeader":
+        buf = as_buffer(data)
+        if len(buf) < offset + HEADER_SIZE:
+            raise ValueError("block header is truncated")
+        return cls(*_unpack_header(buf, offset), raw=buf[offset:offset + HEADER_SIZE])
+
+    def serialize(self) -> bytes:
+        if self.raw is not None:
+            return bytes(self.raw)
+        return struct.pack("<i32s32sIII", self.version, self.prev_block, self.merkle_root, self.time, self.bits,
+                           self.nonce)
+
+    @property
+    def hash(self) -> str:
+        if self._hash is None:
+            self._hash = sha256d(self.raw if self.raw is not None else self.serialize())[::-1].hex()
+        return self._hash
+
+    @property
+    def target(self) -> int:
+        return bits_to_target(self.bits)
+
+    @property
+    def difficulty(self) -> float:
+        return bits_to_difficulty(self.bits)
+
+    def to_dict(self) -> dict:
+        """
+        The fields of getblockheader that can be derived from the header alone
+        :return:
+        """
+        out = {
+            "hash": self.hash,
+            "version": self.version,
+            "versionHex": "{:08x}".format(self.version & 0xffffffff),
+            "merkleroot": self.merkle_root[::-1].hex(),
+            "time": self.time,
+            "nonce": self.nonce,
+            "bits": "{:08x}".format(self.bits),
+            "difficulty": self.difficulty,
+        }
+        if self.prev_block != bytes(32):
+            out["previousblockhash"] = self.prev_block[::-1].hex()
+        return out
+
+
+class Block:
+    """
+        A raw block, the header and the transaction count are decoded on creation, transactions are parsed
+        from the underlying buffer as they are iterated and are views of it.
+        :param data: the block as bytes, memoryview (e.g. BlockStore.read_block_bytes) or hex string
+    """
+    __slots__ = ("header", "tx_count", "size", "_buf", "_tx_start", "_offsets")
+
+    def __init__(self, data: Union[bytes, bytearray, memoryview, str]):
+        buf = as_buffer(data)
+        self.header = BlockHeader.parse(buf)
+        if len(buf) <= HEADER_SIZE:
+            raise ValueError("block data is truncated")
+        self.tx_count, self._tx_start = read_varint(buf, HEADER_SIZE)
+        self.size = len(buf)
+        self._buf = buf
+        self._offsets = None
+
+    @property
+    def hash(self) -> str:
+        return self.header.hash
+
+    def __len__(self) -> int:
+        return self.tx_count
+
+    def iter_transactions(self, start: int = 0, stop: int = None) -> Iterator[Transaction]:
+        """
+        Parse and yield the transactions of index [start, stop), the ones before ``start`` are skipped
+        :param start:
+        :param stop:
+        :return:
+        """
+        stop = self.tx_count if stop is None else min(stop, self.tx_count)
+        buf = self._buf
+        try:
+            offset = self._offset_of(start)
+            for _ in range(start, stop):
+                tx, offset = Transaction.read(buf, offset)
+                yield tx
+        except (IndexError, struct.error):
+            raise ValueError("block data is truncated")
+
+    def __iter__(self) -> Iterator[Transaction]:
+        return self.iter_transactions()
+
+    def transaction(self, index: int) -> Transaction:
+        if not 0 <= index < self.tx_count:
+            raise IndexError("block has {} transactions".format(self.tx_count))
+        return next(self.iter_transactions(index, index + 1))
+
+    def coinbase(self) -> Transaction:
+        return self.transaction(0)
+
+    def iter_outputs(self) -> Iterator[Tuple[int, int, TxOut]]:
+        """
+        Yield the outputs of every transaction without building inputs or witnesses
+        :return: (transaction index, output index, output) tuples
+        """
+        buf = self._buf
+        offset = self._tx_start
+        try:
+            for index in range(self.tx_count):
+                offset += 4
+                segwit = buf[offset] == 0 and buf[offset + 1] != 0
+                if segwit:
+                    offset += 2
+                n_in, offset = read_varint(buf, offset)
+                for _ in range(n_in):
+                    length, offset = read_varint(buf, offset + 36)
+                    offset += length + 4
+                n_out, offset = read_varint(buf, offset)
+                for n in range(n_out):
+                    value = _unpack_u64(buf, offset)[0]
+                    length, offset = read_varint(buf, offset + 8)
+                    yield index, n, TxOut(value, buf[offset:offset + length])
+                    offset += length
+                if segwit:
+                    for _ in range(n_in):
+                        n_items, offset = read_varint(buf, offset)
+                        for _ in range(n_items):
+                            length, offset = read_varint(buf, offset)
+                            offset += length
+                offset += 4
+        except (IndexError, struct.error):
+            raise ValueError("block data is truncated")
+
+    def tx_offsets(self) -> List[int]:
+        """
+        Offsets of the transactions in the block, computed once by skipping over them
+        :return:
+        """
+        if self._offsets is None:
+            offsets = []
+            offset = self._tx_start
+            try:
+                for _ in range(self.tx_count):
+                    offsets.append(offset)
+                    offset = skip_transaction(self._buf, offset)
+            except (IndexError, struct.error):
+                raise ValueError("block data is truncated")
+            if offset != self.size:
+                raise ValueError("{} extra bytes after the last transaction".format(self.size - offset))
+            self._offsets = offsets
+        return self._offsets
+
+    def _offset_of(self, index: int) -> int:
+        if index == 0:
+            return self._tx_start
+        return self.tx_offsets()[index]
+
+    def txids(self) -> List[str]:
+        return [tx.txid for tx in self.iter_transactions()]
+
+    def merkle_root(self) -> bytes:
+        """
+        Merkle root of the transactions, in serialization order like header.merkle_root
+        :return:
+        """
+        level = [tx._stripped_hash() for tx in self.iter_transactions()]
+        while len(level) > 1:
+            if len(level) % 2:
+                level.append(level[-1])
+            level = [sha256d(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+        return level[0] if level else bytes(32)
+
+    def check_merkle_root(self) -> bool:
+        return self.merkle_root() == self.header.merkle_root
+
+
+def block_transactions(block: Any) -> Tuple[str, Union[str, None], Union[int, None], list]:
+    """
+    Spent outpoints and created outputs of a getblock result of verbosity 0 or 2, or of a Block, for indexes
+    that handle both the same way
+    :param block:
+    :return: (hash, previous hash, height or None, transactions), each transaction as
+        (txid in serialization order, [(previous txid, vout)], [(value, scriptPubKey)]), coinbase inputs excluded
+    """
+    if is_dict(block):
+        txs = []
+        for tx in block["tx"]:
+            inputs = [(bytes.fromhex(txin["txid"])[::-1], txin["vout"])
+                      for txin in tx["vin"] if "coinbase" not in txin]
+            outputs = [(as_satoshi(txout["value"]), bytes.fromhex(txout["scriptPubKey"]["hex"]))
+                       for txout in tx["vout"]]
+            txs.append((bytes.fromhex(tx["txid"])[::-1], inputs, outputs))
+        return block["hash"], block.get("previousblockhash"), block.get("height"), txs
+    if not isinstance(block, Block):
+        block = Block(block)
+    txs = []
+    for tx in block:
+        inputs = [(bytes(txin.prev_txid), txin.vout) for txin in tx.inputs if bytes(txin.prev_txid) != COINBASE_TXID]
+        outputs = [(txout.value, bytes(txout.script_pubkey)) for txout in tx.outputs]
+        txs.append((tx._stripped_hash(), inputs, outputs))
+    return block.hash, block.header.prev_block[::-1].hex(), None, txs
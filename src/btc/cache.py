@@ -0,0 +1,174 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Tuple
+from btc.rpc_abi import RPC
+from btc.store import CHAIN_DEPENDENT_KEYS
+from btc.types_btc import RPCEndpoint
+from btc.types_check import is_dict
+
+# methods whose result, for given params, never changes once deep enough in the chain
+CACHEABLE_METHODS = frozenset([
+    RPC.chain_getBlockHash,
+    RPC.chain_getBLock,
+    RPC.raw_getRawTransaction,
+    RPC.raw_decodeRawTransaction,
+])
+
+
+class RPCCache:
+    """
+        Read-through cache for immutable chain RPCs, used by a provider created with ``cache=RPCCache()``.
+        Blocks and transactions with at least ``safe_depth`` confirmations, raw blocks and transactions by hash
+        and decoded transactions are kept until evicted. Near-tip data and verbose results whose depth is unknown
+        (a verbose mempool transaction has no confirmations) expire after ``ttl`` seconds.
+        Like in a BlockStore, verbose blocks and transactions kept until evicted are stored without their
+        "confirmations" and "nextblockhash", which change as the chain grows, so cache hits return them without.
+        Entries are evicted in LRU order once their total size exceeds ``max_bytes``, the size of an entry is
+        the size of its JSON response. Entries tied to a height are dropped when a reorg is seen, either when
+        a block hash at a known height changes or through invalidate_from.
+        Cached results are shared between callers, they must not be modified.
+        :param max_bytes: LRU bound in bytes
+        :param ttl: seconds near-tip entries stay valid
+        :param safe_depth: confirmations from which a block is considered final
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, ttl: float = 30, safe_depth: int = 6):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.safe_depth = safe_depth
+        self.tip_height = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._hash_at_height = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cacheable(method: RPCEndpoint) -> bool:
+        return method in CACHEABLE_METHODS
+
+    @staticmethod
+    def key(method: RPCEndpoint, params: Any) -> Tuple[str, str]:
+        return method, json.dumps(params or [], sort_keys=True, default=str)
+
+    def get(self, method: RPCEndpoint, params: Any) -> Tuple[bool, Any]:
+        """
+        Look up a call
+        :param method:
+        :param params:
+        :return: (found, result)
+        """
+        key = self.key(method, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, size, expires, height = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, result
+                self._remove(key)
+            self.misses += 1
+            return False, None
+
+    def store(self, method: RPCEndpoint, params: Any, result: Any, size: int):
+        """
+        Observe the result of a call, keep it if it is cacheable
+        :param method:
+        :param params:
+        :param result:
+        :param size: size of the JSON response in bytes
+        :return:
+        """
+        with self._lock:
+            if method == RPC.chain_getBlockCount:
+                self._set_tip(result)
+                return
+            if method not in CACHEABLE_METHODS or result is None:
+                return
+            height = None
+            # hex results are the content of a hash and decoded transactions depend on the params only
+            final = not is_dict(result) or method == RPC.raw_decodeRawTransaction
+            if method == RPC.chain_getBlockHash:
+                height = params[0]
+                self._observe_block(height, result)
+                final = self.tip_height is not None and self.tip_height - height + 1 >= self.safe_depth
+            elif is_dict(result) and "confirmations" in result:
+                # verbose blocks and transactions carry confirmations (and nextblockhash) which change over time
+                confirmations = result["confirmations"]
+                height = result.get("height")
+                if height is not None and confirmations > 0:
+                    self._set_tip(height + confirmations - 1)
+                    self._observe_block(height, result.get("hash"))
+                final = confirmations >= self.safe_depth
+                if final:
+                    result = {key: value for key, value in result.items() if key not in CHAIN_DEPENDENT_KEYS}
+            expires = None if final else time.monotonic() + self.ttl
+            if size > self.max_bytes:
+                return
+            key = self.key(method, params)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, size, expires, height)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_from(self, height: int):
+        """
+        Drop every entry at or above ``height``, call it when a reorg disconnected blocks from that height
+        :param height: first height of the stale branch
+        :return:
+        """
+        with self._lock:
+            self._invalidate_from(height)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._hash_at_height.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.size,
+            }
+
+    def _set_tip(self, height: int):
+        if self.tip_height is not None and height < self.tip_height:
+            # the chain got shorter, blocks above the new tip were disconnected
+            self._invalidate_from(height + 1)
+        if height != self.tip_height:
+            # only near-tip heights can still be reorganized
+            for h in [h for h in self._hash_at_height if h <= height - self.safe_depth]:
+                del self._hash_at_height[h]
+        self.tip_height = height
+
+    def _observe_block(self, height: int, block_hash: str):
+        if self.tip_height is not None and height <= self.tip_height - self.safe_depth:
+            return
+        known = self._hash_at_height.get(height)
+        if known is not None and known != block_hash:
+            self._invalidate_from(height)
+        self._hash_at_height[height] = block_hash
+
+    def _invalidate_from(self, height: int):
+        stale = [key for key, entry in self._entries.items() if entry[3] is not None and entry[3] >= height]
+        for key in stale:
+            self._remove(key)
+        for h in [h for h in self._hash_at_height if h >= height]:
+            del self._hash_at_height[h]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.size -= entry[1]
@@ -1,11 +1,24 @@
 from btc.rpc_abi import RPC
-from typing import Any
+from btc.block import Block
+from btc.spv import HeaderChain
+from typing import Any, Iterator, List, Union
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# getblockstats statistics that are not integers
+STATS_DTYPES = {"blockhash": ("U64",), "feerate_percentiles": ("f8", (5,))}
 
 
 class Chain:
     def __init__(self, bitcoin):
         self._bitcoin = bitcoin
         self._provider = bitcoin.provider
+        self._store = getattr(bitcoin, "store", None)
 
     def get_block_count(self):
         """
@@ -26,25 +39,166 @@ class Chain:
         Get block hash via  height
         :return:
         """
+        if self._store is not None:
+            block_hash = self._store.get_block_hash(height)
+            if block_hash is not None:
+                return self._provider.resolved(RPC.chain_getBlockHash, [height], block_hash)
         return self._provider.make_request(RPC.chain_getBlockHash, [height])
 
     def get_block(self, block_hash: str, verbosity: int):
         """
         Get block data via  block hash
         :param block_hash:
-        :param verbosity: 1 or 2, if 1, returns an Object with information about block ‘hash’; if 2, returns an Object with information about block ‘hash’ and information about each transaction.
+        :param verbosity: 0, 1 or 2, if 0, returns a string that is serialized, hex-encoded data for block ‘hash’; if 1, returns an Object with information about block ‘hash’; if 2, returns an Object with information about block ‘hash’ and information about each transaction.
+        :return: a verbose block read from the BlockStore has no confirmations and nextblockhash
+        """
+        if self._store is not None:
+            block = self._store.get_block(block_hash, verbosity, self._provider.codec)
+            if block is not None:
+                return self._provider.resolved(RPC.chain_getBLock, [block_hash, verbosity], block)
+        block = self._provider.make_request(RPC.chain_getBLock, [block_hash, verbosity])
+        if self._store is not None and isinstance(block, (str, dict)):
+            self._store.put_block(block_hash, verbosity, block)
+        return block
+
+    def get_block_header(self, block_hash: str, verbose: bool = True):
+        """
+        Get block header via block hash
+        :param block_hash:
+        :param verbose: True for a json object, false for the hex-encoded 80 bytes header
+        :return: confirmations of the object is -1 when the block is not on the main chain
+        """
+        return self._provider.make_request(RPC.chain_getBlockHeader, [block_hash, verbose])
+
+    def get_raw_block(self, block_hash: str) -> Block:
+        """
+        Get a block with verbosity 0 and wrap it in a lazy Block, transactions are only parsed when iterated.
+        A stored block is read from the store's memory map without copying.
+        :param block_hash:
         :return:
         """
-        return self._provider.make_request(RPC.chain_getBLock, [block_hash, verbosity])
+        if self._store is not None:
+            payload = self._store.read_block_bytes(block_hash)
+            if payload is not None:
+                return self._provider.resolved(RPC.chain_getBLock, [block_hash, 0], Block(payload))
+        return self._provider.map_result(self.get_block(block_hash, 0), Block)
 
-    def get_block_states(self, hash_or_height: [int, str], state: Any = "all"):
+    def iter_blocks(self, start: int, stop: int, verbosity: int = 1, workers: int = 4,
+                    prefetch: int = None) -> Iterator[Any]:
+        """
+        Yield the blocks of heights [start, stop) strictly in height order.
+        Block hashes are looked up in batch requests and blocks are fetched by a pool of ``workers`` threads,
+        at most ``prefetch`` blocks are requested ahead of the consumer so memory stays flat on long ranges.
+        :param start: first height
+        :param stop: height after the last one
+        :param verbosity: see get_block
+        :param workers: number of threads fetching blocks
+        :param prefetch: size of the window of in-flight blocks, default is 4 * workers
+        :return:
+        """
+        if prefetch is None:
+            prefetch = workers * 4
+        prefetch = max(prefetch, 1)
+        next_height = start
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                while True:
+                    # refill once half of the window is consumed so hash lookups go in reasonably sized batches
+                    if next_height < stop and len(pending) <= prefetch // 2:
+                        heights = range(next_height, min(stop, next_height + prefetch - len(pending)))
+                        next_height = heights.stop
+                        responses = self._provider.make_batch_request(
+                            [(RPC.chain_getBlockHash, [height]) for height in heights])
+                        for response in responses:
+                            pending.append(pool.submit(self.get_block, response.result(), verbosity))
+                    if not pending:
+                        break
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def get_block_stats(self, hash_or_height: [int, str], stats: List[str] = None):
         """
         Get block statistic info via hash or height
         :param hash_or_height:
-        :param state: Statistical indicators
+        :param stats: names of the statistics to compute, all of them by default
+        :return:
+        """
+        params = [hash_or_height] if stats is None else [hash_or_height, stats]
+        return self._provider.make_request(RPC.chain_getBlockStats, params)
+
+    def get_block_states(self, hash_or_height: [int, str], state: Any = None):
+        """
+        Former name of get_block_stats, ``state="all"`` selects all the statistics
+        """
+        return self.get_block_stats(hash_or_height, None if state == "all" else state)
+
+    def get_block_stats_many(self, hashes_or_heights: List[Union[int, str]], stats: List[str] = None,
+                             batch_size: int = 100) -> List[dict]:
+        """
+        getblockstats of many blocks in batch requests
+        :param hashes_or_heights:
+        :param stats: names of the statistics to compute, all of them by default
+        :param batch_size: number of calls per batch request
+        :return: results in the order of hashes_or_heights
+        """
+        out = []
+        for start in range(0, len(hashes_or_heights), batch_size):
+            chunk = hashes_or_heights[start:start + batch_size]
+            responses = self._provider.make_batch_request(
+                [(RPC.chain_getBlockStats, [item] if stats is None else [item, stats]) for item in chunk])
+            out += [response.result() for response in responses]
+        return out
+
+    def stats_range(self, start: int, stop: int, fields: List[str], batch_size: int = 100, cache=None,
+                    chunk: int = 1000):
+        """
+        getblockstats of the blocks of heights [start, stop) as a numpy structured array, one column per statistic
+        plus "height", eg ``stats["totalfee"].sum()``.
+        Heights already in ``cache`` are read from it, the others are fetched in batch requests and the final ones
+        stored, so repeating a range only calls the node for the new blocks.
+        :param start: first height
+        :param stop: height after the last one
+        :param fields: names of the statistics, feerate_percentiles is a column of 5 values per block
+        :param batch_size: number of getblockstats calls per batch request
+        :param cache: BlockStatsStore
+        :param chunk: number of blocks fetched between two writes to the cache
         :return:
         """
-        return self._provider.make_request(RPC.chain_getBlockStates, [hash_or_height, state])
+        out, fields, missing = self._stats_from_cache(start, stop, fields, cache)
+        tip = self.get_block_count() if cache is not None and missing else None
+        requested = fields + [field for field in ("height", "blockhash") if field not in fields]
+        for offset in range(0, len(missing), chunk):
+            stats = self.get_block_stats_many(list(missing[offset:offset + chunk]), requested, batch_size)
+            if cache is not None:
+                cache.put(stats, fields, tip)
+            self._fill_stats(out, start, fields, stats)
+        return out
+
+    @staticmethod
+    def _stats_from_cache(start: int, stop: int, fields: List[str], cache) -> tuple:
+        # array of the range filled from the cache, fields without duplicates and heights to fetch
+        if np is None:
+            raise ImportError("stats_range requires numpy")
+        fields = [field for field in dict.fromkeys(fields) if field != "height"]
+        out = np.zeros(max(stop - start, 0), dtype=[("height", "i8")] +
+                       [(field,) + STATS_DTYPES.get(field, ("i8",)) for field in fields])
+        out["height"] = np.arange(start, start + len(out))
+        if cache is None:
+            return out, fields, range(start, stop)
+        for field in fields:
+            pairs = cache.read(start, stop, field)
+            if pairs:
+                out[field][[height - start for height, _ in pairs]] = [value for _, value in pairs]
+        return out, fields, cache.missing(start, stop, fields)
+
+    @staticmethod
+    def _fill_stats(out, start: int, fields: List[str], stats: List[dict]):
+        rows = np.fromiter((item["height"] - start for item in stats), dtype=np.int64, count=len(stats))
+        for field in fields:
+            out[field][rows] = [item[field] for item in stats]
 
     def get_block_chain_info(self):
         """
@@ -67,7 +221,10 @@ class Chain:
         :param block_hash:
         :return:
         """
-        return self._provider.make_request(RPC.chain_getBlockStates, [n_blocks, block_hash])
+        params = [n_blocks, block_hash]
+        while params and params[-1] is None:
+            params.pop()
+        return self._provider.make_request(RPC.chain_getChainTxStats, params)
 
     def get_difficulty(self):
         """
@@ -141,7 +298,7 @@ class Chain:
         Returns statistics about the unspent transaction output set.
         :return:
         """
-        return self._provider.make_request(RPC.chain_getTxOutSetInfo, [], None, 180)
+        return self._provider.make_request(RPC.chain_getTxOutSetInfo, [])
 
     def precious_block(self, block_hash: str):
         """
@@ -167,10 +324,13 @@ class Chain:
         """
         return self._provider.make_request(RPC.chain_verifyChain, [check_level, n_blocks])
 
-    def verify_tx_out_proof(self, proof: str):
+    def verify_tx_out_proof(self, proof: str, headers: HeaderChain = None):
         """
         Verifies that a proof points to a transaction in a block, returning the transaction it commits to and throwing an RPC error if the block is not in our best chain
         :param proof: The hex-encoded proof generated by get_tx_out_proof
+        :param headers: synced HeaderChain, the proof is then verified locally and InvalidProof is raised for a bad one
         :return:
         """
+        if headers is not None:
+            return headers.verify_tx_out_proof(proof)
         return self._provider.make_request(RPC.chain_verifyTxOutProof,[proof])
\ No newline at end of file
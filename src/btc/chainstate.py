@@ -0,0 +1,421 @@
+import os
+import sqlite3
+import struct
+import threading
+from typing import Any, Iterable, List, Tuple, Union
+from btc.block import block_transactions
+from btc.ecc import decode_point, encode_point
+from btc.encoding import from_satoshi
+from btc.follower import ChainEvent, CONNECT
+from btc.muhash import MuHash3072
+from btc.script import OP_CHECKSIG, OP_EQUAL, OP_EQUALVERIFY, OP_DUP, OP_HASH160, OP_RETURN, script_pub_key_to_dict
+from btc.transaction import read_varint, write_varint
+
+"""
+Local UTXO set maintained from connected and disconnected blocks, the local counterpart of gettxout and
+gettxoutsetinfo: lookups are sqlite reads and the set statistics (txouts, total_amount, bogosize and the
+MuHash3072 "muhash") are updated with every block instead of computed by a scan.
+"""
+
+MAX_SCRIPT_SIZE = 10000
+
+# compressed script types, 0 to 5 are the node's (see compressor.cpp), the segwit ones are added here
+P2PKH, P2SH, P2PK_EVEN, P2PK_ODD, P2PK_UNCOMPRESSED_EVEN, P2PK_UNCOMPRESSED_ODD, P2WPKH, P2WSH, P2TR, RAW = range(10)
+
+
+def compress_script(script: bytes) -> bytes:
+    """
+    Compact form of a scriptPubKey: a type byte followed by the hash or key for standard scripts
+    :param script:
+    :return:
+    """
+    size = len(script)
+    if size == 25 and script[:3] == bytes([OP_DUP, OP_HASH160, 20]) and \
+            script[23:] == bytes([OP_EQUALVERIFY, OP_CHECKSIG]):
+        return bytes([P2PKH]) + script[3:23]
+    if size == 23 and script[:2] == bytes([OP_HASH160, 20]) and script[22] == OP_EQUAL:
+        return bytes([P2SH]) + script[2:22]
+    if size == 35 and script[0] == 33 and script[1] in (2, 3) and script[34] == OP_CHECKSIG:
+        return bytes([P2PK_EVEN + script[1] - 2]) + script[2:34]
+    if size == 67 and script[0] == 65 and script[1] == 4 and script[66] == OP_CHECKSIG:
+        try:
+            point = decode_point(script[1:66])
+        except ValueError:
+            point = None
+        if point is not None:
+            return bytes([P2PK_UNCOMPRESSED_EVEN + (point[1] & 1)]) + script[2:34]
+    if size == 22 and script[:2] == b"\x00\x14":
+        return bytes([P2WPKH]) + script[2:]
+    if size == 34 and script[:2] == b"\x00\x20":
+        return bytes([P2WSH]) + script[2:]
+    if size == 34 and script[:2] == b"\x51\x20":
+        return bytes([P2TR]) + script[2:]
+    return bytes([RAW]) + script
+
+
+def decompress_script(data: bytes) -> bytes:
+    kind = data[0]
+    payload = bytes(data[1:])
+    if kind == P2PKH:
+        return bytes([OP_DUP, OP_HASH160, 20]) + payload + bytes([OP_EQUALVERIFY, OP_CHECKSIG])
+    if kind == P2SH:
+        return bytes([OP_HASH160, 20]) + payload + bytes([OP_EQUAL])
+    if kind in (P2PK_EVEN, P2PK_ODD):
+        return bytes([33, kind]) + payload + bytes([OP_CHECKSIG])
+    if kind in (P2PK_UNCOMPRESSED_EVEN, P2PK_UNCOMPRESSED_ODD):
+        point = decode_point(bytes([kind - 2]) + payload)
+        return bytes([65]) + encode_point(point, False) + bytes([OP_CHECKSIG])
+    if kind == P2WPKH:
+        return b"\x00\x14" + payload
+    if kind == P2WSH:
+        return b"\x00\x20" + payload
+    if kind == P2TR:
+        return b"\x51\x20" + payload
+    return payload
+
+
+def outpoint_key(txid: bytes, vout: int) -> bytes:
+    # txid in serialization order
+    return txid + write_varint(vout)
+
+
+def is_unspendable(script: bytes) -> bool:
+    return script[:1] == bytes([OP_RETURN]) or len(script) > MAX_SCRIPT_SIZE
+
+
+class Coin:
+    """
+        An unspent output
+    """
+    __slots__ = ("txid", "vout", "height", "coinbase", "value", "script_pubkey")
+
+    def __init__(self, txid: bytes, vout: int, height: int, coinbase: bool, value: int, script_pubkey: bytes):
+        # txid in serialization order, value in satoshis
+        self.txid = txid
+        self.vout = vout
+        self.height = height
+        self.coinbase = coinbase
+        self.value = value
+        self.script_pubkey = script_pubkey
+
+    def __repr__(self):
+        return "<Coin {}:{} {}>".format(self.txid[::-1].hex(), self.vout, self.value)
+
+    def serialize(self) -> bytes:
+        """
+        Serialization hashed into the muhash (TxOutSer of the node)
+        """
+        return self.txid + struct.pack("<IIq", self.vout, self.height << 1 | self.coinbase, self.value) + \
+            write_varint(len(self.script_pubkey)) + self.script_pubkey
+
+    def bogosize(self) -> int:
+        # txid, vout, height and coinbase, amount, script length and script, like the node's GetBogoSize
+        return 32 + 4 + 4 + 8 + 2 + len(self.script_pubkey)
+
+
+def _pack_coins(coins: List[Coin]) -> bytes:
+    out = [write_varint(len(coins))]
+    for coin in coins:
+        script = compress_script(coin.script_pubkey)
+        out.append(coin.txid + write_varint(coin.vout) + write_varint(coin.height << 1 | coin.coinbase) +
+                   struct.pack("<q", coin.value) + write_varint(len(script)) + script)
+    return b"".join(out)
+
+
+def _unpack_coins(buf: memoryview, offset: int) -> Tuple[List[Coin], int]:
+    count, offset = read_varint(buf, offset)
+    coins = []
+    for _ in range(count):
+        txid = bytes(buf[offset:offset + 32])
+        vout, offset = read_varint(buf, offset + 32)
+        code, offset = read_varint(buf, offset)
+        value = struct.unpack_from("<q", buf, offset)[0]
+        length, offset = read_varint(buf, offset + 8)
+        script = decompress_script(buf[offset:offset + length])
+        offset += length
+        coins.append(Coin(txid, vout, code >> 1, code & 1, value, script))
+    return coins, offset
+
+
+class ChainState:
+    """
+        UTXO set built from blocks in chain order (getblock verbosity 0 or 2 results, or the events of a
+        ChainFollower, see attach), starting at the genesis block.
+        Coins are stored in sqlite keyed by outpoint with compressed scripts. The undo data of a block holds the
+        coins it spent (or overwrote) and the outpoints it created, it is kept for the last ``undo_depth`` blocks.
+        txouts, total_amount, bogosize and the muhash (MuHash3072 numerator and denominator) are stored with the
+        tip and updated in the transaction of each block, so they always describe the stored set.
+        :param path: sqlite database file, created if missing
+        :param network: chain of the addresses of get_tx_out results
+        :param undo_depth: number of recent blocks that can be disconnected by a reorg
+    """
+
+    def __init__(self, path: str, network: str = "main", undo_depth: int = 100):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.network = network
+        self.undo_depth = undo_depth
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS coins (
+                outpoint BLOB PRIMARY KEY, code INTEGER NOT NULL, value INTEGER NOT NULL, script BLOB NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS blocks (height INTEGER PRIMARY KEY, hash TEXT NOT NULL, undo BLOB);
+            CREATE TABLE IF NOT EXISTS stats (
+                id INTEGER PRIMARY KEY CHECK (id = 0), txouts INTEGER NOT NULL, total_amount INTEGER NOT NULL,
+                bogosize INTEGER NOT NULL, muhash BLOB NOT NULL);
+            INSERT OR IGNORE INTO stats VALUES (0, 0, 0, 0, x'');
+        """)
+        self._load_stats()
+
+    def _load_stats(self):
+        txouts, total, bogosize, muhash = self._db.execute(
+            "SELECT txouts, total_amount, bogosize, muhash FROM stats").fetchone()
+        self.txouts = txouts
+        self.total_amount = total
+        self.bogosize = bogosize
+        self._muhash = MuHash3072.parse(muhash) if muhash else MuHash3072()
+
+    def _save_stats(self):
+        self._db.execute("UPDATE stats SET txouts = ?, total_amount = ?, bogosize = ?, muhash = ?",
+                         (self.txouts, self.total_amount, self.bogosize, self._muhash.serialize()))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.txouts
+
+    @property
+    def tip(self) -> Union[Tuple[int, str], None]:
+        """
+        (height, hash) of the last connected block
+        """
+        with self._lock:
+            row = self._db.execute("SELECT height, hash FROM blocks ORDER BY height DESC LIMIT 1").fetchone()
+        return tuple(row) if row else None
+
+    def _add(self, coins: List[Coin]):
+        self._db.executemany("INSERT OR REPLACE INTO coins VALUES (?, ?, ?, ?)",
+                             [(outpoint_key(coin.txid, coin.vout), coin.height << 1 | coin.coinbase, coin.value,
+                               compress_script(coin.script_pubkey)) for coin in coins])
+        self.txouts += len(coins)
+        self.total_amount += sum(coin.value for coin in coins)
+        self.bogosize += sum(coin.bogosize() for coin in coins)
+        self._muhash.insert_many([coin.serialize() for coin in coins])
+
+    def _remove(self, coins: List[Coin]):
+        self._db.executemany("DELETE FROM coins WHERE outpoint = ?",
+                             [(outpoint_key(coin.txid, coin.vout),) for coin in coins])
+        self.txouts -= len(coins)
+        self.total_amount -= sum(coin.value for coin in coins)
+        self.bogosize -= sum(coin.bogosize() for coin in coins)
+        self._muhash.remove_many([coin.serialize() for coin in coins])
+
+    def _fetch(self, outpoints: List[Tuple[bytes, int]]) -> List[Union[Coin, None]]:
+        # outpoints with txids in serialization order
+        found = {}
+        keys = [outpoint_key(txid, vout) for txid, vout in outpoints]
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            query = "SELECT outpoint, code, value, script FROM coins WHERE outpoint IN ({})".format(
+                ",".join("?" * len(chunk)))
+            for key, code, value, script in self._db.execute(query, chunk):
+                found[bytes(key)] = (code, value, script)
+        out = []
+        for (txid, vout), key in zip(outpoints, keys):
+            row = found.get(key)
+            out.append(None if row is None else
+                       Coin(txid, vout, row[0] >> 1, row[0] & 1, row[1], decompress_script(row[2])))
+        return out
+
+    def _connect(self, block: Any, height: int = None):
+        block_hash, previous, block_height, txs = block_transactions(block)
+        height = block_height if height is None else height
+        tip = self.tip
+        if tip is None and height != 0:
+            raise ValueError("the UTXO set starts at the genesis block, got height {}".format(height))
+        if tip is not None:
+            if height != tip[0] + 1:
+                raise ValueError("block {} at height {} does not follow the tip {}".format(block_hash, height, tip[0]))
+            if previous is not None and previous != tip[1]:
+                raise ValueError("block {} does not extend the tip {}".format(block_hash, tip[1]))
+        created = {}
+        spent_keys = []
+        for index, (txid, inputs, outputs) in enumerate(txs):
+            for prev_txid, vout in inputs:
+                if created.pop((prev_txid, vout), None) is None:
+                    spent_keys.append((prev_txid, vout))
+            if height == 0:
+                # the outputs of the genesis block are not spendable
+                continue
+            for vout, (value, script) in enumerate(outputs):
+                if not is_unspendable(script):
+                    created[(txid, vout)] = Coin(txid, vout, height, index == 0, value, script)
+        spent = self._fetch(spent_keys)
+        for (txid, vout), coin in zip(spent_keys, spent):
+            if coin is None:
+                raise ValueError("block {} spends {}:{} which is not in the UTXO set".format(
+                    block_hash, txid[::-1].hex(), vout))
+        # duplicated coinbase txids (BIP30) overwrite the previous outputs, they are undone like spends
+        if txs and height:
+            coinbase = [key for key in created if key[0] == txs[0][0]]
+            spent += [coin for coin in self._fetch(coinbase) if coin is not None]
+        self._remove(spent)
+        self._add(list(created.values()))
+        # outpoints created by the block, grouped by transaction
+        undo = [_pack_coins(spent)]
+        by_tx = {}
+        for txid, vout in created:
+            by_tx.setdefault(txid, []).append(vout)
+        undo.append(write_varint(len(by_tx)))
+        for txid, vouts in by_tx.items():
+            undo.append(txid + write_varint(len(vouts)) + b"".join(write_varint(vout) for vout in vouts))
+        self._db.execute("INSERT INTO blocks VALUES (?, ?, ?)", (height, block_hash, b"".join(undo)))
+        self._db.execute("UPDATE blocks SET undo = NULL WHERE height = ?", (height - self.undo_depth,))
+        self._save_stats()
+
+    def connect_block(self, block: Any, height: int = None):
+        """
+        Apply the block following the tip
+        :param block: getblock result of verbosity 0 (hex) or 2, raw bytes or a Block
+        :param height: height of the block, required for raw blocks unless the set is not empty
+        :return:
+        """
+        self.connect_blocks([(block, height)])
+
+    def connect_blocks(self, blocks: Iterable[Tuple[Any, int]], commit_every: int = 100) -> int:
+        """
+        Apply consecutive blocks, committing every ``commit_every`` blocks
+        :param blocks: (block, height) pairs, see connect_block
+        :param commit_every:
+        :return: number of blocks applied
+        """
+        count = 0
+        with self._lock:
+            try:
+                for block, height in blocks:
+                    if height is None and self.tip is not None:
+                        height = self.tip[0] + 1
+                    self._connect(block, height)
+                    count += 1
+                    if count % commit_every == 0:
+                        self._db.commit()
+            except BaseException:
+                # the current block may be half written, statistics go back to the last commit
+                self._db.rollback()
+                self._load_stats()
+                raise
+            self._db.commit()
+        return count
+
+    def disconnect_from(self, height: int):
+        """
+        Undo the blocks from ``height`` on after a reorg
+        :param height:
+        :return:
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT height, undo FROM blocks WHERE height >= ? ORDER BY height DESC",
+                                    (height,)).fetchall()
+            for row_height, undo in rows:
+                if undo is None:
+                    raise ValueError("block {} is deeper than the undo depth {}".format(row_height, self.undo_depth))
+            try:
+                for row_height, undo in rows:
+                    buf = memoryview(undo)
+                    spent, offset = _unpack_coins(buf, 0)
+                    created = []
+                    n_tx, offset = read_varint(buf, offset)
+                    for _ in range(n_tx):
+                        txid = bytes(buf[offset:offset + 32])
+                        n_out, offset = read_varint(buf, offset + 32)
+                        for _ in range(n_out):
+                            vout, offset = read_varint(buf, offset)
+                            created.append((txid, vout))
+                    self._remove([coin for coin in self._fetch(created) if coin is not None])
+                    self._add(spent)
+                    self._db.execute("DELETE FROM blocks WHERE height = ?", (row_height,))
+                self._save_stats()
+            except BaseException:
+                self._db.rollback()
+                self._load_stats()
+                raise
+            self._db.commit()
+
+    def apply(self, event: ChainEvent):
+        """
+        Apply a ChainFollower event, the follower must use verbosity 0 or 2
+        :param event:
+        :return:
+        """
+        if event.kind == CONNECT:
+            self.connect_block(event.block, event.height)
+        else:
+            self.disconnect_from(event.height)
+
+    def attach(self, follower):
+        """
+        Keep the set up to date with the events of a ChainFollower
+        :param follower:
+        :return:
+        """
+        follower.on_connect(self.apply)
+        follower.on_disconnect(self.apply)
+
+    def get_coins(self, outpoints: Iterable[Tuple[str, int]]) -> List[Union[Coin, None]]:
+        """
+        Unspent outputs of many outpoints in a few queries
+        :param outpoints: (txid, vout) pairs
+        :return: a Coin, or None for spent or unknown outputs, per outpoint
+        """
+        with self._lock:
+            return self._fetch([(bytes.fromhex(txid)[::-1], vout) for txid, vout in outpoints])
+
+    def get_tx_outs(self, outpoints: Iterable[Tuple[str, int]]) -> List[Union[dict, None]]:
+        """
+        gettxout results of many outpoints, amounts as exact Decimal
+        :param outpoints: (txid, vout) pairs
+        :return:
+        """
+        with self._lock:
+            tip = self.tip
+            coins = self.get_coins(outpoints)
+        out = []
+        for coin in coins:
+            if coin is None:
+                out.append(None)
+                continue
+            out.append({"bestblock": tip[1], "confirmations": tip[0] - coin.height + 1,
+                        "value": from_satoshi(coin.value),
+                        "scriptPubKey": script_pub_key_to_dict(coin.script_pubkey, self.network),
+                        "coinbase": bool(coin.coinbase)})
+        return out
+
+    def get_tx_out(self, tx_id: str, n: int) -> Union[dict, None]:
+        return self.get_tx_outs([(tx_id, n)])[0]
+
+    def get_tx_out_set_info(self) -> dict:
+        """
+        Statistics of the set like gettxoutsetinfo with hash_type "muhash", without scanning it
+        :return:
+        """
+        with self._lock:
+            tip = self.tip
+            muhash = MuHash3072(self._muhash.numerator, self._muhash.denominator)
+            out = {"height": tip[0] if tip else None, "bestblock": tip[1] if tip else None, "txouts": self.txouts,
+                   "bogosize": self.bogosize, "total_amount": from_satoshi(self.total_amount)}
+        out["muhash"] = muhash.hexdigest()
+        return out
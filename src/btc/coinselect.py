@@ -0,0 +1,413 @@
+import random
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import Dict, List, Union
+from btc.encoding import SATOSHI
+from btc.models import UtxoSet
+from btc.script import address_to_script, witness_program
+
+"""
+Local coin selection over a UtxoSet: branch and bound (changeless), knapsack and largest first, following the
+algorithms of Bitcoin Core's wallet. Amounts are integer satoshis and fee rates are in sat/vB.
+"""
+
+# weight of an input spending each script type with a 72 bytes signature, p2sh is assumed to wrap p2wpkh
+INPUT_WEIGHTS = {
+    "pubkeyhash": 592,
+    "scripthash": 364,
+    "witness_v0_keyhash": 272,
+    "witness_v1_taproot": 230,
+}
+
+# address_type of getrawchangeaddress for each change script type
+ADDRESS_TYPES = {
+    "pubkeyhash": "legacy",
+    "scripthash": "p2sh-segwit",
+    "witness_v0_keyhash": "bech32",
+    "witness_v1_taproot": "bech32m",
+}
+
+# version, locktime and the input and output counts
+TX_OVERHEAD_WEIGHT = 40
+# segwit marker and flag
+SEGWIT_OVERHEAD_WEIGHT = 2
+
+DUST_THRESHOLD = 546
+# the node's -dustrelayfee, in sat/kvB
+DUST_RELAY_FEERATE = 3000
+
+# the node tries 100000 times, a changeless solution is nearly always found in the first tries and the rest only
+# lowers its waste a little
+BNB_MAX_TRIES = 1000
+KNAPSACK_ITERATIONS = 100
+# coins given to the knapsack search, more when these do not cover the target
+KNAPSACK_MAX_COINS = 32
+
+
+def input_type(script: bytes) -> Union[str, None]:
+    """
+    Type of the scripts INPUT_WEIGHTS knows how to spend, from their template
+    :param script: scriptPubKey
+    :return:
+    """
+    size = len(script)
+    if size == 22 and script[0] == 0x00 and script[1] == 20:
+        return "witness_v0_keyhash"
+    if size == 34 and script[0] == 0x51 and script[1] == 32:
+        return "witness_v1_taproot"
+    if size == 25 and script[:3] == b"\x76\xa9\x14" and script[23:] == b"\x88\xac":
+        return "pubkeyhash"
+    if size == 23 and script[:2] == b"\xa9\x14" and script[22] == 0x87:
+        return "scripthash"
+    return None
+
+
+def output_weight(script: bytes) -> int:
+    # value, script length and script
+    return 4 * (8 + 1 + len(script))
+
+
+def dust_threshold(script: bytes) -> int:
+    """
+    Smallest amount of an output the node relays, like its GetDustThreshold: the output is dust when spending it
+    costs more than it is worth at DUST_RELAY_FEERATE
+    :param script: scriptPubKey
+    :return: satoshis, 0 for unspendable OP_RETURN outputs
+    """
+    if script[:1] == b"\x6a":
+        return 0
+    size = 8 + 1 + len(script)
+    # outpoint, script length, a 107 bytes signature and public key, sequence, discounted for witness programs
+    size += 32 + 4 + 1 + (107 // 4 if witness_program(script) is not None else 107) + 4
+    return size * DUST_RELAY_FEERATE // 1000
+
+
+def _vsize(weight: int) -> int:
+    return (weight + 3) // 4
+
+
+def _fee(weight: int, fee_rate: float) -> int:
+    # the node rounds fees up to the satoshi
+    return -(-int(_vsize(weight) * fee_rate * 1000) // 1000)
+
+
+class Selection:
+    """
+        Result of a coin selection
+        :param indexes: positions of the selected coins in the UtxoSet
+        :param inputs: [{"txid": ..., "vout": ...}] ready for create_psbt / create_raw_transaction
+        :param value: sum of the selected coins in satoshis
+        :param fee: fee in satoshis
+        :param change: change amount in satoshis, 0 when the transaction has no change output
+        :param weight: estimated weight of the signed transaction
+        :param algorithm: "bnb", "knapsack" or "largest_first"
+    """
+    __slots__ = ("indexes", "inputs", "value", "fee", "change", "weight", "algorithm")
+
+    def __init__(self, indexes: List[int], inputs: List[dict], value: int, fee: int, change: int, weight: int,
+                 algorithm: str):
+        self.indexes = indexes
+        self.inputs = inputs
+        self.value = value
+        self.fee = fee
+        self.change = change
+        self.weight = weight
+        self.algorithm = algorithm
+
+    @property
+    def vsize(self) -> int:
+        return _vsize(self.weight)
+
+    def __repr__(self):
+        return "<Selection {} inputs value={} fee={} change={} {}>".format(len(self.indexes), self.value, self.fee,
+                                                                          self.change, self.algorithm)
+
+
+class InsufficientFunds(Exception):
+    """
+        The spendable coins do not cover the outputs and the fee
+    """
+
+
+class CoinSelector:
+    """
+        Selects coins of a UtxoSet for many payouts. The effective value of every coin (its amount minus the fee to
+        spend it) is computed once for the fee rate and the coins are kept sorted by it, so every selection starts
+        with a bisection instead of a walk over the whole set. The coins selected by a payout are removed from the
+        candidates so the next payouts do not use them again, release puts them back.
+        Coins whose script type is not in INPUT_WEIGHTS, or whose spendable flag is False, are left out.
+        :param utxos: list_unspent result as a UtxoSet
+        :param fee_rate: sat/vB
+        :param long_term_fee_rate: sat/vB expected later, branch and bound prefers spending more inputs when the
+            current rate is below it; default is fee_rate
+        :param change_type: script type of the change output
+        :param min_change: smallest change kept, below it the change goes to the fee
+        :param network: chain of the output addresses
+        :param seed: seed of the knapsack randomness
+    """
+
+    def __init__(self, utxos: UtxoSet, fee_rate: float, long_term_fee_rate: float = None,
+                 change_type: str = "witness_v0_keyhash", min_change: int = DUST_THRESHOLD,
+                 network: str = "main", seed: int = None):
+        self.utxos = utxos
+        self.fee_rate = fee_rate
+        self.long_term_fee_rate = fee_rate if long_term_fee_rate is None else long_term_fee_rate
+        self.network = network
+        self.change_type = change_type
+        self.min_change = min_change
+        self.spent = set()
+        self._random = random.Random(seed)
+        change_script = {"witness_v0_keyhash": b"\x00\x14" + bytes(20), "witness_v1_taproot": b"\x51\x20" + bytes(32),
+                         "pubkeyhash": b"\x76\xa9\x14" + bytes(20) + b"\x88\xac",
+                         "scripthash": b"\xa9\x14" + bytes(20) + b"\x87"}[change_type]
+        self.change_weight = output_weight(change_script)
+        # creating the change output now and spending it later
+        self.cost_of_change = _fee(self.change_weight, fee_rate) + _fee(INPUT_WEIGHTS[change_type],
+                                                                         self.long_term_fee_rate)
+        candidates = []
+        for index in range(len(utxos)):
+            entry_type = input_type(utxos.script_pubkey(index))
+            if entry_type is None or utxos.flag(index, "spendable") is False:
+                continue
+            weight = INPUT_WEIGHTS[entry_type]
+            fee = _fee(weight, fee_rate)
+            effective = utxos.amounts[index] - fee
+            if effective > 0:
+                candidates.append((effective, fee - _fee(weight, self.long_term_fee_rate), weight, index))
+        # largest effective value first, the order every algorithm walks
+        candidates.sort(reverse=True)
+        self._candidates = candidates
+        # negated effective values, ascending for bisect
+        self._keys = [-candidate[0] for candidate in candidates]
+        self._by_index = {candidate[3]: candidate for candidate in candidates}
+
+    def __len__(self) -> int:
+        return len(self._candidates)
+
+    def available(self) -> int:
+        """
+        Sum of the effective values of the coins left
+        :return:
+        """
+        return sum(candidate[0] for candidate in self._candidates)
+
+    def _remove(self, candidate: tuple):
+        position = bisect_left(self._keys, -candidate[0])
+        while self._candidates[position] != candidate:
+            position += 1
+        del self._candidates[position]
+        del self._keys[position]
+
+    def release(self, indexes: List[int]):
+        """
+        Make coins selected before available again, eg when their transaction was not broadcast
+        :param indexes: Selection.indexes
+        :return:
+        """
+        for index in indexes:
+            if index in self.spent:
+                self.spent.discard(index)
+                candidate = self._by_index[index]
+                position = bisect_left(self._keys, -candidate[0])
+                self._candidates.insert(position, candidate)
+                self._keys.insert(position, -candidate[0])
+
+    def _outputs_weight(self, outputs: Dict[str, int]) -> int:
+        return sum(output_weight(address_to_script(address, self.network)) for address in outputs)
+
+    def select(self, outputs: Dict[str, int], algorithm: str = "auto", bnb_tries: int = BNB_MAX_TRIES,
+               mark_spent: bool = True) -> Selection:
+        """
+        Select coins paying ``outputs`` and their fee
+        :param outputs: address -> amount in satoshis
+        :param algorithm: "bnb", "knapsack", "largest_first", or "auto" which tries a changeless branch and bound
+            solution first, then knapsack
+        :param bnb_tries: bound of the branch and bound search
+        :param mark_spent: exclude the selected coins from the next selections
+        :return:
+        """
+        if algorithm not in ("auto", "bnb", "knapsack", "largest_first"):
+            raise ValueError("unknown coin selection algorithm {}".format(algorithm))
+        payment = sum(outputs.values())
+        fixed_weight = TX_OVERHEAD_WEIGHT + SEGWIT_OVERHEAD_WEIGHT + self._outputs_weight(outputs)
+        target = payment + _fee(fixed_weight, self.fee_rate)
+        selected = None
+        used = algorithm
+        if algorithm in ("auto", "bnb"):
+            selected = self._bnb(target, bnb_tries)
+            used = "bnb"
+        if selected is None and algorithm in ("auto", "knapsack"):
+            selected = self._knapsack(target + _fee(self.change_weight, self.fee_rate))
+            used = "knapsack"
+        if selected is None and algorithm == "largest_first":
+            selected = self._largest_first(target + _fee(self.change_weight, self.fee_rate))
+        if selected is None and algorithm == "bnb":
+            raise InsufficientFunds("no changeless selection pays {} sat at {} sat/vB".format(payment, self.fee_rate))
+        if selected is None:
+            raise InsufficientFunds("coins worth {} sat cannot pay {} sat at {} sat/vB".format(
+                self.available(), payment, self.fee_rate))
+        return self._result(selected, payment, fixed_weight, used, mark_spent)
+
+    def _result(self, selected: list, payment: int, fixed_weight: int, algorithm: str,
+                mark_spent: bool) -> Selection:
+        indexes = [candidate[3] for candidate in selected]
+        value = sum(self.utxos.amounts[index] for index in indexes)
+        weight = fixed_weight + sum(candidate[2] for candidate in selected)
+        change = value - payment - _fee(weight + self.change_weight, self.fee_rate)
+        if algorithm != "bnb" and change >= self.min_change:
+            weight += self.change_weight
+            fee = value - payment - change
+        else:
+            change = 0
+            fee = value - payment
+        if mark_spent:
+            self.spent.update(indexes)
+            for candidate in selected:
+                self._remove(candidate)
+        inputs = [{"txid": self.utxos.txid(index), "vout": self.utxos.vouts[index]} for index in indexes]
+        return Selection(indexes, inputs, value, fee, change, weight, algorithm)
+
+    def _bnb(self, target: int, max_tries: int) -> Union[list, None]:
+        """
+        Depth first search of a changeless input set whose effective value is within [target, target + cost of
+        change], minimizing the waste, like SelectCoinsBnB of the node
+        """
+        upper = target + self.cost_of_change
+        # a coin worth more than the upper bound is in no solution, skipping those saves tries
+        pool = self._candidates[bisect_left(self._keys, -upper):]
+        values = [candidate[0] for candidate in pool]
+        # value of the coins from each depth on, what is left to reach the target
+        available = list(accumulate(reversed(values)))[::-1] + [0]
+        if available[0] < target:
+            return None
+        wastes = [candidate[1] for candidate in pool]
+        positive_waste = wastes[0] > 0
+        value = 0
+        waste = 0
+        best = None
+        best_waste = float("inf")
+        # depths of the included coins, the coins of the other depths above ``depth`` are excluded
+        selected = []
+        depth = 0
+        for _ in range(max_tries):
+            if value + available[depth] < target or value > upper or (waste > best_waste and positive_waste):
+                backtrack = True
+            elif value >= target:
+                if waste + value - target <= best_waste:
+                    best = list(selected)
+                    best_waste = waste + value - target
+                    if best_waste == 0:
+                        break
+                backtrack = True
+            else:
+                backtrack = False
+            if backtrack:
+                if not selected:
+                    break
+                # exclude the last included coin instead
+                last = selected.pop()
+                value -= values[last]
+                waste -= wastes[last]
+                depth = last + 1
+                continue
+            if selected and selected[-1] != depth - 1 and values[depth] == values[depth - 1] \
+                    and wastes[depth] == wastes[depth - 1]:
+                # same coin as the one just excluded, including it would repeat that branch
+                pass
+            else:
+                selected.append(depth)
+                value += values[depth]
+                waste += wastes[depth]
+            depth += 1
+        if best is None:
+            return None
+        return [pool[depth] for depth in best]
+
+    def _knapsack(self, target: int) -> Union[list, None]:
+        """
+        Smallest coin covering the target with change, or a random approximation of the best subset of the smaller
+        coins, like KnapsackSolver of the node.
+        The random search runs on the largest of the smaller coins, KNAPSACK_MAX_COINS of them or more when these
+        do not cover the target.
+        """
+        candidates = self._candidates
+        exact = bisect_left(self._keys, -target)
+        if exact < len(candidates) and candidates[exact][0] == target:
+            return [candidates[exact]]
+        start = bisect_right(self._keys, -(target + self.min_change))
+        lowest_larger = candidates[start - 1] if start > 0 else None
+        end = start
+        total = 0
+        while end < len(candidates) and (end - start < KNAPSACK_MAX_COINS or total < target + self.min_change):
+            total += candidates[end][0]
+            end += 1
+        smaller = candidates[start:end]
+        if total == target:
+            return smaller
+        if total < target:
+            return [lowest_larger] if lowest_larger is not None else None
+        best, best_value = self._approximate_best_subset(smaller, total, target)
+        if best_value != target and total >= target + self.min_change:
+            best, best_value = self._approximate_best_subset(smaller, total, target + self.min_change)
+        if lowest_larger is not None and \
+                ((best_value != target and best_value < target + self.min_change) or lowest_larger[0] <= best_value):
+            return [lowest_larger]
+        return [candidate for candidate, included in zip(smaller, best) if included]
+
+    def _approximate_best_subset(self, smaller: list, total: int, target: int) -> tuple:
+        values = [candidate[0] for candidate in smaller]
+        size = len(values)
+        best = [True] * size
+        best_value = total
+        random_bits = self._random.getrandbits
+        for _ in range(KNAPSACK_ITERATIONS):
+            if best_value == target:
+                break
+            included = [False] * size
+            value = 0
+            reached = False
+            # one random bit per coin for the first pass, the second pass adds the coins it left out
+            bits = random_bits(size)
+            for n_pass in range(2):
+                if reached:
+                    break
+                for i in range(size):
+                    if (bits >> i & 1 if n_pass == 0 else not included[i]):
+                        value += values[i]
+                        included[i] = True
+                        if value >= target:
+                            reached = True
+                            if value < best_value:
+                                best_value = value
+                                best = list(included)
+                            value -= values[i]
+                            included[i] = False
+        return best, best_value
+
+    def _largest_first(self, target: int) -> Union[list, None]:
+        selected = []
+        value = 0
+        for candidate in self._candidates:
+            selected.append(candidate)
+            value += candidate[0]
+            if value >= target:
+                return selected
+        return None
+
+    def create_psbt(self, raw, outputs: Dict[str, int], change_address: str, algorithm: str = "auto",
+                    lock_time: int = 0, replaceable: bool = True) -> str:
+        """
+        Select coins for ``outputs`` and create the PSBT spending them
+        :param raw: Raw instance, eg bitcoin.raw
+        :param outputs: address -> amount in satoshis
+        :param change_address: address receiving the change
+        :param algorithm: see select
+        :param lock_time:
+        :param replaceable:
+        :return: base64 PSBT
+        """
+        selection = self.select(outputs, algorithm)
+        psbt_outputs = [{address: amount / SATOSHI} for address, amount in outputs.items()]
+        if selection.change:
+            psbt_outputs.append({change_address: selection.change / SATOSHI})
+        return raw.create_psbt(selection.inputs, psbt_outputs, lock_time, replaceable)
@@ -0,0 +1,329 @@
+import hashlib
+import hmac
+import os
+from typing import Iterator, Tuple, Union
+
+try:
+    import coincurve
+    from coincurve._libsecp256k1 import ffi as _ffi
+except ImportError:
+    coincurve = None
+
+"""
+secp256k1 keys and signatures: ECDSA signatures as the node makes them (RFC6979 nonces, low S, grinded to a low R)
+and BIP340 Schnorr signatures. coincurve (libsecp256k1) is used when it is installed, otherwise a pure Python
+implementation giving the same bytes.
+"""
+
+P = 0xfffffffffffffffffffffffffffffffffffffffffffffffffffffffefffffc2f
+N = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
+G = (0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798,
+     0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8)
+
+Point = Tuple[int, int]
+
+# window of the precomputed multiples of G
+_WINDOW = 4
+_G_TABLE = None
+
+
+def tagged_hash(tag: str, data: bytes) -> bytes:
+    tag_hash = hashlib.sha256(tag.encode()).digest()
+    return hashlib.sha256(tag_hash + tag_hash + data).digest()
+
+
+def hash160(data: bytes) -> bytes:
+    return hashlib.new("ripemd160", hashlib.sha256(data).digest()).digest()
+
+
+def _jacobian_double(point: tuple) -> tuple:
+    x, y, z = point
+    if y == 0:
+        return 0, 0, 0
+    ysq = y * y % P
+    s = 4 * x * ysq % P
+    m = 3 * x * x % P
+    nx = (m * m - 2 * s) % P
+    return nx, (m * (s - nx) - 8 * ysq * ysq) % P, 2 * y * z % P
+
+
+def _jacobian_add(p1: tuple, p2: tuple) -> tuple:
+    x1, y1, z1 = p1
+    x2, y2, z2 = p2
+    if z1 == 0:
+        return p2
+    if z2 == 0:
+        return p1
+    z1z1 = z1 * z1 % P
+    z2z2 = z2 * z2 % P
+    u1 = x1 * z2z2 % P
+    u2 = x2 * z1z1 % P
+    s1 = y1 * z2 * z2z2 % P
+    s2 = y2 * z1 * z1z1 % P
+    if u1 == u2:
+        if s1 != s2:
+            return 0, 0, 0
+        return _jacobian_double(p1)
+    h = u2 - u1
+    r = s2 - s1
+    hh = h * h % P
+    hhh = h * hh % P
+    v = u1 * hh % P
+    nx = (r * r - hhh - 2 * v) % P
+    return nx, (r * (v - nx) - s1 * hhh) % P, h * z1 * z2 % P
+
+
+def _to_affine(point: tuple) -> Union[Point, None]:
+    x, y, z = point
+    if z == 0:
+        return None
+    z_inv = pow(z, -1, P)
+    z_inv2 = z_inv * z_inv % P
+    return x * z_inv2 % P, y * z_inv2 * z_inv % P
+
+
+def _g_table() -> list:
+    # _G_TABLE[i][j] is j * 16 ** i * G in jacobian coordinates
+    global _G_TABLE
+    if _G_TABLE is None:
+        table = []
+        base = (G[0], G[1], 1)
+        for _ in range(256 // _WINDOW):
+            row = [(0, 0, 0), base]
+            for _ in range(2, 1 << _WINDOW):
+                row.append(_jacobian_add(row[-1], base))
+            table.append(row)
+            base = _jacobian_add(row[-1], base)
+        _G_TABLE = table
+    return _G_TABLE
+
+
+def point_mul_g(k: int) -> Union[Point, None]:
+    """
+    k * G, None for the point at infinity
+    """
+    table = _g_table()
+    result = (0, 0, 0)
+    mask = (1 << _WINDOW) - 1
+    for row in table:
+        digit = k & mask
+        if digit:
+            result = _jacobian_add(result, row[digit])
+        k >>= _WINDOW
+    return _to_affine(result)
+
+
+def point_mul(point: Point, k: int) -> Union[Point, None]:
+    result = (0, 0, 0)
+    addend = (point[0], point[1], 1)
+    while k:
+        if k & 1:
+            result = _jacobian_add(result, addend)
+        addend = _jacobian_double(addend)
+        k >>= 1
+    return _to_affine(result)
+
+
+def point_add(p1: Union[Point, None], p2: Union[Point, None]) -> Union[Point, None]:
+    if p1 is None:
+        return p2
+    if p2 is None:
+        return p1
+    return _to_affine(_jacobian_add((p1[0], p1[1], 1), (p2[0], p2[1], 1)))
+
+
+def lift_x(x: int) -> Point:
+    """
+    The point with x coordinate ``x`` and an even y, as BIP340 x-only public keys are read
+    """
+    if x >= P:
+        raise ValueError("x coordinate is not in the field")
+    y_sq = (pow(x, 3, P) + 7) % P
+    y = pow(y_sq, (P + 1) // 4, P)
+    if y * y % P != y_sq:
+        raise ValueError("x coordinate is not on the curve")
+    return x, y if y & 1 == 0 else P - y
+
+
+def encode_point(point: Point, compressed: bool = True) -> bytes:
+    if compressed:
+        return bytes([2 + (point[1] & 1)]) + point[0].to_bytes(32, "big")
+    return b"\x04" + point[0].to_bytes(32, "big") + point[1].to_bytes(32, "big")
+
+
+def decode_point(data: bytes) -> Point:
+    if len(data) == 33 and data[0] in (2, 3):
+        x, y = lift_x(int.from_bytes(data[1:], "big"))
+        return (x, y) if y & 1 == data[0] & 1 else (x, P - y)
+    if len(data) == 65 and data[0] == 4:
+        point = int.from_bytes(data[1:33], "big"), int.from_bytes(data[33:], "big")
+        if (point[1] * point[1] - pow(point[0], 3, P) - 7) % P:
+            raise ValueError("public key is not on the curve")
+        return point
+    raise ValueError("invalid public key encoding")
+
+
+def _secret_int(secret: bytes) -> int:
+    d = int.from_bytes(secret, "big")
+    if len(secret) != 32 or not 0 < d < N:
+        raise ValueError("private key is out of range")
+    return d
+
+
+def public_key(secret: bytes, compressed: bool = True) -> bytes:
+    """
+    Serialized public key of a 32 bytes private key
+    :param secret:
+    :param compressed:
+    :return:
+    """
+    if coincurve is not None:
+        return coincurve.PublicKey.from_secret(secret).format(compressed)
+    return encode_point(point_mul_g(_secret_int(secret)), compressed)
+
+
+def x_only_public_key(secret: bytes) -> bytes:
+    if coincurve is not None:
+        return coincurve.PublicKey.from_secret(secret).format(True)[1:]
+    return point_mul_g(_secret_int(secret))[0].to_bytes(32, "big")
+
+
+def _hmac(key: bytes, data: bytes) -> bytes:
+    return hmac.new(key, data, hashlib.sha256).digest()
+
+
+def rfc6979_nonces(secret: bytes, digest: bytes, extra_entropy: bytes = None) -> Iterator[bytes]:
+    """
+    Nonce candidates of libsecp256k1's secp256k1_nonce_function_rfc6979
+    :param secret: private key
+    :param digest: 32 bytes message hash, reduced modulo the curve order
+    :param extra_entropy: optional 32 bytes added to the key data
+    :return:
+    """
+    message = (int.from_bytes(digest, "big") % N).to_bytes(32, "big")
+    key_data = secret + message + (extra_entropy or b"")
+    v = b"\x01" * 32
+    k = _hmac(b"\x00" * 32, v + b"\x00" + key_data)
+    v = _hmac(k, v)
+    k = _hmac(k, v + b"\x01" + key_data)
+    v = _hmac(k, v)
+    while True:
+        v = _hmac(k, v)
+        yield v
+        k = _hmac(k, v + b"\x00")
+        v = _hmac(k, v)
+
+
+def der_encode(r: int, s: int) -> bytes:
+    def integer(value: int) -> bytes:
+        data = value.to_bytes(32, "big").lstrip(b"\x00")
+        if not data or data[0] & 0x80:
+            data = b"\x00" + data
+        return b"\x02" + bytes([len(data)]) + data
+    body = integer(r) + integer(s)
+    return b"\x30" + bytes([len(body)]) + body
+
+
+def _sign_ecdsa_python(d: int, digest: bytes, secret: bytes, extra_entropy: Union[bytes, None]) -> Tuple[int, int]:
+    z = int.from_bytes(digest, "big") % N
+    for nonce in rfc6979_nonces(secret, digest, extra_entropy):
+        k = int.from_bytes(nonce, "big")
+        if not 0 < k < N:
+            continue
+        r = point_mul_g(k)[0] % N
+        s = pow(k, -1, N) * (z + r * d) % N
+        if r == 0 or s == 0:
+            continue
+        return r, min(s, N - s)
+
+
+def sign_ecdsa(secret: bytes, digest: bytes, grind: bool = True) -> bytes:
+    """
+    DER signature of a 32 bytes digest, like the node's CKey::Sign: RFC6979 nonce, low S and, with ``grind``,
+    the nonce is derived again with a counter as extra entropy until R is below 2^255 (a 70 bytes signature
+    instead of 71 half of the time)
+    :param secret: private key
+    :param digest: sighash
+    :param grind:
+    :return:
+    """
+    counter = 0
+    if coincurve is not None:
+        key = coincurve.PrivateKey(secret)
+        while True:
+            nonce = (_ffi.NULL, _ffi.NULL) if counter == 0 else \
+                (_ffi.NULL, _ffi.new("unsigned char[32]", counter.to_bytes(32, "little")))
+            signature = key.sign(digest, hasher=None, custom_nonce=nonce)
+            # r is at most 32 bytes without its sign padding when it is low
+            if not grind or signature[3] <= 32:
+                return signature
+            counter += 1
+    d = _secret_int(secret)
+    while True:
+        r, s = _sign_ecdsa_python(d, digest, secret, counter.to_bytes(32, "little") if counter else None)
+        if not grind or r < 1 << 255:
+            return der_encode(r, s)
+        counter += 1
+
+
+def taproot_tweak(x_only: bytes, merkle_root: bytes = b"") -> int:
+    return int.from_bytes(tagged_hash("TapTweak", x_only + merkle_root), "big")
+
+
+def taproot_output_key(x_only: bytes, merkle_root: bytes = b"") -> bytes:
+    """
+    x-only output key of a taproot output, BIP86 when there is no script tree
+    :param x_only: internal key
+    :param merkle_root: root of the script tree
+    :return:
+    """
+    tweak = taproot_tweak(x_only, merkle_root)
+    if tweak >= N:
+        raise ValueError("taproot tweak is out of range")
+    return point_add(lift_x(int.from_bytes(x_only, "big")), point_mul_g(tweak))[0].to_bytes(32, "big")
+
+
+def taproot_tweak_secret(secret: bytes, merkle_root: bytes = b"") -> bytes:
+    """
+    Private key of the output key of taproot_output_key
+    :param secret: internal private key
+    :param merkle_root:
+    :return:
+    """
+    d = _secret_int(secret)
+    compressed = public_key(secret)
+    if compressed[0] == 3:
+        d = N - d
+    tweaked = (d + taproot_tweak(compressed[1:], merkle_root)) % N
+    if tweaked == 0:
+        raise ValueError("tweaked private key is zero")
+    return tweaked.to_bytes(32, "big")
+
+
+def sign_schnorr(secret: bytes, digest: bytes, aux: bytes = None) -> bytes:
+    """
+    BIP340 signature of a 32 bytes digest
+    :param secret: private key
+    :param digest: sighash
+    :param aux: 32 bytes of auxiliary randomness, random by default like the node's signatures
+    :return: 64 bytes signature
+    """
+    if aux is None:
+        aux = os.urandom(32)
+    if coincurve is not None:
+        return coincurve.PrivateKey(secret).sign_schnorr(digest, aux)
+    d = _secret_int(secret)
+    compressed = public_key(secret)
+    if compressed[0] == 3:
+        d = N - d
+    x_only = compressed[1:]
+    masked = (d ^ int.from_bytes(tagged_hash("BIP0340/aux", aux), "big")).to_bytes(32, "big")
+    k = int.from_bytes(tagged_hash("BIP0340/nonce", masked + x_only + digest), "big") % N
+    if k == 0:
+        raise ValueError("schnorr nonce is zero")
+    nonce_point = point_mul_g(k)
+    if nonce_point[1] & 1:
+        k = N - k
+    r = nonce_point[0].to_bytes(32, "big")
+    e = int.from_bytes(tagged_hash("BIP0340/challenge", r + x_only + digest), "big") % N
+    return r + ((k + e * d) % N).to_bytes(32, "big")
@@ -1,9 +1,142 @@
 import json
-from typing import Dict, Optional, Type, Iterable
+from array import array
+from decimal import Decimal, ROUND_DOWN
+from functools import partial
+from typing import Dict, Optional, Type, Iterable, Callable, Union
 from btc.types_check import *
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SATOSHI = 100000000
+
+# keys whose value is a BTC amount (or a BTC/kvB fee rate) in RPC results
+AMOUNT_KEYS = frozenset([
+    "amount", "value", "fee", "balance", "total", "total_amount", "unconfirmed_balance", "immature_balance",
+    "trusted", "untrusted_pending", "immature", "used", "base", "modified", "ancestor", "descendant",
+    "feerate", "relayfee", "incrementalfee", "mempoolminfee", "minrelaytxfee", "paytxfee", "incrementalrelayfee",
+])
+
+
+def _available_json_backends() -> Dict[str, Callable]:
+    backends = {}
+    if orjson is not None:
+        backends["orjson"] = orjson.loads
+    if ujson is not None:
+        backends["ujson"] = ujson.loads
+    backends["json"] = json.loads
+    return backends
+
+
+JSON_BACKENDS = _available_json_backends()
+
+
+def _amounts_to_satoshi(obj: dict) -> dict:
+    for key, val in obj.items():
+        if key in AMOUNT_KEYS and isinstance(val, Decimal):
+            obj[key] = int(val * SATOSHI)
+    return obj
+
+
+def get_json_backend(name: str = None, amount_mode: str = "float") -> Callable:
+    """
+    Return the loads function of a JSON decoder backend, all of them accept bytes as well as str
+    :param name: "orjson", "ujson" or "json", the fastest installed one is used when omitted
+    :param amount_mode: how numbers with a fraction are parsed
+        "float": as float
+        "decimal": as exact Decimal
+        "satoshi": values of AMOUNT_KEYS as integer satoshis, other numbers with a fraction as Decimal
+    :return:
+    """
+    if amount_mode != "float":
+        # only the stdlib decoder has a parse_float hook
+        if name not in (None, "json"):
+            raise ValueError("amount mode {} requires the json backend".format(amount_mode))
+        if amount_mode == "decimal":
+            return partial(json.loads, parse_float=Decimal)
+        if amount_mode == "satoshi":
+            return partial(json.loads, parse_float=Decimal, object_hook=_amounts_to_satoshi)
+        raise ValueError("unknown amount mode {}".format(amount_mode))
+    if name is None:
+        return next(iter(JSON_BACKENDS.values()))
+    if name not in JSON_BACKENDS:
+        raise ValueError("json backend {} is not installed, available: {}".format(name, ", ".join(JSON_BACKENDS)))
+    return JSON_BACKENDS[name]
+
+
+def to_satoshi(amount: Any) -> int:
+    """
+    Convert a BTC amount (float, Decimal, str or int) to integer satoshis
+    :param amount:
+    :return:
+    """
+    if isinstance(amount, float):
+        return int(round(amount * SATOSHI))
+    return int(Decimal(amount) * SATOSHI)
+
+
+def as_satoshi(amount: Any) -> int:
+    """
+    Convert an amount of an RPC result to integer satoshis, whatever the provider's amount_mode: integers are
+    already satoshis (amount_mode "satoshi"), floats and Decimals are BTC
+    :param amount:
+    :return:
+    """
+    if isinstance(amount, int):
+        return amount
+    return to_satoshi(amount)
+
+
+def from_satoshi(amount: int) -> Decimal:
+    """
+    Convert integer satoshis to an exact BTC Decimal
+    :param amount:
+    :return:
+    """
+    return Decimal(amount) / SATOSHI
+
+
+def to_satoshis(amounts: Iterable[Any]):
+    """
+    Convert many BTC amounts at once, eg the amount of every entry of a list_unspent result
+    :param amounts:
+    :return: int64 numpy array when numpy is installed, otherwise array("q")
+    """
+    amounts = amounts if is_list_like(amounts) else list(amounts)
+    if np is not None:
+        # amounts below 21e6 BTC keep an error under half a satoshi after the float multiplication
+        return np.rint(np.asarray(amounts, dtype=np.float64) * SATOSHI).astype(np.int64)
+    return array("q", [int(round(float(amount) * SATOSHI)) for amount in amounts])
+
+
+def from_satoshis(amounts: Iterable[int]):
+    """
+    Convert many integer satoshi amounts to BTC floats at once
+    :param amounts:
+    :return: float64 numpy array when numpy is installed, otherwise array("d")
+    """
+    amounts = amounts if is_list_like(amounts) else list(amounts)
+    if np is not None:
+        return np.asarray(amounts, dtype=np.int64) / SATOSHI
+    return array("d", [amount / SATOSHI for amount in amounts])
+
 
 class FriendlyCode:
+    def __init__(self, json_loads: Callable = None):
+        self._json_loads = json_loads or json.loads
+
     def _json_mapping_errors(self, mapping: Dict[Any, Any]) -> Iterable[str]:
         for key, val in mapping.items():
             try:
@@ -33,15 +166,18 @@ class FriendlyCode:
             except TypeError as exc:
                 yield "%d: because (%s)" % (index, exc)
 
-    def json_decode(self, json_str: str) -> Dict[Any, Any]:
+    def json_decode(self, json_str: Union[str, bytes]) -> Dict[Any, Any]:
         try:
-            decoded = json.loads(json_str)
+            decoded = self._json_loads(json_str)
             return decoded
-        except json.decoder.JSONDecodeError as exc:
+        except ValueError as exc:
             err_msg = 'Could not decode {} because of {}.'.format(repr(json_str), exc)
             # Calling code may rely on catching JSONDecodeError to recognize bad json
             # so we have to re-raise the same type.
-            raise json.decoder.JSONDecodeError(err_msg, exc.doc, exc.pos)
+            if isinstance(exc, json.decoder.JSONDecodeError):
+                raise json.decoder.JSONDecodeError(err_msg, exc.doc, exc.pos)
+            doc = json_str.decode("utf-8", "replace") if is_bytes(json_str) else json_str
+            raise json.decoder.JSONDecodeError(err_msg, doc, 0)
 
     def json_encode(self, obj: Dict[Any, Any],
                     cls: Optional[Type[json.JSONEncoder]] = None) -> str:
@@ -51,47 +187,40 @@ class FriendlyCode:
             raise TypeError("Could not encode to JSON: {}".format(exc))
 
     def value_encode(self, amount: Any, decimal: int) -> int:
+        """
+        Convert an amount to an integer of its smallest unit, digits beyond ``decimal`` are truncated
+        eg: value_encode("1.5", 8) -> 150000000
+        """
         if not is_string(amount):
             if amount == 0:
                 return 0
             amount = str(amount)
+        return int(Decimal(amount).scaleb(decimal).to_integral_value(ROUND_DOWN))
 
-        if amount == "0":
-            return 0
-
-        if "." not in amount:
-            out = amount + "0" * decimal
-        else:
-            li = amount.split(".")
-            if len(li[1]) >= decimal:
-                out = li[0] + li[1][:decimal]
-            else:
-                out = li[0] + li[1] + "0" * (decimal - len(li[1]))
-        return out
-
-
-    def value_decode(self, amount: Any, decimal: int) -> float:
+    def value_decode(self, amount: Any, decimal: int) -> str:
+        """
+        Convert an integer of the smallest unit back to an amount string without trailing zeros
+        eg: value_decode(150000000, 8) -> "1.5"
+        """
         if not is_string(amount):
             if amount == 0:
                 return 0
             amount = str(amount)
-
         if amount == "0":
             return 0
+        out = Decimal(amount).scaleb(-decimal)
+        if out == out.to_integral_value():
+            return str(out.quantize(1))
+        return format(out.normalize(), "f")
 
-        ll = len(amount)
-        if ll == decimal:
-            out = "0." + amount
-        elif ll > decimal:
-            out = amount[:-decimal] + "." + amount[-decimal:]
-        else:
-            out = "0." + "0" * (decimal - ll) + amount
-        j = len(out) - 1
-        while j >= 0:
-            if out[j] == "0" or out[j] == ".":
-                out = out[:-1]
-            else:
-                break
-            j -= 1
-        return out
+    def values_encode(self, amounts: Iterable[Any], decimal: int):
+        """
+        Bulk value_encode, amounts are rounded to the nearest unit instead of truncated
+        :return: int64 numpy array when numpy is installed, otherwise array("q")
+        """
+        scale = 10 ** decimal
+        amounts = amounts if is_list_like(amounts) else list(amounts)
+        if np is not None:
+            return np.rint(np.asarray(amounts, dtype=np.float64) * scale).astype(np.int64)
+        return array("q", [int(round(float(amount) * scale)) for amount in amounts])
 
@@ -0,0 +1,250 @@
+import math
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from typing import List, Tuple
+from btc.encoding import as_satoshi
+from btc.follower import ChainEvent, CONNECT
+from btc.rpc_abi import RPC
+
+"""
+Local fee estimation from the fee rate percentiles of recent blocks (batched getblockstats) and a fee rate
+histogram of the mempool. Both are summarized into a table of fee rates by confirmation target as they change,
+so estimates are lookups.
+"""
+
+MAX_BLOCK_WEIGHT = 4000000
+MAX_BLOCK_VSIZE = MAX_BLOCK_WEIGHT // 4
+MIN_RELAY_FEERATE = 1.0
+
+BLOCK_STATS = ["height", "blockhash", "feerate_percentiles", "total_weight"]
+
+# lower bounds of the mempool histogram buckets in sat/vB, 10% apart from 1 to 10000
+FEERATE_BUCKETS = [round(1.1 ** i, 3) for i in range(int(math.log(10000) / math.log(1.1)) + 1)]
+
+
+def _mining_score(entry: dict) -> float:
+    # fee rate the entry is mined at: a transaction waits for its ancestors when they pay less
+    fees = entry.get("fees")
+    fee = as_satoshi(fees["base"] if fees else entry["fee"])
+    rate = fee / entry["vsize"]
+    if fees and "ancestor" in fees and entry.get("ancestorsize"):
+        rate = min(rate, as_satoshi(fees["ancestor"]) / entry["ancestorsize"])
+    return rate
+
+
+class FeeEstimator:
+    """
+        Fee rate estimates in sat/vB by confirmation target, without estimatesmartfee.
+        The last ``blocks`` blocks are summarized by their inclusion fee rate: the 10th percentile fee rate
+        (by weight) of a full block, the minimum relay fee rate of a block with room left. For a target of
+        ``t`` blocks the history estimate is the lowest fee rate that confirmed within some ``t`` consecutive
+        blocks ``success`` of the time. The mempool estimate is the fee rate above which the mempool
+        holds less than ``t`` blocks of transactions. The estimate is the larger of the two.
+        update (or apply with ChainFollower events) appends the stats of new blocks, each target keeps the
+        minimum of its last window (a monotonic deque) and its window minima sorted, so a block updates the table in
+        O(max_target * log blocks); a disconnected block rebuilds them. update_mempool rebuilds the histogram and
+        its table.
+        :param bitcoin: BitCoin instance used to call the node
+        :param blocks: number of recent blocks kept
+        :param max_target: largest confirmation target, larger targets get its estimate
+        :param success: share of the past windows of ``t`` blocks the history estimate must have confirmed in
+        :param full_weight: weight from which a block is considered full
+        :param batch_size: number of getblockstats calls per batch request
+    """
+
+    def __init__(self, bitcoin, blocks: int = 144, max_target: int = 144, success: float = 0.85,
+                 full_weight: int = MAX_BLOCK_WEIGHT * 95 // 100, batch_size: int = 100):
+        self._bitcoin = bitcoin
+        self._provider = bitcoin.provider
+        self.max_target = min(max_target, blocks)
+        self.success = success
+        self.full_weight = full_weight
+        self.batch_size = batch_size
+        # (height, hash, inclusion fee rate, fee rate percentiles)
+        self._blocks = deque(maxlen=blocks)
+        self._histogram = [0] * len(FEERATE_BUCKETS)
+        self._mempool_table = [MIN_RELAY_FEERATE] * (self.max_target + 1)
+        self._lock = threading.RLock()
+        self._reset_history()
+
+    def _reset_history(self):
+        self._history_table = [MIN_RELAY_FEERATE] * (self.max_target + 1)
+        # number of blocks pushed, the index of the next one
+        self._pushed = 0
+        # by target: (index, fee rate) of the last blocks with increasing fee rates, the front is the window minimum
+        self._window_min = [deque() for _ in range(self.max_target + 1)]
+        # by target: minima of the windows in block order, and the same sorted
+        self._window_mins = [deque() for _ in range(self.max_target + 1)]
+        self._sorted_mins = [[] for _ in range(self.max_target + 1)]
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def _inclusion_feerate(self, stats: dict) -> float:
+        if stats["total_weight"] < self.full_weight:
+            return MIN_RELAY_FEERATE
+        return max(stats["feerate_percentiles"][0], MIN_RELAY_FEERATE)
+
+    def _append(self, stats: dict):
+        if len(self._blocks) == self._blocks.maxlen:
+            # the oldest window of every target goes away with the oldest block
+            for target in range(1, self.max_target + 1):
+                if self._window_mins[target]:
+                    oldest = self._window_mins[target].popleft()
+                    ordered = self._sorted_mins[target]
+                    del ordered[bisect_left(ordered, oldest)]
+        rate = self._inclusion_feerate(stats)
+        self._blocks.append((stats["height"], stats["blockhash"], rate, stats["feerate_percentiles"]))
+        self._push(rate)
+
+    def _push(self, rate: float):
+        index = self._pushed
+        self._pushed += 1
+        # blocks pushed and still kept, the replay of _drop_from pushes blocks already in _blocks
+        count = min(self._pushed, self._blocks.maxlen)
+        table = self._history_table
+        for target in range(1, self.max_target + 1):
+            window = self._window_min[target]
+            while window and window[-1][1] >= rate:
+                window.pop()
+            window.append((index, rate))
+            if window[0][0] <= index - target:
+                window.popleft()
+            if count < target:
+                # no full window yet, the lowest fee rate of every block
+                table[target] = window[0][1]
+                continue
+            ordered = self._sorted_mins[target]
+            self._window_mins[target].append(window[0][1])
+            insort(ordered, window[0][1])
+            table[target] = ordered[max(math.ceil(self.success * len(ordered)) - 1, 0)]
+
+    def _drop_from(self, height: int):
+        if not self._blocks or self._blocks[-1][0] < height:
+            return
+        while self._blocks and self._blocks[-1][0] >= height:
+            self._blocks.pop()
+        self._reset_history()
+        for _, _, rate, _ in self._blocks:
+            self._push(rate)
+
+    def _fork_height(self, tip: int) -> int:
+        # height after the last kept block still on the main chain
+        kept = [(height, block_hash) for height, block_hash, _, _ in self._blocks if height <= tip]
+        if not kept:
+            return tip + 1
+        if self._provider.make_request(RPC.chain_getBlockHash, [kept[-1][0]]) == kept[-1][1]:
+            return kept[-1][0] + 1
+        responses = self._provider.make_batch_request([(RPC.chain_getBlockHash, [height]) for height, _ in kept])
+        fork = kept[0][0]
+        for (height, block_hash), response in zip(kept, responses):
+            if response.result() != block_hash:
+                break
+            fork = height + 1
+        return fork
+
+    def update(self) -> int:
+        """
+        Fetch the stats of the blocks mined since the last update, blocks of a stale branch are dropped first
+        :return: number of blocks fetched
+        """
+        tip = self._provider.make_request(RPC.chain_getBlockCount, [])
+        with self._lock:
+            self._drop_from(self._fork_height(tip))
+            start = self._blocks[-1][0] + 1 if self._blocks else 0
+            heights = list(range(max(start, tip - self._blocks.maxlen + 1), tip + 1))
+            if not heights:
+                return 0
+            for stats in self._bitcoin.chain.get_block_stats_many(heights, BLOCK_STATS, self.batch_size):
+                self._append(stats)
+        return len(heights)
+
+    def apply(self, event: ChainEvent):
+        """
+        Apply a ChainFollower event, the stats of a connected block are fetched by its hash
+        :param event:
+        :return:
+        """
+        with self._lock:
+            if event.kind != CONNECT:
+                self._drop_from(event.height)
+            elif self._blocks and event.height != self._blocks[-1][0] + 1:
+                self.update()
+                return
+            else:
+                self._append(self._bitcoin.chain.get_block_stats(event.hash, BLOCK_STATS))
+
+    def attach(self, follower):
+        """
+        Keep the block history up to date with the events of a ChainFollower
+        :param follower:
+        :return:
+        """
+        follower.on_connect(self.apply)
+        follower.on_disconnect(self.apply)
+
+    def update_mempool(self, mempool=None):
+        """
+        Rebuild the mempool histogram
+        :param mempool: MempoolMirror to read, by default getrawmempool verbose is called
+        :return:
+        """
+        entries = mempool.to_dict() if mempool is not None else \
+            self._provider.make_request(RPC.chain_getRawMemPool, [True])
+        histogram = [0] * len(FEERATE_BUCKETS)
+        for entry in entries.values():
+            bucket = bisect_right(FEERATE_BUCKETS, _mining_score(entry)) - 1
+            histogram[max(bucket, 0)] += entry["vsize"]
+        with self._lock:
+            self._histogram = histogram
+            self._refresh_mempool()
+
+    def _refresh_mempool(self):
+        table = [MIN_RELAY_FEERATE] * (self.max_target + 1)
+        target = 1
+        above = 0
+        for bucket in range(len(FEERATE_BUCKETS) - 1, -1, -1):
+            above += self._histogram[bucket]
+            while target <= self.max_target and above >= target * MAX_BLOCK_VSIZE:
+                # t blocks are filled by transactions of this bucket or above, outbid the bucket
+                table[target] = FEERATE_BUCKETS[bucket + 1] if bucket + 1 < len(FEERATE_BUCKETS) else \
+                    FEERATE_BUCKETS[bucket]
+                target += 1
+        self._mempool_table = table
+
+    def estimate(self, target_blocks: int) -> float:
+        """
+        Fee rate for a confirmation within ``target_blocks`` blocks
+        :param target_blocks:
+        :return: sat/vB
+        """
+        target = min(max(target_blocks, 1), self.max_target)
+        return max(self._history_table[target], self._mempool_table[target])
+
+    def estimate_smart_fee(self, conf_target: int) -> dict:
+        """
+        Local result shaped like estimatesmartfee
+        :param conf_target:
+        :return: {"feerate" in BTC/kvB, "blocks"}
+        """
+        target = min(max(conf_target, 1), self.max_target)
+        return {"feerate": round(self.estimate(target) / 1e5, 8), "blocks": target}
+
+    def mempool_histogram(self) -> List[Tuple[float, int]]:
+        """
+        vsize of the mempool by fee rate bucket
+        :return: (bucket lower bound in sat/vB, vsize) pairs of the non empty buckets, highest fee rate first
+        """
+        with self._lock:
+            return [(FEERATE_BUCKETS[i], self._histogram[i]) for i in range(len(FEERATE_BUCKETS) - 1, -1, -1)
+                    if self._histogram[i]]
+
+    def block_feerates(self) -> List[dict]:
+        """
+        Fee rates of the kept blocks, oldest first
+        :return: [{"height", "hash", "inclusion", "percentiles"}]
+        """
+        with self._lock:
+            return [{"height": height, "hash": block_hash, "inclusion": rate, "percentiles": percentiles}
+                    for height, block_hash, rate, percentiles in self._blocks]
@@ -0,0 +1,197 @@
+import json
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Iterator, List, Tuple, Union
+from btc.block import Block
+from btc.rpc_abi import RPC
+from btc.types_check import is_dict
+
+CONNECT = "connect"
+DISCONNECT = "disconnect"
+
+
+class ChainEvent:
+    """
+        A block connected to or disconnected from the followed chain.
+        block is the getblock result (of the follower's verbosity) for connect events, None for disconnect ones.
+    """
+    __slots__ = ("kind", "height", "hash", "block")
+
+    def __init__(self, kind: str, height: int, block_hash: str, block: Any = None):
+        self.kind = kind
+        self.height = height
+        self.hash = block_hash
+        self.block = block
+
+    def __repr__(self):
+        return "<ChainEvent {} {} {}>".format(self.kind, self.height, self.hash)
+
+
+class ReorgTooDeep(Exception):
+    """
+        The followed chain forked below the oldest block kept by the follower
+    """
+
+
+class ChainFollower:
+    """
+        Follows the best chain and emits connect and disconnect events in chain order.
+        The hashes of the last ``max_depth`` blocks are kept in memory. A new tip is detected with
+        getbestblockhash, a fork with the confirmations of getblockheader (-1 once a block left the main chain),
+        blocks are then disconnected down to the fork point and new blocks are fetched in a pipeline
+        (see Chain.iter_blocks), each one checked against the previousblockhash of the next.
+        With ``checkpoint`` the kept hashes are saved to that file after every update and loaded on creation,
+        so a restarted follower resumes where it stopped.
+        Disconnected heights are dropped from the provider's RPCCache and the BitCoin's BlockStore.
+        :param bitcoin: BitCoin instance used to call the node
+        :param start_height: first height to connect when there is no checkpoint, default is the current tip
+        :param verbosity: getblock verbosity of the blocks of connect events, 0 for hex blocks
+        :param max_depth: number of recent blocks kept to find fork points
+        :param checkpoint: path of the checkpoint file
+        :param workers: number of threads fetching blocks while catching up
+    """
+
+    def __init__(self, bitcoin, start_height: int = None, verbosity: int = 1, max_depth: int = 100,
+                 checkpoint: str = None, workers: int = 4):
+        self._bitcoin = bitcoin
+        self._provider = bitcoin.provider
+        self._store = getattr(bitcoin, "store", None)
+        self.verbosity = verbosity
+        self.max_depth = max_depth
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self._chain = deque(maxlen=max_depth)
+        self._callbacks = {CONNECT: [], DISCONNECT: []}
+        self._next_height = start_height
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self._load()
+
+    @property
+    def tip(self) -> Union[Tuple[int, str], None]:
+        """
+        (height, hash) of the last connected block
+        :return:
+        """
+        return self._chain[-1] if self._chain else None
+
+    def on_connect(self, callback: Callable[[ChainEvent], None]):
+        self._callbacks[CONNECT].append(callback)
+
+    def on_disconnect(self, callback: Callable[[ChainEvent], None]):
+        self._callbacks[DISCONNECT].append(callback)
+
+    def _load(self):
+        with open(self.checkpoint, "r") as f:
+            state = json.load(f)
+        self._chain.extend((height, block_hash) for height, block_hash in state["blocks"])
+        self._next_height = None
+
+    def save(self):
+        """
+        Write the checkpoint file, replaced atomically
+        :return:
+        """
+        if self.checkpoint is None:
+            return
+        tmp = self.checkpoint + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"blocks": list(self._chain)}, f)
+        os.replace(tmp, self.checkpoint)
+
+    def _fork_height(self) -> int:
+        """
+        Height of the last kept block still on the main chain
+        """
+        responses = self._provider.make_batch_request([(RPC.chain_getBlockHeader, [block_hash, True])
+                                                       for _, block_hash in reversed(self._chain)])
+        for (height, _), response in zip(reversed(self._chain), responses):
+            if response.result()["confirmations"] >= 0:
+                return height
+        raise ReorgTooDeep("no block of the last {} is on the main chain any more".format(len(self._chain)))
+
+    def _disconnect_above(self, height: int) -> Iterator[ChainEvent]:
+        if self._provider.cache is not None:
+            self._provider.cache.invalidate_from(height + 1)
+        if self._store is not None:
+            self._store.remove_from_height(height + 1)
+        while self._chain and self._chain[-1][0] > height:
+            block_height, block_hash = self._chain.pop()
+            yield ChainEvent(DISCONNECT, block_height, block_hash)
+
+    def _block_links(self, block: Any) -> Tuple[str, Union[str, None]]:
+        # (hash, previousblockhash) of a getblock result
+        if is_dict(block):
+            return block["hash"], block.get("previousblockhash")
+        header = Block(block).header
+        return header.hash, header.prev_block[::-1].hex()
+
+    def iter_events(self) -> Iterator[ChainEvent]:
+        """
+        Bring the follower up to date with the node and yield the events in order, the state is updated
+        (and checkpointed) as events are consumed
+        :return:
+        """
+        while True:
+            if self._chain:
+                best = self._provider.make_request(RPC.chain_getBestBlockHash)
+                if best == self._chain[-1][1]:
+                    return
+                header = self._provider.make_request(RPC.chain_getBlockHeader, [self._chain[-1][1], True])
+                if header["confirmations"] < 0:
+                    for event in self._disconnect_above(self._fork_height()):
+                        yield event
+                    self.save()
+                start = self._chain[-1][0] + 1
+            else:
+                start = self._next_height
+                if start is None:
+                    start = self._provider.make_request(RPC.chain_getBlockCount)
+            stop = self._provider.make_request(RPC.chain_getBlockCount) + 1
+            if start >= stop:
+                return
+            relinked = False
+            blocks = self._bitcoin.chain.iter_blocks(start, stop, self.verbosity, self.workers)
+            try:
+                for height, block in zip(range(start, stop), blocks):
+                    block_hash, previous = self._block_links(block)
+                    if self._chain and previous != self._chain[-1][1]:
+                        # the chain changed while catching up, look for the fork point again
+                        relinked = True
+                        break
+                    self._chain.append((height, block_hash))
+                    self._next_height = height + 1
+                    yield ChainEvent(CONNECT, height, block_hash, block)
+                    if (height - start + 1) % self.max_depth == 0:
+                        self.save()
+            finally:
+                blocks.close()
+                self.save()
+            if not relinked:
+                return
+            if self._provider.cache is not None:
+                self._provider.cache.invalidate_from(self._chain[-1][0] + 1)
+
+    def poll(self) -> List[ChainEvent]:
+        """
+        Bring the follower up to date and run the callbacks of every event
+        :return: the events, without the blocks of connect events to keep memory flat during a long catch-up
+        """
+        events = []
+        for event in self.iter_events():
+            for callback in self._callbacks[event.kind]:
+                callback(event)
+            events.append(ChainEvent(event.kind, event.height, event.hash))
+        return events
+
+    def follow(self, interval: float = 1.0) -> Iterator[ChainEvent]:
+        """
+        Yield events forever, the node is polled every ``interval`` seconds when the follower is up to date.
+        Call poll from a hashblock notification callback (see btc.notify) instead to follow without polling.
+        :param interval:
+        :return:
+        """
+        while True:
+            for event in self.iter_events():
+                yield event
+            time.sleep(interval)
@@ -0,0 +1,163 @@
+import threading
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Union
+from btc.providers import RPCError
+from btc.rpc_abi import RPC
+
+# error code of getmempoolentry for a transaction which left the mempool in the meantime
+RPC_INVALID_ADDRESS_OR_KEY = -5
+
+
+class MempoolMirror:
+    """
+        Local indexed copy of the node's mempool.
+        sync diffs the txids of getrawmempool against the mirror, fetches the entries of new transactions with
+        batched getmempoolentry calls and evicts the ones which left the mempool. The in-mempool parents and
+        children of every transaction are indexed, so ancestors and descendants are answered locally.
+        The ancestor*, descendant* and fees fields of an entry are the ones of the time it was fetched,
+        depends and spentby are kept up to date.
+        :param bitcoin: BitCoin instance used to call the node
+        :param batch_size: number of getmempoolentry calls per batch request
+    """
+
+    def __init__(self, bitcoin, batch_size: int = 500):
+        self._provider = bitcoin.provider
+        self.batch_size = batch_size
+        self._entries = {}
+        self._parents = {}
+        self._children = {}
+        self._lock = threading.RLock()
+
+    def sync(self) -> Tuple[List[str], List[str]]:
+        """
+        Bring the mirror up to date with the node
+        :return: (added txids, removed txids)
+        """
+        tx_ids = set(self._provider.make_request(RPC.chain_getRawMemPool, [False]))
+        with self._lock:
+            removed = self.discard([tx_id for tx_id in self._entries if tx_id not in tx_ids])
+        return self.add(tx_ids), removed
+
+    def add(self, tx_ids: Iterable[str]) -> List[str]:
+        """
+        Fetch the entries of transactions that entered the mempool, the ones already mirrored are skipped
+        :param tx_ids:
+        :return: txids added
+        """
+        with self._lock:
+            missing = [tx_id for tx_id in tx_ids if tx_id not in self._entries]
+        added = []
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            responses = self._provider.make_batch_request([(RPC.chain_getMemPoolEntry, [tx_id]) for tx_id in chunk])
+            with self._lock:
+                for tx_id, response in zip(chunk, responses):
+                    if isinstance(response.error, RPCError) and response.error.code == RPC_INVALID_ADDRESS_OR_KEY:
+                        # mined or evicted since getrawmempool
+                        continue
+                    if tx_id not in self._entries:
+                        self._add(tx_id, response.result())
+                        added.append(tx_id)
+        return added
+
+    def discard(self, tx_ids: Iterable[str]) -> List[str]:
+        """
+        Evict transactions that left the mempool
+        :param tx_ids:
+        :return: txids removed
+        """
+        with self._lock:
+            removed = [tx_id for tx_id in tx_ids if tx_id in self._entries]
+            for tx_id in removed:
+                self._remove(tx_id)
+        return removed
+
+    def _add(self, tx_id: str, entry: dict):
+        self._entries[tx_id] = entry
+        parents = self._parents.setdefault(tx_id, set())
+        children = self._children.setdefault(tx_id, set())
+        for parent in entry.get("depends", []):
+            if parent in self._entries:
+                parents.add(parent)
+                self._children[parent].add(tx_id)
+        for child in entry.get("spentby", []):
+            if child in self._entries:
+                children.add(child)
+                self._parents[child].add(tx_id)
+
+    def _remove(self, tx_id: str):
+        del self._entries[tx_id]
+        for parent in self._parents.pop(tx_id):
+            self._children[parent].discard(tx_id)
+        for child in self._children.pop(tx_id):
+            self._parents[child].discard(tx_id)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, tx_id: str) -> bool:
+        return tx_id in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._entries))
+
+    def get_entry(self, tx_id: str) -> dict:
+        """
+        Local equivalent of getmempoolentry
+        :param tx_id:
+        :return:
+        """
+        with self._lock:
+            if tx_id not in self._entries:
+                raise KeyError("transaction {} is not in the mempool mirror".format(tx_id))
+            entry = dict(self._entries[tx_id])
+            entry["depends"] = sorted(self._parents[tx_id])
+            entry["spentby"] = sorted(self._children[tx_id])
+            return entry
+
+    def _walk(self, tx_id: str, edges: Dict[str, Set[str]]) -> Set[str]:
+        if tx_id not in self._entries:
+            raise KeyError("transaction {} is not in the mempool mirror".format(tx_id))
+        found = set()
+        stack = [tx_id]
+        while stack:
+            for relative in edges[stack.pop()]:
+                if relative not in found:
+                    found.add(relative)
+                    stack.append(relative)
+        return found
+
+    def _relatives(self, tx_id: str, edges: Dict[str, Set[str]], verbose: bool) -> Union[List[str], dict]:
+        with self._lock:
+            found = self._walk(tx_id, edges)
+            if verbose:
+                return {relative: self.get_entry(relative) for relative in found}
+            return list(found)
+
+    def ancestors(self, tx_id: str, verbose: bool = False) -> Union[List[str], dict]:
+        """
+        Local equivalent of getmempoolancestors
+        :param tx_id:
+        :param verbose: True for a dict of entries by txid, False for a list of txids
+        :return:
+        """
+        return self._relatives(tx_id, self._parents, verbose)
+
+    def descendants(self, tx_id: str, verbose: bool = False) -> Union[List[str], dict]:
+        """
+        Local equivalent of getmempooldescendants
+        :param tx_id:
+        :param verbose: True for a dict of entries by txid, False for a list of txids
+        :return:
+        """
+        return self._relatives(tx_id, self._children, verbose)
+
+    def to_dict(self, tx_ids: Iterable[str] = None) -> dict:
+        """
+        Local equivalent of getrawmempool with verbose=True
+        :param tx_ids: restrict the result to these transactions
+        :return:
+        """
+        with self._lock:
+            tx_ids = list(self._entries) if tx_ids is None else [tx_id for tx_id in tx_ids if tx_id in self._entries]
+            return {tx_id: self.get_entry(tx_id) for tx_id in tx_ids}
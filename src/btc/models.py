@@ -0,0 +1,442 @@
+from array import array
+from decimal import Decimal
+from typing import Any, Iterable, Iterator, List, Tuple, Union
+from btc.encoding import SATOSHI, np, as_satoshi, from_satoshi
+from btc.script import script_pub_key_to_dict, script_to_asm
+from btc.types_check import is_dict
+
+"""
+Compact models of the verbose getblock / getrawtransaction / decoderawtransaction results and of list_unspent.
+Hashes and scripts are kept as bytes and amounts as integer satoshis, the node's dict is rebuilt by to_dict.
+asm, desc, address and type of scripts are not stored, to_dict derives them from the script like the node does.
+"""
+
+# the networks of address prefixes, used to infer which chain a result comes from
+_ADDRESS_NETWORKS = (("bcrt1", "regtest"), ("bc1", "main"), ("tb1", "test"), ("1", "main"), ("3", "main"),
+                     ("m", "test"), ("n", "test"), ("2", "test"))
+
+
+def _amount(sats: int, amount_mode: str) -> Union[float, Decimal, int]:
+    if amount_mode == "float":
+        return sats / SATOSHI
+    if amount_mode == "decimal":
+        return from_satoshi(sats)
+    if amount_mode == "satoshi":
+        return sats
+    raise ValueError("unknown amount mode {}".format(amount_mode))
+
+
+def _hex(value: Union[str, None]) -> Union[bytes, None]:
+    return bytes.fromhex(value) if value is not None else None
+
+
+def address_network(address: str) -> str:
+    """
+    Network of an address, "test" stands for every test chain (test, testnet4 and signet share their prefixes)
+    :param address:
+    :return:
+    """
+    for prefix, network in _ADDRESS_NETWORKS:
+        if address.startswith(prefix):
+            return network
+    raise ValueError("unknown address prefix {}".format(address))
+
+
+def _infer_network(vouts: Iterable[dict]) -> Union[str, None]:
+    # None when no output has an address, older nodes give a list of "addresses"
+    for out in vouts:
+        script_pub_key = out.get("scriptPubKey", {})
+        address = script_pub_key.get("address") or (script_pub_key.get("addresses") or [None])[0]
+        if address is not None:
+            return address_network(address)
+    return None
+
+
+class TxInModel:
+    __slots__ = ("txid", "vout", "script_sig", "coinbase", "witness", "sequence", "extra")
+
+    def __init__(self, txid: bytes = None, vout: int = None, script_sig: bytes = None, coinbase: bytes = None,
+                 witness: Tuple[bytes, ...] = None, sequence: int = 0xffffffff, extra: dict = None):
+        # txid is kept in display (big endian) order like the RPC
+        self.txid = txid
+        self.vout = vout
+        self.script_sig = script_sig
+        self.coinbase = coinbase
+        self.witness = witness
+        self.sequence = sequence
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, vin: dict) -> "TxInModel":
+        extra = {key: val for key, val in vin.items()
+                 if key not in ("txid", "vout", "scriptSig", "coinbase", "txinwitness", "sequence")}
+        witness = vin.get("txinwitness")
+        script_sig = vin["scriptSig"]["hex"] if "scriptSig" in vin else None
+        return cls(_hex(vin.get("txid")), vin.get("vout"), _hex(script_sig), _hex(vin.get("coinbase")),
+                   tuple(bytes.fromhex(item) for item in witness) if witness else None, vin["sequence"],
+                   extra or None)
+
+    def to_dict(self) -> dict:
+        if self.coinbase is not None:
+            out = {"coinbase": self.coinbase.hex()}
+        else:
+            out = {
+                "txid": self.txid.hex(),
+                "vout": self.vout,
+                "scriptSig": {"asm": script_to_asm(self.script_sig, True), "hex": self.script_sig.hex()},
+            }
+        if self.witness:
+            out["txinwitness"] = [item.hex() for item in self.witness]
+        if self.extra:
+            out.update(self.extra)
+        out["sequence"] = self.sequence
+        return out
+
+
+class TxOutModel:
+    __slots__ = ("value", "script_pubkey")
+
+    def __init__(self, value: int, script_pubkey: bytes):
+        # value in satoshis
+        self.value = value
+        self.script_pubkey = script_pubkey
+
+    @classmethod
+    def from_dict(cls, vout: dict) -> "TxOutModel":
+        return cls(as_satoshi(vout["value"]), bytes.fromhex(vout["scriptPubKey"]["hex"]))
+
+    def to_dict(self, n: int, network: str = "main", amount_mode: str = "float") -> dict:
+        """
+        :param n:
+        :param network: chain of the address, None leaves out the address and the addr() descriptor
+        :param amount_mode:
+        :return:
+        """
+        script_pub_key = script_pub_key_to_dict(self.script_pubkey, network or "main")
+        if network is None:
+            script_pub_key.pop("address", None)
+            if script_pub_key["desc"].startswith("addr("):
+                del script_pub_key["desc"]
+        return {
+            "value": _amount(self.value, amount_mode),
+            "n": n,
+            "scriptPubKey": script_pub_key,
+        }
+
+
+class TxModel:
+    """
+        A verbose transaction, from getrawtransaction, decoderawtransaction or the tx list of a verbosity 2 block.
+        Keys other than the ones of decoderawtransaction, fee and hex (eg blockhash, confirmations) are kept as is.
+    """
+    __slots__ = ("txid", "hash", "version", "size", "vsize", "weight", "locktime", "vin", "vout", "fee", "hex",
+                 "network", "extra")
+
+    _KEYS = frozenset(["txid", "hash", "version", "size", "vsize", "weight", "locktime", "vin", "vout", "fee",
+                       "hex"])
+
+    def __init__(self, txid: bytes, hash: bytes, version: int, size: int, vsize: int, weight: int, locktime: int,
+                 vin: Tuple[TxInModel, ...], vout: Tuple[TxOutModel, ...], fee: int = None, hex: bytes = None,
+                 network: str = "main", extra: dict = None):
+        self.txid = txid
+        self.hash = hash
+        self.version = version
+        self.size = size
+        self.vsize = vsize
+        self.weight = weight
+        self.locktime = locktime
+        self.vin = vin
+        self.vout = vout
+        self.fee = fee
+        self.hex = hex
+        self.network = network
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, tx: dict, network: str = None) -> "TxModel":
+        """
+        :param tx: the node's transaction object
+        :param network: chain used to rebuild addresses, inferred from the addresses of the outputs when omitted,
+            addresses are left out of to_dict when none of the outputs has one
+        :return:
+        """
+        if network is None:
+            network = _infer_network(tx["vout"])
+        extra = {key: val for key, val in tx.items() if key not in cls._KEYS}
+        return cls(bytes.fromhex(tx["txid"]), bytes.fromhex(tx["hash"]), tx["version"], tx["size"], tx["vsize"],
+                   tx["weight"], tx["locktime"], tuple(TxInModel.from_dict(vin) for vin in tx["vin"]),
+                   tuple(TxOutModel.from_dict(vout) for vout in tx["vout"]),
+                   as_satoshi(tx["fee"]) if "fee" in tx else None, _hex(tx.get("hex")), network, extra or None)
+
+    def to_dict(self, amount_mode: str = "float") -> dict:
+        """
+        :param amount_mode: "float", "decimal" or "satoshi", see get_json_backend
+        :return:
+        """
+        out = {
+            "txid": self.txid.hex(),
+            "hash": self.hash.hex(),
+            "version": self.version,
+            "size": self.size,
+            "vsize": self.vsize,
+            "weight": self.weight,
+            "locktime": self.locktime,
+            "vin": [vin.to_dict() for vin in self.vin],
+            "vout": [vout.to_dict(n, self.network, amount_mode) for n, vout in enumerate(self.vout)],
+        }
+        if self.fee is not None:
+            out["fee"] = _amount(self.fee, amount_mode)
+        if self.hex is not None:
+            out["hex"] = self.hex.hex()
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+
+class BlockModel:
+    """
+        A verbosity 1 or 2 block, ``tx`` holds txids as bytes for verbosity 1 and TxModel for verbosity 2.
+        Keys unknown to this model are kept as is.
+    """
+    __slots__ = ("hash", "confirmations", "height", "version", "merkleroot", "time", "mediantime", "nonce", "bits",
+                 "difficulty", "chainwork", "n_tx", "previousblockhash", "nextblockhash", "strippedsize", "size",
+                 "weight", "tx", "extra")
+
+    # (key, slot, holds a hex hash)
+    _FIELDS = (
+        ("hash", "hash", True), ("confirmations", "confirmations", False), ("height", "height", False),
+        ("version", "version", False), ("merkleroot", "merkleroot", True), ("time", "time", False),
+        ("mediantime", "mediantime", False), ("nonce", "nonce", False), ("bits", "bits", False),
+        ("difficulty", "difficulty", False), ("chainwork", "chainwork", True), ("nTx", "n_tx", False),
+        ("previousblockhash", "previousblockhash", True), ("nextblockhash", "nextblockhash", True),
+        ("strippedsize", "strippedsize", False), ("size", "size", False), ("weight", "weight", False),
+    )
+    _KEYS = frozenset([key for key, _, _ in _FIELDS] + ["versionHex", "tx"])
+
+    @classmethod
+    def from_dict(cls, block: dict, network: str = None) -> "BlockModel":
+        """
+        :param block: the node's block object
+        :param network: chain used to rebuild addresses of verbosity 2 blocks, inferred from the addresses of the
+            outputs when omitted, addresses are left out of to_dict when none of the outputs has one
+        :return:
+        """
+        model = cls.__new__(cls)
+        for key, slot, is_hash in cls._FIELDS:
+            value = block.get(key)
+            setattr(model, slot, _hex(value) if is_hash else value)
+        txs = block.get("tx", [])
+        if txs and is_dict(txs[0]):
+            if network is None:
+                network = _infer_network(out for tx in txs for out in tx["vout"])
+            model.tx = [TxModel.from_dict(tx, network) for tx in txs]
+        else:
+            model.tx = [bytes.fromhex(tx_id) for tx_id in txs]
+        extra = {key: val for key, val in block.items() if key not in cls._KEYS}
+        model.extra = extra or None
+        return model
+
+    @property
+    def txids(self) -> List[str]:
+        return [tx.hex() if isinstance(tx, bytes) else tx.txid.hex() for tx in self.tx]
+
+    def to_dict(self, amount_mode: str = "float") -> dict:
+        out = {}
+        for key, slot, is_hash in self._FIELDS:
+            value = getattr(self, slot)
+            if value is None:
+                continue
+            out[key] = value.hex() if is_hash else value
+            if key == "version":
+                out["versionHex"] = "{:08x}".format(value & 0xffffffff)
+        out["tx"] = [tx.hex() if isinstance(tx, bytes) else tx.to_dict(amount_mode) for tx in self.tx]
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+
+class UtxoSet:
+    """
+        Columnar list_unspent result.
+        txids and scripts are packed in bytearrays, vout, amount (satoshis) and confirmations in arrays,
+        addresses, labels and descriptors are stored once and referenced by index since they repeat a lot.
+        Keys unknown to this model are kept per entry as is.
+    """
+
+    # bits of the flags column, every boolean takes a "present" and a "value" bit
+    _FLAGS = ("spendable", "solvable", "safe", "reused")
+    _KEYS = frozenset(["txid", "vout", "address", "label", "scriptPubKey", "amount", "confirmations", "desc",
+                       "parent_descs"] + list(_FLAGS))
+
+    def __init__(self, entries: Iterable[dict] = ()):
+        self._txids = bytearray()
+        self.vouts = array("I")
+        self.amounts = array("q")
+        self.confirmations = array("q")
+        self._flags = array("B")
+        self._scripts = bytearray()
+        self._script_ends = array("Q")
+        self._addresses = array("i")
+        self._labels = array("i")
+        self._descs = array("i")
+        self._parent_descs = array("i")
+        self._strings = []
+        self._string_ids = {}
+        self._extra = {}
+        self._index = None
+        self.extend(entries)
+
+    def _string_id(self, value: Any) -> int:
+        if value is None:
+            return -1
+        if isinstance(value, list):
+            value = tuple(value)
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+        return string_id
+
+    def _string(self, string_id: int) -> Any:
+        return self._strings[string_id] if string_id >= 0 else None
+
+    def append(self, entry: dict):
+        """
+        Add a list_unspent entry
+        :param entry:
+        :return:
+        """
+        index = len(self.vouts)
+        self._txids += bytes.fromhex(entry["txid"])
+        self.vouts.append(entry["vout"])
+        self.amounts.append(as_satoshi(entry["amount"]))
+        self.confirmations.append(entry.get("confirmations", 0))
+        flags = 0
+        for bit, key in enumerate(self._FLAGS):
+            if key in entry:
+                flags |= (1 | (2 if entry[key] else 0)) << (2 * bit)
+        self._flags.append(flags)
+        self._scripts += bytes.fromhex(entry.get("scriptPubKey", ""))
+        self._script_ends.append(len(self._scripts))
+        self._addresses.append(self._string_id(entry.get("address")))
+        self._labels.append(self._string_id(entry.get("label")))
+        self._descs.append(self._string_id(entry.get("desc")))
+        self._parent_descs.append(self._string_id(entry.get("parent_descs")))
+        extra = {key: val for key, val in entry.items() if key not in self._KEYS}
+        if extra:
+            self._extra[index] = extra
+        if self._index is not None:
+            self._index[(self.txid(index), entry["vout"])] = index
+
+    def extend(self, entries: Iterable[dict]):
+        for entry in entries:
+            self.append(entry)
+
+    def __len__(self) -> int:
+        return len(self.vouts)
+
+    def txid(self, index: int) -> str:
+        return self._txids[index * 32:index * 32 + 32].hex()
+
+    def script_pubkey(self, index: int) -> bytes:
+        start = self._script_ends[index - 1] if index > 0 else 0
+        return bytes(self._scripts[start:self._script_ends[index]])
+
+    def address(self, index: int) -> Union[str, None]:
+        return self._string(self._addresses[index])
+
+    def flag(self, index: int, key: str) -> Union[bool, None]:
+        """
+        Boolean field of an entry, eg "spendable", None when the entry has not the field
+        :param index:
+        :param key: one of spendable, solvable, safe and reused
+        :return:
+        """
+        bit = self._FLAGS.index(key)
+        flags = self._flags[index] >> (2 * bit)
+        return bool(flags & 2) if flags & 1 else None
+
+    def outpoint(self, index: int) -> Tuple[str, int]:
+        return self.txid(index), self.vouts[index]
+
+    def find(self, tx_id: str, vout: int) -> Union[int, None]:
+        """
+        Index of an outpoint, the lookup table is built on first use
+        :param tx_id:
+        :param vout:
+        :return:
+        """
+        if self._index is None:
+            self._index = {self.outpoint(i): i for i in range(len(self))}
+        return self._index.get((tx_id, vout))
+
+    def total(self) -> int:
+        """
+        Sum of the amounts in satoshis
+        :return:
+        """
+        if np is not None:
+            return int(self.amounts_array().sum())
+        return sum(self.amounts)
+
+    def amounts_array(self):
+        """
+        Amounts in satoshis as an int64 numpy array sharing the memory of the column, requires numpy
+        :return:
+        """
+        if np is None:
+            raise ImportError("numpy is required for amounts_array")
+        return np.frombuffer(self.amounts, dtype=np.int64)
+
+    def entry(self, index: int, amount_mode: str = "float") -> dict:
+        """
+        Rebuild the list_unspent entry at ``index``
+        :param index:
+        :param amount_mode: "float", "decimal" or "satoshi", see get_json_backend
+        :return:
+        """
+        if index < 0:
+            index += len(self)
+        out = {"txid": self.txid(index), "vout": self.vouts[index]}
+        address = self._string(self._addresses[index])
+        if address is not None:
+            out["address"] = address
+        label = self._string(self._labels[index])
+        if label is not None:
+            out["label"] = label
+        out["scriptPubKey"] = self.script_pubkey(index).hex()
+        out["amount"] = _amount(self.amounts[index], amount_mode)
+        out["confirmations"] = self.confirmations[index]
+        flags = self._flags[index]
+        for bit, key in enumerate(self._FLAGS[:2]):
+            if flags >> (2 * bit) & 1:
+                out[key] = bool(flags >> (2 * bit) & 2)
+        desc = self._string(self._descs[index])
+        if desc is not None:
+            out["desc"] = desc
+        parent_descs = self._string(self._parent_descs[index])
+        if parent_descs is not None:
+            out["parent_descs"] = list(parent_descs)
+        for bit, key in enumerate(self._FLAGS[2:], 2):
+            if flags >> (2 * bit) & 1:
+                out[key] = bool(flags >> (2 * bit) & 2)
+        if index in self._extra:
+            out.update(self._extra[index])
+        return out
+
+    def __getitem__(self, index: int) -> dict:
+        if not -len(self) <= index < len(self):
+            raise IndexError("utxo index out of range")
+        return self.entry(index)
+
+    def __iter__(self) -> Iterator[dict]:
+        for index in range(len(self)):
+            yield self.entry(index)
+
+    def to_dict(self, amount_mode: str = "float") -> List[dict]:
+        """
+        The list_unspent result this set was built from
+        :param amount_mode: "float", "decimal" or "satoshi", see get_json_backend
+        :return:
+        """
+        return [self.entry(index, amount_mode) for index in range(len(self))]
@@ -0,0 +1,173 @@
+import hashlib
+import struct
+from typing import Iterable, List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+MuHash3072, the rolling set hash of the node's gettxoutsetinfo "muhash": elements are hashed to 3072 bits
+numbers (SHA256 then ChaCha20 keystream) multiplied together modulo a prime, so adding or removing an element
+costs one multiplication. ChaCha20 runs vectorized over many elements at once when numpy is installed.
+"""
+
+MODULUS = 2 ** 3072 - 1103717
+BYTE_SIZE = 384
+
+_C = 2 ** 3072 - MODULUS
+_LOW = 2 ** 3072 - 1
+
+# "expand 32-byte k"
+_SIGMA = (0x61707865, 0x3320646e, 0x79622d32, 0x6b206574)
+_MASK = 0xffffffff
+_QUARTER_ROUNDS = ((0, 4, 8, 12), (1, 5, 9, 13), (2, 6, 10, 14), (3, 7, 11, 15),
+                   (0, 5, 10, 15), (1, 6, 11, 12), (2, 7, 8, 13), (3, 4, 9, 14))
+
+
+def _chacha20_block(key_words: tuple, counter: int) -> List[int]:
+    state = list(_SIGMA + key_words) + [counter, 0, 0, 0]
+    x = list(state)
+    for _ in range(10):
+        for a, b, c, d in _QUARTER_ROUNDS:
+            x[a] = (x[a] + x[b]) & _MASK
+            v = x[d] ^ x[a]
+            x[d] = (v << 16 | v >> 16) & _MASK
+            x[c] = (x[c] + x[d]) & _MASK
+            v = x[b] ^ x[c]
+            x[b] = (v << 12 | v >> 20) & _MASK
+            x[a] = (x[a] + x[b]) & _MASK
+            v = x[d] ^ x[a]
+            x[d] = (v << 8 | v >> 24) & _MASK
+            x[c] = (x[c] + x[d]) & _MASK
+            v = x[b] ^ x[c]
+            x[b] = (v << 7 | v >> 25) & _MASK
+    return [(x[i] + state[i]) & _MASK for i in range(16)]
+
+
+def chacha20_keystream(key: bytes, length: int) -> bytes:
+    """
+    ChaCha20 keystream with a zero nonce, counter starting at 0
+    :param key: 32 bytes key
+    :param length:
+    :return:
+    """
+    key_words = struct.unpack("<8I", key)
+    out = bytearray()
+    for counter in range((length + 63) // 64):
+        out += struct.pack("<16I", *_chacha20_block(key_words, counter))
+    return bytes(out[:length])
+
+
+def _rotate(v, n: int):
+    return (v << np.uint32(n)) | (v >> np.uint32(32 - n))
+
+
+def _chacha20_keystreams(keys: bytes, length: int) -> bytes:
+    # keystreams of many 32 bytes keys at once, one column per (key, counter)
+    blocks = length // 64
+    key_words = np.frombuffer(keys, dtype="<u4").reshape(-1, 8).astype(np.uint32)
+    n = len(key_words) * blocks
+    state = np.empty((16, n), dtype=np.uint32)
+    state[:4] = np.array(_SIGMA, dtype=np.uint32)[:, None]
+    state[4:12] = np.repeat(key_words, blocks, axis=0).T
+    state[12] = np.tile(np.arange(blocks, dtype=np.uint32), len(key_words))
+    state[13:] = 0
+    x = [row.copy() for row in state]
+    for _ in range(10):
+        for a, b, c, d in _QUARTER_ROUNDS:
+            x[a] += x[b]
+            x[d] = _rotate(x[d] ^ x[a], 16)
+            x[c] += x[d]
+            x[b] = _rotate(x[b] ^ x[c], 12)
+            x[a] += x[b]
+            x[d] = _rotate(x[d] ^ x[a], 8)
+            x[c] += x[d]
+            x[b] = _rotate(x[b] ^ x[c], 7)
+    out = np.stack(x) + state
+    return out.T.astype("<u4").tobytes()
+
+
+def mul(a: int, b: int) -> int:
+    """
+    a * b modulo MODULUS for a, b below 2^3072, 2^3072 is _C modulo MODULUS so the reduction needs no division
+    """
+    x = a * b
+    x = (x & _LOW) + (x >> 3072) * _C
+    x = (x & _LOW) + (x >> 3072) * _C
+    return x - MODULUS if x >= MODULUS else x
+
+
+def to_num3072(data: bytes) -> int:
+    """
+    Number of an element of the set
+    :param data: serialized element
+    :return:
+    """
+    return int.from_bytes(chacha20_keystream(hashlib.sha256(data).digest(), BYTE_SIZE), "little")
+
+
+def to_num3072_many(items: Iterable[bytes]) -> List[int]:
+    keys = b"".join(hashlib.sha256(data).digest() for data in items)
+    if np is None or len(keys) < 32 * 8:
+        # numpy only pays off past a few elements
+        return [int.from_bytes(chacha20_keystream(keys[i:i + 32], BYTE_SIZE), "little")
+                for i in range(0, len(keys), 32)]
+    stream = _chacha20_keystreams(keys, BYTE_SIZE)
+    return [int.from_bytes(stream[i:i + BYTE_SIZE], "little") for i in range(0, len(stream), BYTE_SIZE)]
+
+
+class MuHash3072:
+    """
+        Hash of a multiset, independent of the order elements are inserted and removed in.
+        Removals are accumulated in a denominator, only digest computes a modular inverse.
+    """
+    __slots__ = ("numerator", "denominator")
+
+    def __init__(self, numerator: int = 1, denominator: int = 1):
+        self.numerator = numerator
+        self.denominator = denominator
+
+    def insert(self, data: bytes):
+        self.numerator = mul(self.numerator, to_num3072(data))
+
+    def remove(self, data: bytes):
+        self.denominator = mul(self.denominator, to_num3072(data))
+
+    def insert_many(self, items: Iterable[bytes]):
+        numerator = self.numerator
+        for value in to_num3072_many(items):
+            numerator = mul(numerator, value)
+        self.numerator = numerator
+
+    def remove_many(self, items: Iterable[bytes]):
+        denominator = self.denominator
+        for value in to_num3072_many(items):
+            denominator = mul(denominator, value)
+        self.denominator = denominator
+
+    def normalize(self):
+        """
+        Fold the denominator into the numerator
+        """
+        if self.denominator != 1:
+            self.numerator = mul(self.numerator, pow(self.denominator, -1, MODULUS))
+            self.denominator = 1
+
+    def digest(self) -> bytes:
+        self.normalize()
+        return hashlib.sha256(self.numerator.to_bytes(BYTE_SIZE, "little")).digest()
+
+    def hexdigest(self) -> str:
+        """
+        Digest in the byte order the node displays it
+        """
+        return self.digest()[::-1].hex()
+
+    def serialize(self) -> bytes:
+        return self.numerator.to_bytes(BYTE_SIZE, "little") + self.denominator.to_bytes(BYTE_SIZE, "little")
+
+    @classmethod
+    def parse(cls, data: bytes) -> "MuHash3072":
+        return cls(int.from_bytes(data[:BYTE_SIZE], "little"), int.from_bytes(data[BYTE_SIZE:], "little"))
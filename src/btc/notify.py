@@ -0,0 +1,393 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+import struct
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, Union
+from btc.rpc_abi import RPC
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+"""
+Push notifications of new blocks and transactions, from bitcoind's ZMQ publisher (-zmqpubhashblock,
+-zmqpubrawtx, -zmqpubsequence...) or, with the same interface, from polling the RPC.
+"""
+
+TOPICS = ("hashblock", "hashtx", "rawblock", "rawtx", "sequence")
+
+logger = logging.getLogger(__name__)
+
+# labels of the sequence topic
+BLOCK_CONNECTED = "C"
+BLOCK_DISCONNECTED = "D"
+TX_ADDED = "A"
+TX_REMOVED = "R"
+
+
+class Notification:
+    """
+        One message of a topic.
+        body is the hash (in RPC byte order) for hashblock and hashtx, the serialized block or transaction for
+        rawblock and rawtx, and hash + label (+ mempool sequence for A and R) for sequence.
+    """
+    __slots__ = ("topic", "body", "sequence")
+
+    def __init__(self, topic: str, body: bytes, sequence: int = None):
+        self.topic = topic
+        self.body = body
+        self.sequence = sequence
+
+    @property
+    def hash(self) -> Union[str, None]:
+        if self.topic in ("hashblock", "hashtx", "sequence"):
+            return self.body[:32].hex()
+        return None
+
+    @property
+    def label(self) -> Union[str, None]:
+        if self.topic == "sequence":
+            return chr(self.body[32])
+        return None
+
+    @property
+    def mempool_sequence(self) -> Union[int, None]:
+        if self.topic == "sequence" and len(self.body) == 41:
+            return struct.unpack("<Q", self.body[33:41])[0]
+        return None
+
+    def __repr__(self):
+        return "<Notification {} {} {}>".format(self.topic, self.hash or "{} bytes".format(len(self.body)),
+                                                self.label or "")
+
+
+class BaseSubscriber(ABC):
+    """
+        Dispatch loop shared by ZmqSubscriber and PollingSubscriber.
+        Notifications are consumed either by callbacks registered with subscribe and run by start (in a thread)
+        or run_forever, or by iterating the subscriber, synchronously or with ``async for``.
+        A gap in the sequence numbers of a topic (messages dropped by the publisher) is counted in ``missed``
+        and reported to the "gap" callbacks with the notification that revealed it.
+        The loop of run_forever and start survives errors: they are logged, counted in ``errors``, kept in
+        ``last_error`` and passed to the "error" callbacks, a failing receive is retried with exponential backoff.
+        Subclasses implement receive.
+        :param topics: topics to receive
+    """
+
+    def __init__(self, topics: Iterable[str]):
+        self.topics = tuple(topics)
+        for topic in self.topics:
+            if topic not in TOPICS:
+                raise ValueError("unknown topic {}, available: {}".format(topic, ", ".join(TOPICS)))
+        self.missed = 0
+        self.errors = 0
+        self.last_error = None
+        self._callbacks = {}
+        self._last_sequence = {}
+        self._running = False
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @abstractmethod
+    def receive(self, timeout: float = None) -> Union[Notification, None]:
+        """
+        Wait for the next notification
+        :param timeout: seconds, None waits forever
+        :return: the notification, None on timeout
+        """
+
+    def close(self):
+        self.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def subscribe(self, topic: str, callback: Callable[[Notification], None]):
+        """
+        Call ``callback(notification)`` for every notification of ``topic``
+        :param topic: one of TOPICS, "gap", or "error" whose callbacks get the exception raised in run_forever
+        :param callback:
+        :return:
+        """
+        if topic not in ("gap", "error") and topic not in self.topics:
+            raise ValueError("topic {} is not received by this subscriber".format(topic))
+        self._callbacks.setdefault(topic, []).append(callback)
+
+    def attach(self, cache=None, store=None, mempool=None, bitcoin=None):
+        """
+        Keep the library's structures in line with the notifications:
+        a MempoolMirror follows the sequence topic (or resyncs on every new block without it),
+        an RPCCache and a BlockStore drop what is above a disconnected block.
+        :param cache: RPCCache
+        :param store: BlockStore
+        :param mempool: MempoolMirror
+        :param bitcoin: BitCoin used to look up the height of disconnected blocks, required with cache or store
+        :return:
+        """
+        if (cache is not None or store is not None) and bitcoin is None:
+            raise ValueError("bitcoin is required to invalidate a cache or a store")
+        feeder = _Feeder(cache, store, mempool, bitcoin)
+        if "sequence" in self.topics:
+            self.subscribe("sequence", feeder.on_sequence)
+        elif mempool is not None and "hashblock" in self.topics:
+            self.subscribe("hashblock", lambda notification: mempool.sync())
+        self.subscribe("gap", feeder.on_gap)
+        return feeder
+
+    def dispatch(self, notification: Notification):
+        last = self._last_sequence.get(notification.topic)
+        if notification.sequence is not None:
+            if last is not None and notification.sequence != (last + 1) & 0xffffffff:
+                self.missed += (notification.sequence - last - 1) & 0xffffffff
+                for callback in self._callbacks.get("gap", []):
+                    callback(notification)
+            self._last_sequence[notification.topic] = notification.sequence
+        for callback in self._callbacks.get(notification.topic, []):
+            callback(notification)
+
+    def run_forever(self, poll_interval: float = 0.5, max_backoff: float = 30.0):
+        """
+        Receive and dispatch notifications until stop is called
+        :param poll_interval: how often stop is checked, and the first wait after a failed receive
+        :param max_backoff: longest wait between failed receives, the wait doubles on each consecutive failure
+        :return:
+        """
+        self._running = True
+        self._stopping.clear()
+        failures = 0
+        while self._running:
+            try:
+                notification = self.receive(poll_interval)
+            except Exception as e:
+                failures += 1
+                self._error(e, "receive failed ({} in a row)".format(failures))
+                self._stopping.wait(min(poll_interval * 2 ** (failures - 1), max_backoff))
+                continue
+            failures = 0
+            if notification is None:
+                continue
+            try:
+                self.dispatch(notification)
+            except Exception as e:
+                self._error(e, "callback failed on {!r}".format(notification))
+
+    def _error(self, error: Exception, message: str):
+        self.errors += 1
+        self.last_error = error
+        logger.error("subscriber %s: %s", message, error, exc_info=error)
+        for callback in self._callbacks.get("error", []):
+            try:
+                callback(error)
+            except Exception:
+                logger.exception("subscriber error callback failed")
+
+    def start(self):
+        """
+        Run the dispatch loop in a daemon thread
+        :return:
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self.run_forever, name="btc-subscriber", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._stopping.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def __iter__(self) -> Iterator[Notification]:
+        while True:
+            notification = self.receive()
+            if notification is not None:
+                self.dispatch(notification)
+                yield notification
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            notification = await loop.run_in_executor(None, self.receive, 0.5)
+            if notification is not None:
+                self.dispatch(notification)
+                yield notification
+
+
+class ZmqSubscriber(BaseSubscriber):
+    """
+        Subscriber of bitcoind's ZMQ notifications, requires pyzmq.
+        :param address: endpoint of every topic (eg "tcp://127.0.0.1:28332"), or a {topic: endpoint} dict when
+            the node publishes topics on different ports
+        :param topics: topics to receive, default are the keys of ``address`` or hashblock, rawtx and sequence
+        :param hwm: receive high water mark, messages beyond it are dropped and show up as gaps
+        :param context: zmq.Context to use, a new one is created when omitted
+    """
+
+    def __init__(self, address: Union[str, Dict[str, str]], topics: Iterable[str] = None, hwm: int = 10000,
+                 context=None):
+        if zmq is None:
+            raise ImportError("pyzmq is required for ZmqSubscriber, use PollingSubscriber without it")
+        if isinstance(address, str):
+            topics = topics or ("hashblock", "rawtx", "sequence")
+            endpoints = {topic: address for topic in topics}
+        else:
+            topics = topics or tuple(address)
+            endpoints = {topic: address[topic] for topic in topics}
+        super(ZmqSubscriber, self).__init__(topics)
+        self._own_context = context is None
+        self._context = context or zmq.Context()
+        self._poller = zmq.Poller()
+        self._sockets = []
+        for endpoint in sorted(set(endpoints.values())):
+            socket = self._context.socket(zmq.SUB)
+            socket.setsockopt(zmq.RCVHWM, hwm)
+            for topic, topic_endpoint in endpoints.items():
+                if topic_endpoint == endpoint:
+                    socket.setsockopt(zmq.SUBSCRIBE, topic.encode())
+            socket.connect(endpoint)
+            self._poller.register(socket, zmq.POLLIN)
+            self._sockets.append(socket)
+        self._ready = deque()
+
+    def receive(self, timeout: float = None) -> Union[Notification, None]:
+        if not self._ready:
+            events = self._poller.poll(None if timeout is None else int(timeout * 1000))
+            for socket, _ in events:
+                self._ready.append(socket.recv_multipart())
+            if not self._ready:
+                return None
+        frames = self._ready.popleft()
+        topic = frames[0].decode()
+        sequence = struct.unpack("<I", frames[2])[0] if len(frames) > 2 and len(frames[2]) == 4 else None
+        return Notification(topic, frames[1], sequence)
+
+    def close(self):
+        super(ZmqSubscriber, self).close()
+        for socket in self._sockets:
+            socket.close(linger=0)
+        self._sockets = []
+        if self._own_context:
+            self._context.term()
+
+
+class PollingSubscriber(BaseSubscriber):
+    """
+        Same interface as ZmqSubscriber for nodes without ZMQ, notifications are derived from polling
+        getbestblockhash and getrawmempool every ``interval`` seconds.
+        hashblock is emitted for every new tip (blocks connected in between are not reported one by one),
+        sequence emits C for a new tip and A / R for transactions entering and leaving the mempool,
+        hashtx and rawtx for transactions entering the mempool. rawblock is not supported.
+        :param bitcoin: BitCoin instance used to call the node
+        :param topics: topics to receive
+        :param interval: seconds between polls
+    """
+
+    def __init__(self, bitcoin, topics: Iterable[str] = ("hashblock", "rawtx", "sequence"), interval: float = 1.0):
+        super(PollingSubscriber, self).__init__(topics)
+        if "rawblock" in self.topics:
+            raise ValueError("rawblock is not supported by PollingSubscriber")
+        self._provider = bitcoin.provider
+        self.interval = interval
+        self._tip = None
+        self._mempool = None
+        self._sequence = {}
+        self._ready = deque()
+        self._next_poll = 0
+
+    def _emit(self, topic: str, body: bytes):
+        if topic in self.topics:
+            sequence = self._sequence.get(topic, 0)
+            self._sequence[topic] = (sequence + 1) & 0xffffffff
+            self._ready.append(Notification(topic, body, sequence))
+
+    def poll(self):
+        """
+        Poll the node once and queue the notifications of what changed since the previous poll
+        :return:
+        """
+        tip = self._provider.make_request(RPC.chain_getBestBlockHash)
+        if self._tip is not None and tip != self._tip:
+            self._emit("hashblock", bytes.fromhex(tip))
+            self._emit("sequence", bytes.fromhex(tip) + BLOCK_CONNECTED.encode())
+        self._tip = tip
+        if not {"hashtx", "rawtx", "sequence"} & set(self.topics):
+            return
+        mempool = set(self._provider.make_request(RPC.chain_getRawMemPool, [False]))
+        if self._mempool is not None:
+            added = [tx_id for tx_id in mempool if tx_id not in self._mempool]
+            for tx_id in self._mempool - mempool:
+                self._emit("sequence", bytes.fromhex(tx_id) + TX_REMOVED.encode())
+            raw = {}
+            if "rawtx" in self.topics and added:
+                responses = self._provider.make_batch_request([(RPC.raw_getRawTransaction, [tx_id])
+                                                               for tx_id in added])
+                # a transaction which already left the mempool has no raw transaction any more
+                raw = {tx_id: response.result() for tx_id, response in zip(added, responses)
+                       if response.error is None}
+            for tx_id in added:
+                self._emit("sequence", bytes.fromhex(tx_id) + TX_ADDED.encode())
+                self._emit("hashtx", bytes.fromhex(tx_id))
+                if tx_id in raw:
+                    self._emit("rawtx", bytes.fromhex(raw[tx_id]))
+        self._mempool = mempool
+
+    def receive(self, timeout: float = None) -> Union[Notification, None]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._ready:
+            wait = self._next_poll - time.monotonic()
+            if deadline is not None and time.monotonic() + max(wait, 0) > deadline:
+                time.sleep(max(deadline - time.monotonic(), 0))
+                return None
+            if wait > 0:
+                time.sleep(wait)
+            self._next_poll = time.monotonic() + self.interval
+            self.poll()
+        return self._ready.popleft()
+
+
+class _Feeder:
+    """
+        Applies notifications to a MempoolMirror, an RPCCache and a BlockStore, see BaseSubscriber.attach
+    """
+
+    def __init__(self, cache, store, mempool, bitcoin):
+        self.cache = cache
+        self.store = store
+        self.mempool = mempool
+        self._provider = bitcoin.provider if bitcoin is not None else None
+
+    def on_sequence(self, notification: Notification):
+        label = notification.label
+        if label == BLOCK_DISCONNECTED:
+            self._invalidate(notification.hash)
+        if self.mempool is None:
+            return
+        if label == TX_ADDED:
+            self.mempool.add([notification.hash])
+        elif label == TX_REMOVED:
+            self.mempool.discard([notification.hash])
+        else:
+            # mined transactions leave the mempool without an R notification
+            self.mempool.sync()
+
+    def on_gap(self, notification: Notification):
+        if self.mempool is not None:
+            self.mempool.sync()
+
+    def _invalidate(self, block_hash: str):
+        if self.cache is None and self.store is None:
+            return
+        height = self._provider.make_request(RPC.chain_getBLock, [block_hash, 1])["height"]
+        if self.cache is not None:
+            self.cache.invalidate_from(height)
+        if self.store is not None:
+            self.store.remove_from_height(height)
@@ -0,0 +1,479 @@
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Union
+from btc.coinselect import ADDRESS_TYPES, SEGWIT_OVERHEAD_WEIGHT, TX_OVERHEAD_WEIGHT, CoinSelector, \
+    InsufficientFunds, dust_threshold, output_weight
+from btc.encoding import SATOSHI
+from btc.providers import RPCError
+from btc.script import address_to_script
+from btc.transaction import Transaction
+
+"""
+Batched payouts: payments are queued and sent together with one send_many, or one locally funded PSBT, per batch.
+"""
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+# the node may or may not have sent the batch, see PayoutQueue.recover
+UNKNOWN = "unknown"
+
+# largest standard transaction
+MAX_STANDARD_TX_WEIGHT = 400000
+
+RPC_TYPE_ERROR = -3
+RPC_WALLET_ERROR = -4
+RPC_INVALID_ADDRESS_OR_KEY = -5
+RPC_WALLET_INSUFFICIENT_FUNDS = -6
+RPC_INVALID_PARAMETER = -8
+RPC_VERIFY_REJECTED = -26
+
+# errors caused by some payments of a batch (bad address, bad amount, balance), the batch is split to find them.
+# Other errors (locked wallet, fee estimation) are about the whole batch, it is left pending
+SPLIT_CODES = frozenset([RPC_TYPE_ERROR, RPC_INVALID_ADDRESS_OR_KEY, RPC_INVALID_PARAMETER,
+                         RPC_WALLET_INSUFFICIENT_FUNDS, RPC_VERIFY_REJECTED])
+# reasons of sendrawtransaction rejections (RPC_VERIFY_REJECTED) that are about the fee of the whole batch
+BATCH_REJECT_REASONS = ("min relay fee not met", "mempool min fee not met", "mempool full", "insufficient fee",
+                        "too-long-mempool-chain")
+
+
+class BatchTooLarge(RPCError):
+    """
+        The inputs selected for a PSBT batch make its transaction heavier than max_weight, the batch is split
+    """
+
+
+def _payment_error(error: RPCError) -> bool:
+    # whether some payments of the batch caused the error, rather than the batch as a whole
+    if isinstance(error, BatchTooLarge):
+        return True
+    if error.code == RPC_VERIFY_REJECTED:
+        return not any(reason in (error.message or "") for reason in BATCH_REJECT_REASONS)
+    return error.code in SPLIT_CODES
+
+
+class Payment:
+    """
+        A queued payment
+        :param key: idempotency key, a payment is sent once per key
+        :param address:
+        :param amount: satoshis
+        :param status: pending, sending, sent, failed or unknown
+        :param txid: transaction which paid it
+        :param batch: id of the last batch it was sent with, the comment of the send_many transaction
+        :param error: RPCError of a failed payment, or of the last attempt of a pending one
+    """
+    __slots__ = ("key", "address", "amount", "status", "txid", "batch", "error", "created")
+
+    def __init__(self, key: str, address: str, amount: int, created: float = None):
+        self.key = key
+        self.address = address
+        self.amount = amount
+        self.status = PENDING
+        self.txid = None
+        self.batch = None
+        self.error = None
+        self.created = time.time() if created is None else created
+
+    def __repr__(self):
+        return "<Payment {} {} {} {}>".format(self.key, self.address, self.amount, self.status)
+
+
+class PayoutQueue:
+    """
+        Collects payments and sends them in batches, a batch is flushed once it holds ``max_payments`` payments or
+        its oldest payment waited ``max_wait`` seconds (see poll and start).
+        A batch is sent with one send_many call, or with ``selector`` as a PSBT funded locally by the CoinSelector,
+        signed by the wallet and broadcast with sendrawtransaction.
+        Batches are chunked so the transaction stays under ``max_weight``: with send_many the node picks the inputs,
+        ``input_weight`` is reserved for them. Addresses paid twice go to different batches since send_many
+        rejects duplicated addresses.
+        When the node rejects a batch because of some of its payments (bad address or amount, insufficient funds)
+        the batch is split in halves which are sent again, a single payment rejected is marked failed, or left
+        pending on insufficient funds. Other errors (locked wallet, fee estimation failure, min relay fee or
+        mempool full rejections) leave the batch pending and are raised.
+        submit rejects the payments the node would always refuse (an amount not above zero or below the dust
+        threshold of the address, an address of another network), so they never hold up the queue.
+        With ``journal`` every submission and batch is appended to that file and replayed on creation, so a payment
+        key is never paid twice across restarts. A batch whose outcome was lost (eg a timeout of send_many) is
+        marked unknown until recover finds out whether the node sent it.
+        :param bitcoin: BitCoin instance used to call the node
+        :param wallet: wallet paying
+        :param max_payments: payments per batch
+        :param max_wait: seconds the oldest pending payment waits before a flush
+        :param max_weight: weight limit of a batch transaction
+        :param input_weight: weight reserved for the inputs of a send_many transaction
+        :param selector: CoinSelector funding PSBT batches, None to use send_many
+        :param journal: path of the journal file
+        :param conf_target: confirmation target of send_many
+        :param estimate_mode: fee estimate mode of send_many
+        :param replaceable: opt in to BIP125 replacement
+    """
+
+    def __init__(self, bitcoin, wallet: str, max_payments: int = 500, max_wait: float = 30.0,
+                 max_weight: int = MAX_STANDARD_TX_WEIGHT, input_weight: int = 100000, selector: CoinSelector = None,
+                 journal: str = None, conf_target: int = None, estimate_mode: str = "UNSET", replaceable: bool = True):
+        self._bitcoin = bitcoin
+        self.wallet = wallet
+        self.max_payments = max_payments
+        self.max_wait = max_wait
+        self.max_weight = max_weight
+        self.input_weight = input_weight
+        self.selector = selector
+        self.journal = journal
+        self.conf_target = conf_target
+        self.estimate_mode = estimate_mode
+        self.replaceable = replaceable
+        self.payments = {}
+        self._pending = []
+        self._batches = {}
+        self._callbacks = []
+        self._lock = threading.RLock()
+        self._running = False
+        self._thread = None
+        self._file = None
+        self.last_error = None
+        if journal is not None:
+            if os.path.exists(journal):
+                self._replay()
+            self._file = open(journal, "a")
+
+    def close(self):
+        self.stop()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def on_sent(self, callback: Callable[[str, List[Payment]], None]):
+        """
+        Call ``callback(txid, payments)`` after every batch sent
+        :param callback:
+        :return:
+        """
+        self._callbacks.append(callback)
+
+    def _log(self, record: dict):
+        if self._file is not None:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _replay(self):
+        with open(self.journal, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a partly written last record
+                    break
+                op = record["op"]
+                if op == "submit":
+                    self.payments[record["key"]] = Payment(record["key"], record["address"], record["amount"],
+                                                           record["time"])
+                elif op == "batch":
+                    self._batches[record["batch"]] = (record["keys"], record.get("txid"), record["time"])
+                    for key in record["keys"]:
+                        self.payments[key].status = UNKNOWN
+                        self.payments[key].batch = record["batch"]
+                elif op == "sent":
+                    self._batches.pop(record["batch"], None)
+                    for key in record["keys"]:
+                        self.payments[key].status = SENT
+                        self.payments[key].txid = record["txid"]
+                elif op == "failed":
+                    for key in record["keys"]:
+                        self.payments[key].status = FAILED
+                        self.payments[key].error = RPCError(record["error"])
+                elif op == "pending":
+                    self._batches.pop(record.get("batch"), None)
+                    for key in record["keys"]:
+                        self.payments[key].status = PENDING
+        self._pending = [payment for payment in self.payments.values() if payment.status == PENDING]
+
+    def submit(self, key: str, address: str, amount: int) -> Payment:
+        """
+        Queue a payment, submitting a key again returns the existing payment and sends nothing
+        :param key: idempotency key, eg the id of the withdrawal request
+        :param address:
+        :param amount: satoshis
+        :return:
+        :raises ValueError: invalid address, an amount not above zero or below the dust threshold
+        """
+        network = self.selector.network if self.selector is not None else "main"
+        if amount <= 0:
+            raise ValueError("payment {} has an amount of {}, it must be positive".format(key, amount))
+        try:
+            script = address_to_script(address, network)
+        except ValueError:
+            raise ValueError("payment {} has an invalid address {}".format(key, address))
+        dust = dust_threshold(script)
+        if amount < dust:
+            raise ValueError("payment {} of {} is below the dust threshold of {}".format(key, amount, dust))
+        with self._lock:
+            payment = self.payments.get(key)
+            if payment is not None:
+                if payment.address != address or payment.amount != amount:
+                    raise ValueError("payment {} was submitted with another address or amount".format(key))
+                return payment
+            payment = Payment(key, address, amount)
+            self._log({"op": "submit", "key": key, "address": address, "amount": amount, "time": payment.created})
+            self.payments[key] = payment
+            self._pending.append(payment)
+            full = len(self._pending) >= self.max_payments
+        if full:
+            self.flush()
+        return payment
+
+    def get(self, key: str) -> Union[Payment, None]:
+        return self.payments.get(key)
+
+    def due(self) -> bool:
+        """
+        Whether the oldest pending payment waited max_wait seconds
+        :return:
+        """
+        return bool(self._pending) and time.time() - self._pending[0].created >= self.max_wait
+
+    def poll(self) -> List[str]:
+        """
+        Flush when due
+        :return: txids sent
+        """
+        return self.flush() if self.due() else []
+
+    def _chunks(self, payments: List[Payment]) -> List[List[Payment]]:
+        reserved = TX_OVERHEAD_WEIGHT + SEGWIT_OVERHEAD_WEIGHT + self.input_weight
+        if self.selector is not None:
+            # the inputs of PSBT batches are known, the selection is checked against max_weight
+            reserved = TX_OVERHEAD_WEIGHT + SEGWIT_OVERHEAD_WEIGHT + self.selector.change_weight
+        network = self.selector.network if self.selector is not None else "main"
+        chunks = []
+        chunk = []
+        addresses = set()
+        weight = reserved
+        for payment in payments:
+            try:
+                payment_weight = output_weight(address_to_script(payment.address, network))
+            except ValueError:
+                # submitted before addresses were checked, left for the node to reject, it ends up failed alone
+                payment_weight = output_weight(bytes(34))
+            if chunk and (len(chunk) >= self.max_payments or weight + payment_weight > self.max_weight or
+                          payment.address in addresses):
+                chunks.append(chunk)
+                chunk = []
+                addresses = set()
+                weight = reserved
+            chunk.append(payment)
+            addresses.add(payment.address)
+            weight += payment_weight
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def flush(self) -> List[str]:
+        """
+        Send every pending payment now
+        :return: txids sent
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+            tx_ids = []
+            try:
+                for chunk in self._chunks(pending):
+                    tx_ids.extend(self._send_split(chunk))
+            finally:
+                # payments left pending and the ones of chunks not attempted after an error stay queued
+                self._pending = [payment for payment in pending if payment.status == PENDING] + self._pending
+            return tx_ids
+
+    def _send_split(self, chunk: List[Payment]) -> List[str]:
+        try:
+            return [self._send(chunk)]
+        except RPCError as e:
+            if not _payment_error(e):
+                raise
+            error = e
+        if len(chunk) == 1:
+            if error.code == RPC_WALLET_INSUFFICIENT_FUNDS:
+                # funds may come in later
+                chunk[0].error = error
+            else:
+                self._mark(chunk, FAILED, error)
+            return []
+        middle = len(chunk) // 2
+        tx_ids = self._send_split(chunk[:middle])
+        if error.code == RPC_WALLET_INSUFFICIENT_FUNDS and not tx_ids:
+            # pay what the balance allows, the second half waits instead of being split down as well
+            return []
+        return tx_ids + self._send_split(chunk[middle:])
+
+    def _mark(self, payments: List[Payment], status: str, error: RPCError = None, batch: str = None):
+        keys = [payment.key for payment in payments]
+        if status == FAILED:
+            self._log({"op": "failed", "keys": keys, "error": error.error})
+        elif status == PENDING:
+            self._log({"op": "pending", "keys": keys, "batch": batch})
+        for payment in payments:
+            payment.status = status
+            if error is not None:
+                payment.error = error
+
+    def _send(self, chunk: List[Payment]) -> str:
+        batch = "payout-" + uuid.uuid4().hex
+        keys = [payment.key for payment in chunk]
+        for payment in chunk:
+            payment.status = SENDING
+            payment.batch = batch
+        if self.selector is None:
+            self._log({"op": "batch", "batch": batch, "keys": keys, "time": time.time()})
+            amounts = {payment.address: payment.amount / SATOSHI for payment in chunk}
+            tx_id = self._call(chunk, batch, None, lambda: self._bitcoin.wallet.send_many(
+                self.wallet, "", amounts, 1, batch, None, self.replaceable, self.conf_target, self.estimate_mode))
+        else:
+            tx_id = self._send_psbt(chunk, batch, keys)
+        self._log({"op": "sent", "batch": batch, "keys": keys, "txid": tx_id})
+        for payment in chunk:
+            payment.status = SENT
+            payment.txid = tx_id
+            payment.error = None
+        for callback in self._callbacks:
+            callback(tx_id, chunk)
+        return tx_id
+
+    def _call(self, chunk: List[Payment], batch: str, tx_id: Union[str, None], call: Callable):
+        try:
+            return call()
+        except RPCError as e:
+            # the node answered, nothing was sent
+            self._mark(chunk, PENDING, batch=batch)
+            raise e
+        except Exception:
+            # the request may have reached the node
+            self._batches[batch] = ([payment.key for payment in chunk], tx_id, time.time())
+            self._mark(chunk, UNKNOWN)
+            raise
+
+    def _send_psbt(self, chunk: List[Payment], batch: str, keys: List[str]) -> str:
+        wallet = self._bitcoin.wallet
+        outputs = {payment.address: payment.amount for payment in chunk}
+        try:
+            selection = self.selector.select(outputs)
+        except InsufficientFunds as e:
+            self._mark(chunk, PENDING, batch=batch)
+            raise RPCError({"code": RPC_WALLET_INSUFFICIENT_FUNDS, "message": str(e)})
+        try:
+            if selection.weight > self.max_weight:
+                raise BatchTooLarge({"code": RPC_WALLET_ERROR, "message": "Transaction too large"})
+            psbt_outputs = [{payment.address: payment.amount / SATOSHI} for payment in chunk]
+            if selection.change:
+                # the type the selector reserved the weight and fee of the change output for
+                change_address = wallet.get_raw_change_address(self.wallet, ADDRESS_TYPES[self.selector.change_type])
+                psbt_outputs.append({change_address: selection.change / SATOSHI})
+            psbt = self._bitcoin.raw.create_psbt(selection.inputs, psbt_outputs, 0, self.replaceable)
+            signed = wallet.wallet_process_psbt(self.wallet, psbt)
+            final = self._bitcoin.raw.finalize_psbt(signed["psbt"])
+            if not final.get("complete"):
+                raise RPCError({"code": RPC_WALLET_ERROR, "message": "wallet could not sign the batch"})
+        except Exception:
+            # nothing was broadcast yet
+            self.selector.release(selection.indexes)
+            self._mark(chunk, PENDING, batch=batch)
+            raise
+        tx_id = Transaction.parse(final["hex"]).txid
+        self._log({"op": "batch", "batch": batch, "keys": keys, "txid": tx_id, "time": time.time()})
+        try:
+            return self._call(chunk, batch, tx_id, lambda: self._bitcoin.raw.send_raw_transaction(final["hex"]))
+        except RPCError:
+            self.selector.release(selection.indexes)
+            raise
+
+    def recover(self, lookback: float = 7200.0) -> Dict[str, str]:
+        """
+        Find out the outcome of the batches marked unknown: a send_many batch is looked up by its comment in the
+        wallet's transactions, a PSBT batch by its txid. Payments of batches the node did not send are pending again.
+        :param lookback: seconds before the oldest unknown batch where the wallet's transactions are searched
+        :return: batch -> txid of the batches found sent
+        """
+        with self._lock:
+            if not self._batches:
+                return {}
+            wallet = self._bitcoin.wallet
+            found = {}
+            comments = {}
+            for batch, (keys, tx_id, created) in self._batches.items():
+                if tx_id is None:
+                    comments[batch] = created
+                    continue
+                try:
+                    wallet.get_transaction(self.wallet, tx_id)
+                    found[batch] = tx_id
+                except RPCError as e:
+                    if e.code != RPC_INVALID_ADDRESS_OR_KEY:
+                        raise
+            if comments:
+                oldest = min(comments.values()) - lookback
+                for entry in wallet.iter_transactions(self.wallet):
+                    if entry.get("time", 0) < oldest:
+                        break
+                    if entry.get("comment") in comments:
+                        found[entry["comment"]] = entry["txid"]
+            for batch, (keys, tx_id, created) in list(self._batches.items()):
+                payments = [self.payments[key] for key in keys]
+                if batch in found:
+                    self._log({"op": "sent", "batch": batch, "keys": keys, "txid": found[batch]})
+                    for payment in payments:
+                        payment.status = SENT
+                        payment.txid = found[batch]
+                else:
+                    self._mark(payments, PENDING, batch=batch)
+                    self._pending.extend(payments)
+                del self._batches[batch]
+            return found
+
+    def run_forever(self, interval: float = None):
+        """
+        Flush due batches until stop is called, a failed flush is retried at the next check and its error kept in
+        ``last_error``
+        :param interval: how often the queue is checked, default is a quarter of max_wait
+        :return:
+        """
+        interval = self.max_wait / 4 if interval is None else interval
+        self._running = True
+        while self._running:
+            try:
+                self.poll()
+            except Exception as e:
+                self.last_error = e
+            time.sleep(interval)
+
+    def start(self, interval: float = None):
+        """
+        Run run_forever in a daemon thread
+        :param interval:
+        :return:
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self.run_forever, args=(interval,), name="btc-payout", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
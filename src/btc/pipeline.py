@@ -0,0 +1,164 @@
+import multiprocessing
+import os
+from collections import Counter, deque
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Iterable, Iterator, Tuple, Union
+from btc.block import HEADER_SIZE, Block
+from btc.script import script_type
+from btc.transaction import write_varint
+
+"""
+Block processing pipeline: raw blocks are fetched by threads (Chain.iter_blocks, verbosity 0), copied into
+slots of a shared memory segment and parsed by a pool of processes, so parsing is not limited to one core by
+the GIL and block bytes are never pickled. Results come back in height order.
+"""
+
+# largest serialized block allowed by consensus
+MAX_BLOCK_SERIALIZED_SIZE = 4000000
+
+COIN = 100000000
+
+# state of the pool processes
+_memory = None
+_extract = None
+
+
+def _init_worker(name: str, extract: Callable[[Block, int], Any]):
+    global _memory, _extract
+    _memory = SharedMemory(name=name)
+    _extract = extract
+
+
+def _run_extract(offset: int, length: int, height: int) -> Any:
+    return _extract(Block(_memory.buf[offset:offset + length]), height)
+
+
+def block_subsidy(height: int, halving_interval: int = 210000) -> int:
+    halvings = height // halving_interval
+    return 0 if halvings >= 64 else (50 * COIN) >> halvings
+
+
+def block_summary(block: Block, height: int, halving_interval: int = 210000) -> dict:
+    """
+    Extractor of the size, weight, output total and fees of a block. Fees are the coinbase outputs above the
+    subsidy, the fee of each transaction would need the spent outputs.
+    Use functools.partial to pass halving_interval (150 on regtest).
+    :param block:
+    :param height:
+    :param halving_interval:
+    :return:
+    """
+    weight = (HEADER_SIZE + len(write_varint(block.tx_count))) * 4
+    total_out = 0
+    coinbase_out = 0
+    n_outputs = 0
+    for index, tx in enumerate(block):
+        weight += tx.weight
+        value = sum(txout.value for txout in tx.outputs)
+        n_outputs += len(tx.outputs)
+        if index == 0:
+            coinbase_out = value
+        else:
+            total_out += value
+    subsidy = block_subsidy(height, halving_interval)
+    return {"height": height, "hash": block.hash, "time": block.header.time, "txs": block.tx_count,
+            "size": block.size, "weight": weight, "outputs": n_outputs, "total_out": total_out,
+            "subsidy": subsidy, "fees": coinbase_out - subsidy}
+
+
+def block_outputs(block: Block, height: int) -> list:
+    """
+    Extractor of every output of a block
+    :param block:
+    :param height:
+    :return: [(txid, vout, value, scriptPubKey bytes)]
+    """
+    return [(tx.txid, vout, txout.value, bytes(txout.script_pubkey))
+            for tx in block for vout, txout in enumerate(tx.outputs)]
+
+
+def script_type_counts(block: Block, height: int) -> Counter:
+    """
+    Extractor of the number of outputs of each script type in a block
+    """
+    return Counter(script_type(txout.script_pubkey)[0] for _, _, txout in block.iter_outputs())
+
+
+class BlockPipeline:
+    """
+        Runs ``extract(block, height)`` on many raw blocks with a process pool.
+        ``extract`` receives a Block whose buffer lives in shared memory and must return picklable data without
+        views of it (bytes(...) rather than memoryview). It must be importable by the pool processes, a module
+        level function or a functools.partial of one.
+        At most ``slots`` blocks are in flight, each slot holds up to ``slot_size`` bytes.
+        :param bitcoin: BitCoin instance used to fetch blocks, only needed by run
+        :param extract: function of (Block, height), see block_summary, block_outputs, script_type_counts
+        :param processes: number of processes parsing blocks, default is the number of cores
+        :param fetch_workers: number of threads fetching blocks
+        :param slots: number of shared memory slots, default is 2 * processes
+        :param slot_size: size of a slot in bytes
+        :param context: multiprocessing start method, default is the platform's
+    """
+
+    def __init__(self, bitcoin=None, extract: Callable[[Block, int], Any] = block_summary, processes: int = None,
+                 fetch_workers: int = 4, slots: int = None, slot_size: int = MAX_BLOCK_SERIALIZED_SIZE,
+                 context: str = None):
+        self._bitcoin = bitcoin
+        self.extract = extract
+        self.processes = processes or os.cpu_count() or 1
+        self.fetch_workers = fetch_workers
+        self.slots = slots or 2 * self.processes
+        self.slot_size = slot_size
+        self._context = multiprocessing.get_context(context)
+
+    def map(self, blocks: Iterable[Tuple[int, Union[str, bytes, memoryview]]]) -> Iterator[Tuple[int, Any]]:
+        """
+        Run the extractor on blocks given by the caller, eg read from a BlockStore
+        :param blocks: (height, raw block as hex, bytes or memoryview) pairs
+        :return: (height, result) pairs in the order of ``blocks``
+        """
+        memory = SharedMemory(create=True, size=self.slots * self.slot_size)
+        try:
+            with self._context.Pool(self.processes, _init_worker, (memory.name, self.extract)) as pool:
+                free = list(range(self.slots))
+                pending = deque()
+                for height, raw in blocks:
+                    if not free:
+                        yield self._collect(pending, free)
+                    data = bytes.fromhex(raw) if isinstance(raw, str) else raw
+                    if len(data) > self.slot_size:
+                        raise ValueError("block at height {} is larger than a slot ({} bytes)".format(
+                            height, self.slot_size))
+                    slot = free.pop()
+                    offset = slot * self.slot_size
+                    memory.buf[offset:offset + len(data)] = data
+                    pending.append((height, slot, pool.apply_async(_run_extract, (offset, len(data), height))))
+                while pending:
+                    yield self._collect(pending, free)
+        finally:
+            memory.close()
+            memory.unlink()
+
+    @staticmethod
+    def _collect(pending: deque, free: list) -> Tuple[int, Any]:
+        # results are taken oldest first, which keeps them in order
+        height, slot, result = pending.popleft()
+        try:
+            return height, result.get()
+        finally:
+            free.append(slot)
+
+    def run(self, start: int, stop: int) -> Iterator[Tuple[int, Any]]:
+        """
+        Fetch the blocks of heights [start, stop) and yield the extractor results in height order
+        :param start: first height
+        :param stop: height after the last one
+        :return: (height, result) pairs
+        """
+        blocks = self._bitcoin.chain.iter_blocks(start, stop, 0, self.fetch_workers,
+                                                 max(self.slots, self.fetch_workers * 4))
+        try:
+            for item in self.map(zip(range(start, stop), blocks)):
+                yield item
+        finally:
+            blocks.close()
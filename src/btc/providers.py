@@ -1,23 +1,237 @@
-from typing import Any, Union
+from typing import Any, Callable, Union, Iterable, List, Tuple
 import os
 import requests
 import itertools
-from btc.encoding import FriendlyCode
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from btc.cache import RPCCache
+from btc.encoding import FriendlyCode, get_json_backend
+from btc.rpc_abi import RPC_TIMEOUTS, IDEMPOTENT_METHODS
 from btc.types_btc import RPCEndpoint
+from btc.types_check import is_dict, is_list
+
+
+class RPCError(Exception):
+    """
+        Error returned by the node for a single JSON-RPC call
+    """
+
+    def __init__(self, error: Any):
+        super(RPCError, self).__init__(error)
+        self.error = error
+        if is_dict(error):
+            self.code = error.get("code")
+            self.message = error.get("message")
+        else:
+            self.code = None
+            self.message = str(error)
+
+
+class BatchResponse:
+    """
+        Placeholder for the result of a call queued in a batch, it is filled in once the batch has been sent
+    """
+
+    def __init__(self, method: RPCEndpoint, params: Any = None, rpcwallet: str = None, timeout: int = None):
+        self.method = method
+        self.params = params
+        self.rpcwallet = rpcwallet
+        self.timeout = timeout
+        self.done = False
+        self.error = None
+        self._result = None
+        self._transforms = []
+
+    def set_result(self, result: Any):
+        self._result = result
+        self.error = None
+        self.done = True
+
+    def set_error(self, error: Exception):
+        self._result = None
+        self.error = error
+        self.done = True
+
+    def result(self) -> Any:
+        """
+        Return the result of the call, raise its error if the node rejected it
+        :return:
+        """
+        if not self.done:
+            raise RuntimeError("batch containing {} has not been sent yet".format(self.method))
+        if self.error is not None:
+            raise self.error
+        result = self._result
+        for transform in self._transforms:
+            result = transform(result)
+        return result
+
+    def then(self, transform: Callable[[Any], Any]) -> "BatchResponse":
+        """
+        Apply ``transform`` to the node result when result() is called, after the transforms added before
+        :param transform:
+        :return: self
+        """
+        self._transforms.append(transform)
+        return self
+
+    def __repr__(self):
+        if not self.done:
+            state = "pending"
+        elif self.error is not None:
+            state = "error={!r}".format(self.error)
+        else:
+            state = "result={!r}".format(self._result)
+        return "<BatchResponse {} {}>".format(self.method, state)
+
+
+class RPCBatch:
+    """
+        Collects calls made through a provider and sends them as JSON-RPC arrays, one POST per wallet endpoint.
+        While the batch is active in a thread, every make_request of that thread (including the ones made by
+        Chain, Wallet and Raw helpers) returns a BatchResponse instead of the result.
+        Helpers that post-process the node result (eg Wallet.dump_wallet, Utils.validate_address) do it when
+        result() is called, see JSONBaseProvider.map_result.
+    """
+
+    def __init__(self, provider: "HttpProvider"):
+        self._provider = provider
+        self.responses = []
+
+    def add(self, method: RPCEndpoint, params: Any = None, rpcwallet: str = None, timeout: int = None) -> BatchResponse:
+        response = BatchResponse(method, params, rpcwallet, timeout)
+        self.responses.append(response)
+        return response
+
+    def send(self) -> List[BatchResponse]:
+        """
+        Send all queued calls, a failed call does not affect the others
+        :return: responses in the order the calls were queued
+        """
+        responses, self.responses = self.responses, []
+        # calls answered locally (see JSONBaseProvider.resolved) are already filled in
+        self._provider.send_batch([response for response in responses if not response.done])
+        return responses
+
+    def __enter__(self):
+        if self._provider.active_batch() is not None:
+            raise RuntimeError("a batch is already active in this thread")
+        self._provider._local.batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._provider._local.batch = None
+        if exc_type is None:
+            self.send()
 
 
 class JSONBaseProvider:
-    def __init__(self) -> None:
+    """Request timeout in second, methods of ``timeouts`` use their own timeout."""
+    timeout = 10
+    timeouts = RPC_TIMEOUTS
+
+    def __init__(self, json_backend: str = None, amount_mode: str = "float", cache: RPCCache = None) -> None:
         self.request_counter = itertools.count()
+        self.codec = FriendlyCode(get_json_backend(json_backend, amount_mode))
+        self.cache = cache
+
+    def active_batch(self) -> Union[RPCBatch, None]:
+        return None
+
+    def resolved(self, method: RPCEndpoint, params: Any, result: Any, rpcwallet: str = None) -> Any:
+        """
+        Return a result found without calling the node (eg in a BlockStore) the way make_request would return it:
+        as is, or inside an active batch as a BatchResponse already filled in
+        :param method: method the result answers
+        :param params:
+        :param result:
+        :param rpcwallet:
+        :return:
+        """
+        batch = self.active_batch()
+        if batch is None:
+            return result
+        response = batch.add(method, params, rpcwallet)
+        response.set_result(result)
+        return response
+
+    @staticmethod
+    def map_result(result: Any, transform: Callable[[Any], Any]) -> Any:
+        """
+        Post-process a make_request result: right away, or for the BatchResponse returned inside a batch, when its
+        result() is called
+        :param result: make_request result
+        :param transform:
+        :return:
+        """
+        if isinstance(result, BatchResponse):
+            return result.then(transform)
+        return transform(result)
+
+    def cache_lookup(self, method: RPCEndpoint, params: Any, rpcwallet: str = None) -> Tuple[bool, Any]:
+        if self.cache is None or rpcwallet or not self.cache.cacheable(method):
+            return False, None
+        return self.cache.get(method, params)
+
+    def cache_store(self, method: RPCEndpoint, params: Any, rpcwallet: str, result: Any, size: int):
+        if self.cache is not None and not rpcwallet:
+            self.cache.store(method, params, result, size)
+
+    def request_timeout(self, method: RPCEndpoint, timeout: int = None) -> int:
+        if timeout is not None:
+            return timeout
+        return self.timeouts.get(method, self.timeout)
 
     def decode_rpc_response(self, raw_response):
-        resp = FriendlyCode().json_decode(raw_response.text)
+        # decode the raw bytes directly, building the intermediate str of a multi-MB block is not free
+        return self.decode_rpc_body(raw_response.content)
+
+    def decode_rpc_body(self, body: Union[str, bytes]):
+        resp = self.codec.json_decode(body)
         error = resp.get("error")
         if error is None:
             res = resp.get("result")
             return res
         else:
-            raise Exception(error)
+            raise RPCError(error)
+
+    def decode_rpc_batch_response(self, raw_response, requests_by_id: dict):
+        return self.decode_rpc_batch_body(raw_response.content, requests_by_id)
+
+    def decode_rpc_batch_body(self, body: Union[str, bytes], requests_by_id: dict):
+        """
+        Match the responses of a JSON-RPC array back to their BatchResponse via id
+        :param body:
+        :param requests_by_id: request id -> BatchResponse
+        :return:
+        """
+        resp = self.codec.json_decode(body)
+        if not is_list(resp):
+            # the node rejected the whole batch, e.g. with a parse error
+            error = RPCError(resp.get("error") if is_dict(resp) else resp)
+            for response in requests_by_id.values():
+                response.set_error(error)
+            return
+        orphan_error = None
+        for item in resp:
+            if not is_dict(item):
+                continue
+            response = requests_by_id.pop(item.get("id"), None)
+            error = item.get("error")
+            if response is None:
+                # an entry the node could not parse is answered with a null id
+                if error is not None and orphan_error is None:
+                    orphan_error = RPCError(error)
+                continue
+            if error is None:
+                response.set_result(item.get("result"))
+            else:
+                response.set_error(RPCError(error))
+        for request_id, response in requests_by_id.items():
+            response.set_error(orphan_error or RPCError(
+                {"code": None, "message": "no response for request id {}".format(request_id)}))
+        requests_by_id.clear()
 
     def encode_rpc_request(self, method: RPCEndpoint, params: Any):
         rpc_dict = {
@@ -28,17 +242,75 @@ class JSONBaseProvider:
         }
         return rpc_dict
 
+    def wallet_uri(self, rpcwallet: str = None) -> str:
+        if rpcwallet:
+            return self.endpoint_uri + "/wallet/" + rpcwallet
+        return self.endpoint_uri
+
+    def encode_rpc_batch(self, responses: List[BatchResponse]):
+        requests_by_id = {}
+        payload = []
+        for response in responses:
+            rpc_dict = self.encode_rpc_request(response.method, response.params)
+            requests_by_id[rpc_dict["id"]] = response
+            payload.append(rpc_dict)
+        return payload, requests_by_id
+
+    def resolve_cached(self, responses: List[BatchResponse]) -> List[BatchResponse]:
+        """
+        Fill in the calls answered by the cache
+        :param responses:
+        :return: the calls which still have to be sent
+        """
+        if self.cache is None:
+            return responses
+        remaining = []
+        for response in responses:
+            found, res = self.cache_lookup(response.method, response.params, response.rpcwallet)
+            if found:
+                response.set_result(res)
+            else:
+                remaining.append(response)
+        return remaining
+
+    def cache_store_batch(self, responses: List[BatchResponse], size: int):
+        if self.cache is None:
+            return
+        # the size of single results is not known, share the response size evenly
+        size = size // max(len(responses), 1)
+        for response in responses:
+            if response.error is None:
+                # the node result, before the transforms of helpers
+                self.cache_store(response.method, response.params, response.rpcwallet, response._result, size)
+
+    @staticmethod
+    def group_batch(responses: List[BatchResponse]) -> dict:
+        """
+        Group queued calls by wallet, every wallet endpoint needs its own POST
+        :param responses:
+        :return: rpcwallet -> BatchResponse list
+        """
+        groups = {}
+        for response in responses:
+            groups.setdefault(response.rpcwallet, []).append(response)
+        return groups
+
 
 class HttpProvider(JSONBaseProvider):
     """
         An HTTP Provider for API request
         :param endpoint_uri: HTTP API URL base. Default value is ``"http://127.0.0.1:8332"``. Can also be configured via the ``BITCOIN_LOTUS_HTTP_PROVIDER_URI`` environment variable.
+        :param json_backend: JSON decoder, "orjson", "ujson" or "json", default is the fastest installed one
+        :param amount_mode: "float", "decimal" or "satoshi", see encoding.get_json_backend
+        :param cache: optional RPCCache for the results of immutable calls
         :return:
     """
 
     def __init__(self, rpcuser: str, rpcpassword: str, endpoint_uri: Union[str, dict] = None,
-                 ):
-        super(HttpProvider, self).__init__()
+                 pool_size: int = 10, pool_block: bool = True, retries: int = 3, backoff_factor: float = 0.2,
+                 timeout: int = 10, timeouts: dict = None, json_backend: str = None, amount_mode: str = "float",
+                 cache: RPCCache = None):
+        super(HttpProvider, self).__init__(json_backend, amount_mode, cache)
         if endpoint_uri is None:
             self.endpoint_uri = os.environ.get("BITCOIN_HTTP_PROVIDER_URI", "http://127.0.0.1:8332")
         elif isinstance(endpoint_uri, (str,)):
@@ -50,17 +322,109 @@ class HttpProvider(JSONBaseProvider):
         self.sess.headers = {
             "Content-Type": "application/json"
         }
+        # with pool_block, threads beyond pool_size wait for a free connection instead of opening throwaway ones
+        self.adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=pool_block)
+        self.sess.mount("http://", self.adapter)
+        self.sess.mount("https://", self.adapter)
         self.auth = (rpcuser, rpcpassword)
+        self._local = threading.local()
+
+        # idempotent read methods are sent again up to ``retries`` times, waiting backoff_factor * 2 ** n seconds
+        self.retries = retries
+        self.backoff_factor = backoff_factor
 
         """Request timeout in second."""
+        self.timeout = timeout
+        self.timeouts = dict(RPC_TIMEOUTS, **(timeouts or {}))
 
-    def make_request(self, method: RPCEndpoint, params: Any = None, rpcwallet: str = None, timeout: int = 10) -> Any:
+    def make_request(self, method: RPCEndpoint, params: Any = None, rpcwallet: str = None, timeout: int = None) -> Any:
+        batch = self.active_batch()
+        if batch is not None:
+            return batch.add(method, params, rpcwallet, timeout)
+        found, res = self.cache_lookup(method, params, rpcwallet)
+        if found:
+            return res
         json_dict = self.encode_rpc_request(method, params)
-        if rpcwallet:
-            uri = self.endpoint_uri + "/wallet/" + rpcwallet
-        else:
-            uri = self.endpoint_uri
-        resp = self.sess.post(uri, json=json_dict, timeout=timeout,
-                              auth=self.auth)
+        uri = self.wallet_uri(rpcwallet)
+        retries = self.retries if method in IDEMPOTENT_METHODS else 0
+        resp = self.post(uri, json_dict, self.request_timeout(method, timeout), retries)
         res = self.decode_rpc_response(resp)
+        self.cache_store(method, params, rpcwallet, res, len(resp.content))
         return res
+
+    def post(self, uri: str, payload: Any, timeout: int, retries: int = 0) -> requests.Response:
+        """
+        Post a JSON-RPC payload, connection errors, timeouts and busy responses are retried with exponential backoff
+        :param uri:
+        :param payload:
+        :param timeout:
+        :param retries: Maximum number of retries, only use it for idempotent methods
+        :return:
+        """
+        attempt = 0
+        while True:
+            try:
+                resp = self.sess.post(uri, json=payload, timeout=timeout, auth=self.auth)
+                # 503 is returned when the node's work queue is full
+                if resp.status_code not in (502, 503, 504) or attempt >= retries:
+                    return resp
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= retries:
+                    raise
+            time.sleep(self.backoff_factor * 2 ** attempt)
+            attempt += 1
+
+    def connection_stats(self) -> dict:
+        """
+        Connection reuse statistics of the connection pools currently held by the provider
+        :return: {"http://host:port": {"requests": n, "connections": n, "reused": n}}
+        """
+        stats = {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            uri = "{}://{}:{}".format(pool.scheme, pool.host, pool.port)
+            stats[uri] = {
+                "requests": pool.num_requests,
+                "connections": pool.num_connections,
+                "reused": pool.num_requests - pool.num_connections,
+            }
+        return stats
+
+    def active_batch(self) -> Union[RPCBatch, None]:
+        return getattr(self._local, "batch", None)
+
+    def batch(self) -> RPCBatch:
+        """
+        Create a batch, use it as a context manager to send all calls made inside the block in one POST.
+        eg:
+            with provider.batch():
+                hashes = [bitcoin.chain.get_block_hash(h) for h in range(100)]
+            hashes = [r.result() for r in hashes]
+        :return:
+        """
+        return RPCBatch(self)
+
+    def make_batch_request(self, calls: Iterable[Tuple[RPCEndpoint, Any]], rpcwallet: str = None,
+                           timeout: int = None) -> List[BatchResponse]:
+        """
+        Send many calls in one JSON-RPC array POST
+        :param calls: (method, params) pairs
+        :param rpcwallet: wallet endpoint used for all calls
+        :param timeout:
+        :return: BatchResponse list in the order of calls, call result() on each to get its result or error
+        """
+        responses = [BatchResponse(method, params, rpcwallet, timeout) for method, params in calls]
+        self.send_batch(responses)
+        return responses
+
+    def send_batch(self, responses: List[BatchResponse]):
+        for rpcwallet, group in self.group_batch(self.resolve_cached(responses)).items():
+            payload, requests_by_id = self.encode_rpc_batch(group)
+            timeout = max(self.request_timeout(response.method, response.timeout) for response in group)
+            retries = self.retries if all(response.method in IDEMPOTENT_METHODS for response in group) else 0
+            resp = self.post(self.wallet_uri(rpcwallet), payload, timeout, retries)
+            self.decode_rpc_batch_response(resp, requests_by_id)
+            self.cache_store_batch(group, len(resp.content))
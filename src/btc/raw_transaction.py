@@ -1,10 +1,13 @@
 from btc.rpc_abi import RPC
+from btc.signing import sign_transaction
+from btc.transaction import build_transaction, combine_transactions, decode_raw_transaction
 
 
 class Raw:
     def __init__(self, bitcoin):
         self._bitcoin = bitcoin
         self._provider = bitcoin.provider
+        self._store = getattr(bitcoin, "store", None)
 
     def get_raw_transaction(self, tx_id: str) -> str:
         """
@@ -12,17 +15,29 @@ class Raw:
         :param tx_id:
         :return:
         """
-        return self._provider.make_request(RPC.raw_getRawTransaction, [tx_id])
+        if self._store is not None:
+            hex_string = self._store.get_transaction(tx_id)
+            if hex_string is not None:
+                return self._provider.resolved(RPC.raw_getRawTransaction, [tx_id], hex_string)
+        hex_string = self._provider.make_request(RPC.raw_getRawTransaction, [tx_id])
+        if self._store is not None and isinstance(hex_string, str):
+            self._store.put_transaction(tx_id, hex_string)
+        return hex_string
 
-    def decode_raw_transaction(self, tran_info_hex: str) -> dict:
+    def decode_raw_transaction(self, tran_info_hex: str, local: bool = False, network: str = "main") -> dict:
         """
         Return a JSON object representing the serialized, hex-encoded transaction.
         :param tran_info_hex
+        :param local: parse the transaction in the library instead of sending it to the node
+        :param network: chain used to encode addresses when parsing locally, "main", "test", "signet" or "regtest"
         :return
         """
+        if local:
+            return decode_raw_transaction(tran_info_hex, network)
         return self._provider.make_request(RPC.raw_decodeRawTransaction, [tran_info_hex])
 
-    def create_raw_transaction(self, inputs: list, outputs: list, lock_time: int = 0, replaceable: bool = False):
+    def create_raw_transaction(self, inputs: list, outputs: list, lock_time: int = 0, replaceable: bool = False,
+                               local: bool = False, network: str = "main"):
         """
         Create a transaction spending the given inputs and creating new outputs.
         Outputs can be addresses or data.
@@ -30,8 +45,12 @@ class Raw:
         :param outputs:
         :param lock_time:
         :param replaceable:
+        :param local: serialize the transaction in the library instead of sending it to the node
+        :param network: chain of the output addresses when serializing locally
         :return:
         """
+        if local:
+            return build_transaction(inputs, outputs, lock_time, replaceable, network).serialize().hex()
         return self._provider.make_request(RPC.raw_createRawTransaction, [inputs, outputs, lock_time, replaceable])
 
     def fund_raw_transaction(self, hex_string: str, *args):
@@ -43,13 +62,17 @@ class Raw:
         """
         return self._provider.make_request(RPC.raw_fundRawTransaction, [hex_string, *args])
 
-    def combine_raw_transaction(self, transactions: [str]) -> str:
+    def combine_raw_transaction(self, transactions: [str], local: bool = False) -> str:
         """
         Combine multiple partially signed transactions into one transaction.
         :param transactions:
+        :param local: combine in the library, inputs take the first signature found, partial multisig
+            signatures are not merged
         :return:
         """
-        return self._provider.make_request(RPC.raw_combineRawTransaction, transactions)
+        if local:
+            return combine_transactions(transactions).serialize().hex()
+        return self._provider.make_request(RPC.raw_combineRawTransaction, [transactions])
 
     def send_raw_transaction(self, hex_string: str, allow_high_fees: bool = False):
         """
@@ -60,15 +83,20 @@ class Raw:
         """
         return self._provider.make_request(RPC.raw_sendRawTransaction, [hex_string, allow_high_fees])
 
-    def sign_raw_transaction(self, hex_string: str, private_keys: list, prev_txs: list, sign_hash_type: str = "ALL"):
+    def sign_raw_transaction(self, hex_string: str, private_keys: list, prev_txs: list, sign_hash_type: str = "ALL",
+                             local: bool = False):
         """
         Sign inputs for raw transaction (serialized, hex-encoded).
         :param hex_string: The transaction hex string
         :param private_keys: A json array of base58-encoded private keys for signing
         :param prev_txs: A json array of previous dependent transaction outputs
         :param sign_hash_type: The signature hash type. Must be one of: “ALL” “NONE” “SINGLE” “ALL|ANYONECANPAY” “NONE|ANYONECANPAY” “SINGLE|ANYONECANPAY”
+        :param local: sign P2PKH, P2WPKH, P2SH-P2WPKH and P2TR key path inputs in the library, the private keys
+            never reach the node
         :return:
         """
+        if local:
+            return sign_transaction(hex_string, private_keys, prev_txs, sign_hash_type)
         return self._provider.make_request(RPC.raw_signRawTransaction,
                                            [hex_string, private_keys, prev_txs, sign_hash_type])
 
@@ -5,7 +5,10 @@ class RPC:
     chain_getBestBlockHash = "getbestblockhash"
     chain_getBlockHash = "getblockhash"
     chain_getBLock = "getblock"
-    chain_getBlockStates = "getblockstates"
+    chain_getBlockHeader = "getblockheader"
+    chain_getBlockStats = "getblockstats"
+    # misspelled name of getblockstats, kept for existing callers
+    chain_getBlockStates = chain_getBlockStats
     chain_getBlockChainInfo = "getblockchaininfo"
     chain_getChainTips = "getchaintips"
     chain_getChainTxStats = "getchaintxstats"
@@ -99,4 +102,65 @@ class RPC:
     mine_generateToAddress = "generatetoaddress"
 
     # utils
-    util_validateAddress = "validateaddress"
\ No newline at end of file
+    util_validateAddress = "validateaddress"
+
+
+# seconds to wait for methods that are known to run longer than the default timeout
+RPC_TIMEOUTS = {
+    RPC.chain_getTxOutSetInfo: 180,
+    RPC.wallet_loadWallet: 180,
+    RPC.wallet_importWallet: 180,
+}
+
+# read only methods, safe to send again when a request failed on the way
+IDEMPOTENT_METHODS = frozenset([
+    RPC.chain_getBlockCount,
+    RPC.chain_getBestBlockHash,
+    RPC.chain_getBlockHash,
+    RPC.chain_getBLock,
+    RPC.chain_getBlockHeader,
+    RPC.chain_getBlockStats,
+    RPC.chain_getBlockChainInfo,
+    RPC.chain_getChainTips,
+    RPC.chain_getChainTxStats,
+    RPC.chain_getDifficulty,
+    RPC.chain_getMemPoolAncestors,
+    RPC.chain_getMemPoolDescendants,
+    RPC.chain_getMemPoolEntry,
+    RPC.chain_getMemPoolInfo,
+    RPC.chain_getRawMemPool,
+    RPC.chain_getTxOut,
+    RPC.chain_getTxOutProof,
+    RPC.chain_getTxOutSetInfo,
+    RPC.chain_verifyTxOutProof,
+    RPC.wallet_listWallets,
+    RPC.wallet_listWalletDir,
+    RPC.wallet_getAddressByLabel,
+    RPC.wallet_getAddressInfo,
+    RPC.wallet_getBalance,
+    RPC.wallet_getReceivedByAddress,
+    RPC.wallet_getReceivedByLabel,
+    RPC.wallet_getTransaction,
+    RPC.wallet_getWalletInfo,
+    RPC.wallet_listAddressGroupings,
+    RPC.wallet_listLabels,
+    RPC.wallet_listLockUnSpent,
+    RPC.wallet_listReceivedByAddress,
+    RPC.wallet_listReceivedByLabel,
+    RPC.wallet_listSinceBlock,
+    RPC.wallet_listTransactions,
+    RPC.wallet_listUnspent,
+    RPC.raw_getRawTransaction,
+    RPC.raw_decodeRawTransaction,
+    RPC.raw_createRawTransaction,
+    RPC.raw_combineRawTransaction,
+    RPC.raw_analyzePsbt,
+    RPC.raw_combinePsbt,
+    RPC.raw_convertToPsbt,
+    RPC.raw_createPsbt,
+    RPC.raw_decodePsbt,
+    RPC.raw_finalizePsbt,
+    RPC.raw_joinPsbts,
+    RPC.raw_utxoUpdatePsbt,
+    RPC.util_validateAddress,
+])
@@ -0,0 +1,468 @@
+import hashlib
+from typing import List, Tuple, Union
+
+"""
+Script disassembly, type detection, address and descriptor encoding, following Bitcoin Core's
+ScriptToAsmStr, Solver and InferDescriptor so that results match the RPC output.
+"""
+
+OP_0 = 0x00
+OP_PUSHDATA1 = 0x4c
+OP_PUSHDATA2 = 0x4d
+OP_PUSHDATA4 = 0x4e
+OP_1NEGATE = 0x4f
+OP_1 = 0x51
+OP_16 = 0x60
+OP_RETURN = 0x6a
+OP_DUP = 0x76
+OP_EQUAL = 0x87
+OP_EQUALVERIFY = 0x88
+OP_HASH160 = 0xa9
+OP_CHECKSIG = 0xac
+OP_CHECKMULTISIG = 0xae
+
+OP_NAMES = {
+    0x00: "0", 0x4c: "OP_PUSHDATA1", 0x4d: "OP_PUSHDATA2", 0x4e: "OP_PUSHDATA4", 0x4f: "-1",
+    0x50: "OP_RESERVED",
+    0x61: "OP_NOP", 0x62: "OP_VER", 0x63: "OP_IF", 0x64: "OP_NOTIF", 0x65: "OP_VERIF", 0x66: "OP_VERNOTIF",
+    0x67: "OP_ELSE", 0x68: "OP_ENDIF", 0x69: "OP_VERIFY", 0x6a: "OP_RETURN",
+    0x6b: "OP_TOALTSTACK", 0x6c: "OP_FROMALTSTACK", 0x6d: "OP_2DROP", 0x6e: "OP_2DUP", 0x6f: "OP_3DUP",
+    0x70: "OP_2OVER", 0x71: "OP_2ROT", 0x72: "OP_2SWAP", 0x73: "OP_IFDUP", 0x74: "OP_DEPTH", 0x75: "OP_DROP",
+    0x76: "OP_DUP", 0x77: "OP_NIP", 0x78: "OP_OVER", 0x79: "OP_PICK", 0x7a: "OP_ROLL", 0x7b: "OP_ROT",
+    0x7c: "OP_SWAP", 0x7d: "OP_TUCK",
+    0x7e: "OP_CAT", 0x7f: "OP_SUBSTR", 0x80: "OP_LEFT", 0x81: "OP_RIGHT", 0x82: "OP_SIZE",
+    0x83: "OP_INVERT", 0x84: "OP_AND", 0x85: "OP_OR", 0x86: "OP_XOR", 0x87: "OP_EQUAL", 0x88: "OP_EQUALVERIFY",
+    0x89: "OP_RESERVED1", 0x8a: "OP_RESERVED2",
+    0x8b: "OP_1ADD", 0x8c: "OP_1SUB", 0x8d: "OP_2MUL", 0x8e: "OP_2DIV", 0x8f: "OP_NEGATE", 0x90: "OP_ABS",
+    0x91: "OP_NOT", 0x92: "OP_0NOTEQUAL", 0x93: "OP_ADD", 0x94: "OP_SUB", 0x95: "OP_MUL", 0x96: "OP_DIV",
+    0x97: "OP_MOD", 0x98: "OP_LSHIFT", 0x99: "OP_RSHIFT", 0x9a: "OP_BOOLAND", 0x9b: "OP_BOOLOR",
+    0x9c: "OP_NUMEQUAL", 0x9d: "OP_NUMEQUALVERIFY", 0x9e: "OP_NUMNOTEQUAL", 0x9f: "OP_LESSTHAN",
+    0xa0: "OP_GREATERTHAN", 0xa1: "OP_LESSTHANOREQUAL", 0xa2: "OP_GREATERTHANOREQUAL", 0xa3: "OP_MIN",
+    0xa4: "OP_MAX", 0xa5: "OP_WITHIN",
+    0xa6: "OP_RIPEMD160", 0xa7: "OP_SHA1", 0xa8: "OP_SHA256", 0xa9: "OP_HASH160", 0xaa: "OP_HASH256",
+    0xab: "OP_CODESEPARATOR", 0xac: "OP_CHECKSIG", 0xad: "OP_CHECKSIGVERIFY", 0xae: "OP_CHECKMULTISIG",
+    0xaf: "OP_CHECKMULTISIGVERIFY",
+    0xb0: "OP_NOP1", 0xb1: "OP_CHECKLOCKTIMEVERIFY", 0xb2: "OP_CHECKSEQUENCEVERIFY", 0xb3: "OP_NOP4",
+    0xb4: "OP_NOP5", 0xb5: "OP_NOP6", 0xb6: "OP_NOP7", 0xb7: "OP_NOP8", 0xb8: "OP_NOP9", 0xb9: "OP_NOP10",
+    0xba: "OP_CHECKSIGADD", 0xff: "OP_INVALIDOPCODE",
+}
+for _n in range(1, 17):
+    OP_NAMES[OP_1 + _n - 1] = str(_n)
+
+SIGHASH_NAMES = {
+    0x01: "ALL", 0x02: "NONE", 0x03: "SINGLE",
+    0x81: "ALL|ANYONECANPAY", 0x82: "NONE|ANYONECANPAY", 0x83: "SINGLE|ANYONECANPAY",
+}
+
+# base58 prefixes and bech32 hrp of every chain
+NETWORKS = {
+    "main": {"pubkeyhash": 0x00, "scripthash": 0x05, "hrp": "bc"},
+    "test": {"pubkeyhash": 0x6f, "scripthash": 0xc4, "hrp": "tb"},
+    "testnet4": {"pubkeyhash": 0x6f, "scripthash": 0xc4, "hrp": "tb"},
+    "signet": {"pubkeyhash": 0x6f, "scripthash": 0xc4, "hrp": "tb"},
+    "regtest": {"pubkeyhash": 0x6f, "scripthash": 0xc4, "hrp": "bcrt"},
+}
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+BECH32_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+BECH32_CONST = 1
+BECH32M_CONST = 0x2bc830a3
+
+
+def sha256d(data: Union[bytes, memoryview]) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+def iter_ops(script: Union[bytes, memoryview]):
+    """
+    Walk the operations of a script
+    :param script:
+    :return: (opcode, pushed data or None) pairs, (None, None) once the script is malformed
+    """
+    i = 0
+    size = len(script)
+    while i < size:
+        opcode = script[i]
+        i += 1
+        if opcode > OP_PUSHDATA4:
+            yield opcode, None
+            continue
+        if opcode < OP_PUSHDATA1:
+            length = opcode
+        elif opcode == OP_PUSHDATA1:
+            if i + 1 > size:
+                yield None, None
+                return
+            length = script[i]
+            i += 1
+        elif opcode == OP_PUSHDATA2:
+            if i + 2 > size:
+                yield None, None
+                return
+            length = int.from_bytes(script[i:i + 2], "little")
+            i += 2
+        else:
+            if i + 4 > size:
+                yield None, None
+                return
+            length = int.from_bytes(script[i:i + 4], "little")
+            i += 4
+        if i + length > size:
+            yield None, None
+            return
+        yield opcode, bytes(script[i:i + length])
+        i += length
+
+
+def script_num(data: bytes) -> int:
+    if not data:
+        return 0
+    result = int.from_bytes(data, "little")
+    if data[-1] & 0x80:
+        return -(result & ~(0x80 << (8 * (len(data) - 1))))
+    return result
+
+
+def push_data(data: bytes) -> bytes:
+    """
+    Smallest push of ``data``, like CScript's operator<< for a byte vector
+    :param data:
+    :return:
+    """
+    size = len(data)
+    if size < OP_PUSHDATA1:
+        return bytes([size]) + data
+    if size <= 0xff:
+        return bytes([OP_PUSHDATA1, size]) + data
+    if size <= 0xffff:
+        return bytes([OP_PUSHDATA2]) + size.to_bytes(2, "little") + data
+    return bytes([OP_PUSHDATA4]) + size.to_bytes(4, "little") + data
+
+
+def is_valid_signature_encoding(sig: bytes) -> bool:
+    """
+    Strict DER check of BIP66, the sighash type byte is included in ``sig``
+    """
+    size = len(sig)
+    if size < 9 or size > 73:
+        return False
+    if sig[0] != 0x30 or sig[1] != size - 3:
+        return False
+    len_r = sig[3]
+    if 5 + len_r >= size:
+        return False
+    len_s = sig[5 + len_r]
+    if len_r + len_s + 7 != size:
+        return False
+    if sig[2] != 0x02 or len_r == 0 or sig[4] & 0x80:
+        return False
+    if len_r > 1 and sig[4] == 0x00 and not sig[5] & 0x80:
+        return False
+    if sig[len_r + 4] != 0x02 or len_s == 0 or sig[len_r + 6] & 0x80:
+        return False
+    if len_s > 1 and sig[len_r + 6] == 0x00 and not sig[len_r + 7] & 0x80:
+        return False
+    return True
+
+
+def script_to_asm(script: Union[bytes, memoryview], attempt_sighash_decode: bool = False) -> str:
+    """
+    Disassemble a script the way the node does, signatures of scriptSig get their sighash type decoded
+    :param script:
+    :param attempt_sighash_decode: True for scriptSig
+    :return:
+    """
+    unspendable = (len(script) > 0 and script[0] == OP_RETURN) or len(script) > 10000
+    out = []
+    for opcode, data in iter_ops(script):
+        if opcode is None:
+            out.append("[error]")
+            break
+        if data is None:
+            out.append(OP_NAMES.get(opcode, "OP_UNKNOWN"))
+        elif len(data) <= 4:
+            out.append(str(script_num(data)))
+        elif attempt_sighash_decode and not unspendable and data[-1] in SIGHASH_NAMES \
+                and is_valid_signature_encoding(data):
+            out.append(data[:-1].hex() + "[" + SIGHASH_NAMES[data[-1]] + "]")
+        else:
+            out.append(data.hex())
+    return " ".join(out)
+
+
+def _valid_pubkey_size(pubkey: bytes) -> bool:
+    if len(pubkey) == 33:
+        return pubkey[0] in (0x02, 0x03)
+    if len(pubkey) == 65:
+        return pubkey[0] in (0x04, 0x06, 0x07)
+    return False
+
+
+def witness_program(script: Union[bytes, memoryview]) -> Union[Tuple[int, bytes], None]:
+    size = len(script)
+    if size < 4 or size > 42:
+        return None
+    if script[0] != OP_0 and not OP_1 <= script[0] <= OP_16:
+        return None
+    if script[1] + 2 != size:
+        return None
+    version = 0 if script[0] == OP_0 else script[0] - OP_1 + 1
+    return version, bytes(script[2:])
+
+
+def _multisig(script: Union[bytes, memoryview]) -> Union[Tuple[int, List[bytes]], None]:
+    if len(script) < 1 or script[-1] != OP_CHECKMULTISIG:
+        return None
+    ops = list(iter_ops(script))
+    if len(ops) < 4 or not OP_1 <= ops[0][0] <= OP_16 or not OP_1 <= ops[-2][0] <= OP_16:
+        return None
+    keys = [data for _, data in ops[1:-2]]
+    if any(key is None or not _valid_pubkey_size(key) for key in keys):
+        return None
+    required = ops[0][0] - OP_1 + 1
+    if ops[-2][0] - OP_1 + 1 != len(keys) or required > len(keys):
+        return None
+    return required, keys
+
+
+def script_type(script: Union[bytes, memoryview]) -> Tuple[str, list]:
+    """
+    Classify a scriptPubKey like the node's Solver
+    :param script:
+    :return: (type name, solutions), solutions are the hash, program, pubkey or (m, keys) of the script
+    """
+    size = len(script)
+    if size == 25 and script[0] == OP_DUP and script[1] == OP_HASH160 and script[2] == 20 \
+            and script[23] == OP_EQUALVERIFY and script[24] == OP_CHECKSIG:
+        return "pubkeyhash", [bytes(script[3:23])]
+    if size == 23 and script[0] == OP_HASH160 and script[1] == 20 and script[22] == OP_EQUAL:
+        return "scripthash", [bytes(script[2:22])]
+    program = witness_program(script)
+    if program is not None:
+        version, data = program
+        if version == 0 and len(data) == 20:
+            return "witness_v0_keyhash", [data]
+        if version == 0 and len(data) == 32:
+            return "witness_v0_scripthash", [data]
+        if version == 1 and len(data) == 32:
+            return "witness_v1_taproot", [data]
+        if version == 1 and data == b"\x4e\x73":
+            return "anchor", []
+        if version != 0:
+            return "witness_unknown", [version, data]
+        return "nonstandard", []
+    if size >= 1 and script[0] == OP_RETURN and all(op is not None and op <= OP_16 for op, _ in
+                                                    iter_ops(script[1:])):
+        return "nulldata", []
+    if size in (35, 67) and script[0] == size - 2 and script[-1] == OP_CHECKSIG \
+            and _valid_pubkey_size(bytes(script[1:-1])):
+        return "pubkey", [bytes(script[1:-1])]
+    multisig = _multisig(script)
+    if multisig is not None:
+        return "multisig", list(multisig)
+    return "nonstandard", []
+
+
+def base58_encode(data: bytes) -> str:
+    n = int.from_bytes(data, "big")
+    out = []
+    while n:
+        n, rem = divmod(n, 58)
+        out.append(BASE58_ALPHABET[rem])
+    pad = len(data) - len(data.lstrip(b"\x00"))
+    return "1" * pad + "".join(reversed(out))
+
+
+def base58_decode(text: str) -> bytes:
+    n = 0
+    for c in text:
+        n = n * 58 + BASE58_ALPHABET.index(c)
+    pad = len(text) - len(text.lstrip("1"))
+    return b"\x00" * pad + (n.to_bytes((n.bit_length() + 7) // 8, "big") if n else b"")
+
+
+def base58check_encode(payload: bytes) -> str:
+    return base58_encode(payload + sha256d(payload)[:4])
+
+
+def base58check_decode(text: str) -> bytes:
+    data = base58_decode(text)
+    if len(data) < 4 or sha256d(data[:-4])[:4] != data[-4:]:
+        raise ValueError("invalid base58 checksum: {}".format(text))
+    return data[:-4]
+
+
+def _generator_table(generator: List[int]) -> List[int]:
+    # xor of the generators selected by each 5 bit value, so a polymod step is a single lookup
+    table = []
+    for top in range(32):
+        mask = 0
+        for i in range(5):
+            if (top >> i) & 1:
+                mask ^= generator[i]
+        table.append(mask)
+    return table
+
+
+BECH32_TABLE = _generator_table([0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3])
+
+
+def _bech32_polymod(values: List[int]) -> int:
+    chk = 1
+    for value in values:
+        chk = ((chk & 0x1ffffff) << 5 ^ value) ^ BECH32_TABLE[chk >> 25]
+    return chk
+
+
+def _bech32_hrp_expand(hrp: str) -> List[int]:
+    return [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+
+
+def _convert_bits(data: bytes, from_bits: int, to_bits: int, pad: bool = True) -> List[int]:
+    acc = 0
+    bits = 0
+    out = []
+    maxv = (1 << to_bits) - 1
+    for value in data:
+        acc = (acc << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            out.append((acc >> bits) & maxv)
+    if pad and bits:
+        out.append((acc << (to_bits - bits)) & maxv)
+    elif not pad and (bits >= from_bits or (acc << (to_bits - bits)) & maxv):
+        raise ValueError("invalid padding")
+    return out
+
+
+def segwit_address(hrp: str, version: int, program: bytes) -> str:
+    data = [version] + _convert_bits(program, 8, 5)
+    const = BECH32_CONST if version == 0 else BECH32M_CONST
+    polymod = _bech32_polymod(_bech32_hrp_expand(hrp) + data + [0] * 6) ^ const
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + "1" + "".join(BECH32_CHARSET[d] for d in data + checksum)
+
+
+def decode_segwit_address(hrp: str, address: str) -> Union[Tuple[int, bytes], None]:
+    address = address.lower()
+    pos = address.rfind("1")
+    if pos < 1 or address[:pos] != hrp or len(address) - pos < 7:
+        return None
+    try:
+        data = [BECH32_CHARSET.index(c) for c in address[pos + 1:]]
+    except ValueError:
+        return None
+    const = _bech32_polymod(_bech32_hrp_expand(hrp) + data)
+    version = data[0]
+    if const != (BECH32_CONST if version == 0 else BECH32M_CONST):
+        return None
+    try:
+        program = bytes(_convert_bits(data[1:-6], 5, 8, False))
+    except ValueError:
+        return None
+    if version > 16 or not 2 <= len(program) <= 40 or (version == 0 and len(program) not in (20, 32)):
+        return None
+    return version, program
+
+
+def script_address(script: Union[bytes, memoryview], network: str = "main",
+                   solved: Tuple[str, list] = None) -> Union[str, None]:
+    """
+    Address of a scriptPubKey, None for scripts without one (pubkey, multisig, nulldata, nonstandard)
+    :param script:
+    :param network:
+    :param solved: script_type result when it is already known
+    :return:
+    """
+    params = NETWORKS[network]
+    kind, solutions = solved or script_type(script)
+    if kind == "pubkeyhash":
+        return base58check_encode(bytes([params["pubkeyhash"]]) + solutions[0])
+    if kind == "scripthash":
+        return base58check_encode(bytes([params["scripthash"]]) + solutions[0])
+    if kind in ("witness_v0_keyhash", "witness_v0_scripthash", "witness_v1_taproot", "witness_unknown",
+                "anchor"):
+        version, program = witness_program(script)
+        return segwit_address(params["hrp"], version, program)
+    return None
+
+
+def address_to_script(address: str, network: str = "main") -> bytes:
+    """
+    scriptPubKey paying to an address
+    """
+    params = NETWORKS[network]
+    program = decode_segwit_address(params["hrp"], address)
+    if program is not None:
+        version, data = program
+        return bytes([OP_0 if version == 0 else OP_1 + version - 1, len(data)]) + data
+    payload = base58check_decode(address)
+    if len(payload) == 21 and payload[0] == params["pubkeyhash"]:
+        return bytes([OP_DUP, OP_HASH160, 20]) + payload[1:] + bytes([OP_EQUALVERIFY, OP_CHECKSIG])
+    if len(payload) == 21 and payload[0] == params["scripthash"]:
+        return bytes([OP_HASH160, 20]) + payload[1:] + bytes([OP_EQUAL])
+    raise ValueError("invalid {} address: {}".format(network, address))
+
+
+DESCRIPTOR_INPUT_CHARSET = "0123456789()[],'/*abcdefgh@:$%{}IJKLMNOPQRSTUVWXYZ&+-.;<=>?!^_|~" \
+                           "ijklmnopqrstuvwxyzABCDEFGH`#\"\\ "
+DESCRIPTOR_POSITIONS = {c: i for i, c in enumerate(DESCRIPTOR_INPUT_CHARSET)}
+DESCRIPTOR_TABLE = _generator_table([0xf5dee51989, 0xa9fdca3312, 0x1bab10e32d, 0x3706b1677a, 0x644d626ffd])
+
+
+def descriptor_checksum(desc: str) -> str:
+    symbols = []
+    groups = []
+    for c in desc:
+        value = DESCRIPTOR_POSITIONS[c]
+        symbols.append(value & 31)
+        groups.append(value >> 5)
+        if len(groups) == 3:
+            symbols.append(groups[0] * 9 + groups[1] * 3 + groups[2])
+            groups = []
+    if len(groups) == 1:
+        symbols.append(groups[0])
+    elif len(groups) == 2:
+        symbols.append(groups[0] * 3 + groups[1])
+    symbols.extend([0] * 8)
+    chk = 1
+    for value in symbols:
+        chk = ((chk & 0x7ffffffff) << 5 ^ value) ^ DESCRIPTOR_TABLE[chk >> 35]
+    chk ^= 1
+    return "".join(BECH32_CHARSET[(chk >> (5 * (7 - i))) & 31] for i in range(8))
+
+
+def script_descriptor(script: Union[bytes, memoryview], network: str = "main",
+                      solved: Tuple[str, list] = None) -> str:
+    """
+    Descriptor inferred from a scriptPubKey without any key information, with checksum
+    """
+    kind, solutions = solved or script_type(script)
+    if kind == "pubkey":
+        desc = "pk({})".format(solutions[0].hex())
+    elif kind == "multisig":
+        desc = "multi({},{})".format(solutions[0], ",".join(key.hex() for key in solutions[1]))
+    elif kind == "witness_v1_taproot":
+        desc = "rawtr({})".format(solutions[0].hex())
+    else:
+        address = script_address(script, network, (kind, solutions))
+        desc = "addr({})".format(address) if address is not None else "raw({})".format(bytes(script).hex())
+    return desc + "#" + descriptor_checksum(desc)
+
+
+def script_pub_key_to_dict(script: Union[bytes, memoryview], network: str = "main") -> dict:
+    """
+    The scriptPubKey object of decoderawtransaction and getblock
+    """
+    solved = script_type(script)
+    out = {
+        "asm": script_to_asm(script),
+        "desc": script_descriptor(script, network, solved),
+        "hex": bytes(script).hex(),
+    }
+    address = script_address(script, network, solved)
+    if address is not None:
+        out["address"] = address
+    out["type"] = solved[0]
+    return out
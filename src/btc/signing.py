@@ -0,0 +1,323 @@
+import hashlib
+import struct
+from typing import Dict, List, Tuple, Union
+from btc.ecc import hash160, public_key, sign_ecdsa, sign_schnorr, tagged_hash, taproot_output_key, \
+    taproot_tweak_secret, x_only_public_key
+from btc.encoding import to_satoshi
+from btc.script import OP_CHECKSIG, OP_DUP, OP_EQUALVERIFY, OP_HASH160, OP_PUSHDATA1, OP_PUSHDATA2, OP_PUSHDATA4, \
+    base58check_decode, iter_ops, push_data, sha256d
+from btc.transaction import Transaction, TxIn, TxOut, write_varint
+
+"""
+Signature hashes (legacy, BIP143 and BIP341 key path) and local signing of P2PKH, P2WPKH, P2SH-P2WPKH and
+P2TR (BIP86 key path) inputs with private keys, the local counterpart of signrawtransactionwithkey.
+"""
+
+SIGHASH_DEFAULT = 0x00
+SIGHASH_ALL = 0x01
+SIGHASH_NONE = 0x02
+SIGHASH_SINGLE = 0x03
+SIGHASH_ANYONECANPAY = 0x80
+
+SIGHASH_TYPES = {
+    "DEFAULT": SIGHASH_DEFAULT, "ALL": SIGHASH_ALL, "NONE": SIGHASH_NONE, "SINGLE": SIGHASH_SINGLE,
+    "ALL|ANYONECANPAY": SIGHASH_ALL | SIGHASH_ANYONECANPAY, "NONE|ANYONECANPAY": SIGHASH_NONE | SIGHASH_ANYONECANPAY,
+    "SINGLE|ANYONECANPAY": SIGHASH_SINGLE | SIGHASH_ANYONECANPAY,
+}
+
+OP_CODESEPARATOR = 0xab
+
+# sighash of the legacy SIGHASH_SINGLE bug, the number one
+SIGHASH_ONE = (1).to_bytes(32, "little")
+
+WIF_PREFIXES = {0x80: "main", 0xef: "test"}
+
+
+def decode_wif(wif: str) -> Tuple[bytes, bool]:
+    """
+    Private key of a WIF string
+    :param wif:
+    :return: (32 bytes secret, compressed public key)
+    """
+    payload = base58check_decode(wif)
+    if payload[0] not in WIF_PREFIXES or len(payload) not in (33, 34) or len(payload) == 34 and payload[33] != 1:
+        raise ValueError("Invalid private key encoding")
+    return payload[1:33], len(payload) == 34
+
+
+def _sha256(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
+
+
+def _outpoint(txin: TxIn) -> bytes:
+    return bytes(txin.prev_txid) + struct.pack("<I", txin.vout)
+
+
+def _without_codeseparators(script: bytes) -> bytes:
+    if OP_CODESEPARATOR not in script:
+        return script
+    out = bytearray()
+    for op, data in iter_ops(script):
+        if op is None:
+            # malformed scripts are hashed as they are
+            return script
+        if op == OP_CODESEPARATOR:
+            continue
+        out.append(op)
+        if op == OP_PUSHDATA1:
+            out.append(len(data))
+        elif op == OP_PUSHDATA2:
+            out += struct.pack("<H", len(data))
+        elif op == OP_PUSHDATA4:
+            out += struct.pack("<I", len(data))
+        if data is not None:
+            out += data
+    return bytes(out)
+
+
+class SighashCache:
+    """
+        Signature hashes of the inputs of one transaction. The hashes shared by every input (BIP143 hashPrevouts,
+        hashSequence, hashOutputs and their BIP341 single SHA256 counterparts) are computed once.
+        :param tx: transaction being signed
+        :param spent_outputs: TxOut spent by each input, required by BIP143 (amount) and BIP341 (every input)
+    """
+
+    def __init__(self, tx: Transaction, spent_outputs: List[Union[TxOut, None]] = None):
+        self.tx = tx
+        self.spent_outputs = spent_outputs
+        self._shared = {}
+
+    def _single_hashes(self) -> Dict[str, bytes]:
+        # SHA256 of the prevouts, sequences and outputs, BIP143 hashes them once more
+        if "prevouts" not in self._shared:
+            tx = self.tx
+            self._shared["prevouts"] = _sha256(b"".join(_outpoint(txin) for txin in tx.inputs))
+            self._shared["sequences"] = _sha256(b"".join(struct.pack("<I", txin.sequence) for txin in tx.inputs))
+            self._shared["outputs"] = _sha256(b"".join(txout.serialize() for txout in tx.outputs))
+        return self._shared
+
+    def legacy(self, index: int, script_code: bytes, hash_type: int) -> bytes:
+        """
+        Signature hash of SigVersion::BASE
+        :param index: input index
+        :param script_code: scriptPubKey, or redeem script, being satisfied
+        :param hash_type:
+        :return:
+        """
+        tx = self.tx
+        base_type = hash_type & 0x1f
+        if index >= len(tx.inputs) or base_type == SIGHASH_SINGLE and index >= len(tx.outputs):
+            return SIGHASH_ONE
+        anyone_can_pay = hash_type & SIGHASH_ANYONECANPAY
+        out = [struct.pack("<i", tx.version)]
+        positions = [index] if anyone_can_pay else range(len(tx.inputs))
+        out.append(write_varint(len(positions)))
+        script_code = _without_codeseparators(bytes(script_code))
+        for i in positions:
+            txin = tx.inputs[i]
+            out.append(_outpoint(txin))
+            if i == index:
+                out.append(write_varint(len(script_code)) + script_code)
+            else:
+                out.append(b"\x00")
+            if i != index and base_type in (SIGHASH_NONE, SIGHASH_SINGLE):
+                out.append(b"\x00\x00\x00\x00")
+            else:
+                out.append(struct.pack("<I", txin.sequence))
+        if base_type == SIGHASH_NONE:
+            out.append(b"\x00")
+        elif base_type == SIGHASH_SINGLE:
+            out.append(write_varint(index + 1))
+            # outputs before the signed one are blanked to a value of -1 and an empty script
+            out.append((b"\xff" * 8 + b"\x00") * index)
+            out.append(tx.outputs[index].serialize())
+        else:
+            out.append(write_varint(len(tx.outputs)))
+            out.extend(txout.serialize() for txout in tx.outputs)
+        out.append(struct.pack("<I", tx.locktime))
+        out.append(struct.pack("<i", hash_type))
+        return sha256d(b"".join(out))
+
+    def segwit_v0(self, index: int, script_code: bytes, amount: int, hash_type: int) -> bytes:
+        """
+        BIP143 signature hash
+        :param index: input index
+        :param script_code: P2PKH script of the key for P2WPKH, the witness script for P2WSH
+        :param amount: satoshis of the spent output
+        :param hash_type:
+        :return:
+        """
+        tx = self.tx
+        base_type = hash_type & 0x1f
+        anyone_can_pay = hash_type & SIGHASH_ANYONECANPAY
+        zero = bytes(32)
+        shared = self._single_hashes()
+        hash_prevouts = zero if anyone_can_pay else _sha256(shared["prevouts"])
+        hash_sequence = zero if anyone_can_pay or base_type in (SIGHASH_NONE, SIGHASH_SINGLE) else \
+            _sha256(shared["sequences"])
+        if base_type not in (SIGHASH_NONE, SIGHASH_SINGLE):
+            hash_outputs = _sha256(shared["outputs"])
+        elif base_type == SIGHASH_SINGLE and index < len(tx.outputs):
+            hash_outputs = sha256d(tx.outputs[index].serialize())
+        else:
+            hash_outputs = zero
+        txin = tx.inputs[index]
+        return sha256d(struct.pack("<i", tx.version) + hash_prevouts + hash_sequence + _outpoint(txin) +
+                       write_varint(len(script_code)) + bytes(script_code) + struct.pack("<q", amount) +
+                       struct.pack("<I", txin.sequence) + hash_outputs + struct.pack("<I", tx.locktime) +
+                       struct.pack("<I", hash_type))
+
+    def taproot(self, index: int, hash_type: int = SIGHASH_DEFAULT) -> bytes:
+        """
+        BIP341 signature hash of a key path spend without annex
+        :param index: input index
+        :param hash_type:
+        :return:
+        """
+        if hash_type not in SIGHASH_TYPES.values():
+            raise ValueError("invalid taproot hash type {}".format(hash_type))
+        if self.spent_outputs is None or any(txout is None for txout in self.spent_outputs):
+            raise ValueError("taproot signature hashes need the outputs spent by every input")
+        tx = self.tx
+        output_type = hash_type & 3 or SIGHASH_ALL
+        anyone_can_pay = hash_type & SIGHASH_ANYONECANPAY
+        out = [bytes([0, hash_type]), struct.pack("<i", tx.version), struct.pack("<I", tx.locktime)]
+        if not anyone_can_pay:
+            shared = self._single_hashes()
+            if "amounts" not in self._shared:
+                self._shared["amounts"] = _sha256(b"".join(struct.pack("<q", txout.value)
+                                                           for txout in self.spent_outputs))
+                self._shared["scripts"] = _sha256(b"".join(write_varint(len(txout.script_pubkey)) +
+                                                           bytes(txout.script_pubkey)
+                                                           for txout in self.spent_outputs))
+            out += [shared["prevouts"], shared["amounts"], shared["scripts"], shared["sequences"]]
+        if output_type == SIGHASH_ALL:
+            out.append(self._single_hashes()["outputs"])
+        # spend type: key path, no annex
+        out.append(b"\x00")
+        txin = tx.inputs[index]
+        if anyone_can_pay:
+            spent = self.spent_outputs[index]
+            out += [_outpoint(txin), spent.serialize(), struct.pack("<I", txin.sequence)]
+        else:
+            out.append(struct.pack("<I", index))
+        if output_type == SIGHASH_SINGLE:
+            if index >= len(tx.outputs):
+                raise ValueError("SIGHASH_SINGLE input {} has no matching output".format(index))
+            out.append(_sha256(tx.outputs[index].serialize()))
+        return tagged_hash("TapSighash", b"".join(out))
+
+
+def p2pkh_script(key_hash: bytes) -> bytes:
+    return bytes([OP_DUP, OP_HASH160, 20]) + key_hash + bytes([OP_EQUALVERIFY, OP_CHECKSIG])
+
+
+class KeyStore:
+    """
+        Private keys indexed by the scripts they can spend: P2PKH (with the compression of the WIF), and for
+        compressed keys P2WPKH, P2SH-P2WPKH and BIP86 P2TR.
+        :param keys: WIF strings, or (32 bytes secret, compressed) tuples
+    """
+
+    def __init__(self, keys: List[Union[str, Tuple[bytes, bool]]]):
+        # scriptPubKey -> (kind, secret, public key, redeem script)
+        self.scripts = {}
+        for key in keys:
+            secret, compressed = decode_wif(key) if isinstance(key, str) else key
+            self.add(secret, compressed)
+
+    def add(self, secret: bytes, compressed: bool = True):
+        pub = public_key(secret, compressed)
+        key_hash = hash160(pub)
+        self.scripts[p2pkh_script(key_hash)] = ("pubkeyhash", secret, pub, None)
+        if not compressed:
+            return
+        witness_script = b"\x00\x14" + key_hash
+        self.scripts[witness_script] = ("witness_v0_keyhash", secret, pub, None)
+        self.scripts[b"\xa9\x14" + hash160(witness_script) + b"\x87"] = ("scripthash", secret, pub, witness_script)
+        output_key = taproot_output_key(x_only_public_key(secret))
+        self.scripts[b"\x51\x20" + output_key] = ("witness_v1_taproot", secret, pub, None)
+
+
+def _prev_outputs(tx: Transaction, prev_txs: List[dict]) -> List[Union[TxOut, None]]:
+    by_outpoint = {}
+    for prev in prev_txs:
+        amount = prev.get("amount")
+        by_outpoint[(prev["txid"], prev["vout"])] = TxOut(to_satoshi(amount) if amount is not None else None,
+                                                          bytes.fromhex(prev["scriptPubKey"]))
+    return [by_outpoint.get((txin.txid, txin.vout)) for txin in tx.inputs]
+
+
+def _input_error(txin: TxIn, message: str) -> dict:
+    return {"txid": txin.txid, "vout": txin.vout, "witness": [bytes(item).hex() for item in txin.witness],
+            "scriptSig": bytes(txin.script_sig).hex(), "sequence": txin.sequence, "error": message}
+
+
+def sign_transaction(tx: Union[str, bytes, Transaction], keys: Union[KeyStore, List[str]], prev_txs: List[dict],
+                     sighash_type: str = "ALL", aux: bytes = None) -> dict:
+    """
+    Local equivalent of signrawtransactionwithkey. ECDSA signatures are the node's bytes for the same keys
+    (RFC6979 nonce grinded to a low R), Schnorr signatures use random auxiliary data like the node unless
+    ``aux`` is given, so they are valid but differ from the node's.
+    Inputs that cannot be signed keep their scriptSig and witness, and only count as complete when they have some.
+    :param tx: transaction, hex, bytes or parsed
+    :param keys: WIF private keys, or a KeyStore to reuse across transactions
+    :param prev_txs: outputs spent by the inputs, [{"txid", "vout", "scriptPubKey", "amount"}], the amount is
+        required for segwit inputs and every output spent is required to sign a taproot input
+    :param sighash_type: "ALL", "NONE", "SINGLE", their "|ANYONECANPAY" variants, or "DEFAULT"
+    :param aux: auxiliary randomness of Schnorr signatures
+    :return: {"hex", "complete", "errors"} like the node, errors only when some input is not complete
+    """
+    if not isinstance(tx, Transaction):
+        tx = Transaction.parse(tx)
+    store = keys if isinstance(keys, KeyStore) else KeyStore(keys)
+    if sighash_type not in SIGHASH_TYPES:
+        raise ValueError("{} is not a valid sighash parameter.".format(sighash_type))
+    hash_type = SIGHASH_TYPES[sighash_type]
+    # the transaction is rebuilt, the inputs of a parsed one are views of its buffer
+    tx = Transaction(tx.version, [TxIn(txin.prev_txid, txin.vout, bytes(txin.script_sig), txin.sequence,
+                                       [bytes(item) for item in txin.witness]) for txin in tx.inputs],
+                     tx.outputs, tx.locktime)
+    spent = _prev_outputs(tx, prev_txs)
+    cache = SighashCache(tx, spent)
+    errors = []
+    for index, (txin, prev) in enumerate(zip(tx.inputs, spent)):
+        if prev is None:
+            errors.append(_input_error(txin, "Input not found or already spent"))
+            continue
+        found = store.scripts.get(bytes(prev.script_pubkey))
+        if found is None:
+            if not txin.script_sig and not txin.witness:
+                errors.append(_input_error(txin, "Unable to sign input, invalid stack size (possibly missing key)"))
+            continue
+        kind, secret, pub, redeem_script = found
+        if kind != "pubkeyhash" and prev.value is None:
+            errors.append(_input_error(txin, "Missing amount"))
+            continue
+        if kind == "witness_v1_taproot":
+            try:
+                digest = cache.taproot(index, hash_type)
+            except ValueError as e:
+                errors.append(_input_error(txin, str(e)))
+                continue
+            signature = sign_schnorr(taproot_tweak_secret(secret), digest, aux)
+            txin.script_sig = b""
+            txin.witness = [signature + (bytes([hash_type]) if hash_type else b"")]
+            continue
+        if hash_type == SIGHASH_DEFAULT:
+            hash_type_byte = SIGHASH_ALL
+        else:
+            hash_type_byte = hash_type
+        if kind == "pubkeyhash":
+            digest = cache.legacy(index, prev.script_pubkey, hash_type_byte)
+            txin.script_sig = push_data(sign_ecdsa(secret, digest) + bytes([hash_type_byte])) + push_data(pub)
+            txin.witness = []
+            continue
+        digest = cache.segwit_v0(index, p2pkh_script(hash160(pub)), prev.value, hash_type_byte)
+        txin.witness = [sign_ecdsa(secret, digest) + bytes([hash_type_byte]), pub]
+        txin.script_sig = push_data(redeem_script) if kind == "scripthash" else b""
+    result = {"hex": tx.serialize().hex(), "complete": not errors}
+    if errors:
+        result["errors"] = errors
+    return result
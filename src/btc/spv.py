@@ -0,0 +1,279 @@
+import os
+import struct
+import threading
+from typing import Iterable, List, Tuple, Union
+from btc.block import HEADER_SIZE, BlockHeader, bits_to_target
+from btc.rpc_abi import RPC
+from btc.script import sha256d
+from btc.transaction import as_buffer, read_varint
+
+"""
+Offline verification of gettxoutproof proofs against a local chain of block headers.
+"""
+
+
+class InvalidProof(ValueError):
+    """
+        A proof which is malformed, does not commit to its header, or whose block is not in the header chain
+    """
+
+
+def check_proof_of_work(header: Union[bytes, memoryview], bits: int = None) -> bool:
+    if bits is None:
+        bits = int.from_bytes(header[72:76], "little")
+    return int.from_bytes(sha256d(header), "little") <= bits_to_target(bits)
+
+
+class MerkleBlock:
+    """
+        A merkle block as returned by gettxoutproof: a header and the partial merkle tree of the matched transactions
+    """
+    __slots__ = ("header", "total_txs", "hashes", "flags")
+
+    def __init__(self, header: BlockHeader, total_txs: int, hashes: List[bytes], flags: bytes):
+        self.header = header
+        self.total_txs = total_txs
+        self.hashes = hashes
+        self.flags = flags
+
+    @classmethod
+    def parse(cls, data: Union[bytes, bytearray, memoryview, str]) -> "MerkleBlock":
+        buf = as_buffer(data)
+        try:
+            header = BlockHeader.parse(buf)
+            total_txs = int.from_bytes(buf[HEADER_SIZE:HEADER_SIZE + 4], "little")
+            n_hashes, offset = read_varint(buf, HEADER_SIZE + 4)
+            hashes = [bytes(buf[offset + 32 * i:offset + 32 * i + 32]) for i in range(n_hashes)]
+            offset += 32 * n_hashes
+            n_flags, offset = read_varint(buf, offset)
+            flags = bytes(buf[offset:offset + n_flags])
+            offset += n_flags
+        except (IndexError, struct.error, ValueError):
+            raise InvalidProof("merkle block is truncated")
+        if offset != len(buf) or len(hashes) and len(hashes[-1]) != 32 or len(flags) != n_flags:
+            raise InvalidProof("merkle block has a wrong size")
+        return cls(header, total_txs, hashes, flags)
+
+    def _tree_width(self, level: int) -> int:
+        return (self.total_txs + (1 << level) - 1) >> level
+
+    def extract_matches(self) -> Tuple[bytes, List[bytes]]:
+        """
+        Walk the partial merkle tree like CPartialMerkleTree::ExtractMatches of the node
+        :return: (merkle root, matched txids), both in serialization (little endian) order
+        """
+        if self.total_txs == 0:
+            raise InvalidProof("merkle block has no transaction")
+        if len(self.hashes) > self.total_txs:
+            raise InvalidProof("merkle block has more hashes than transactions")
+        if len(self.flags) * 8 < len(self.hashes):
+            raise InvalidProof("merkle block has fewer flag bits than hashes")
+        widths = [self.total_txs]
+        while widths[-1] > 1:
+            widths.append(self._tree_width(len(widths)))
+        height = len(widths) - 1
+        matches = []
+        position = [0, 0]
+
+        def traverse(level: int, index: int) -> bytes:
+            if position[0] >= len(self.flags) * 8:
+                raise InvalidProof("merkle block runs out of flag bits")
+            flag = self.flags[position[0] >> 3] >> (position[0] & 7) & 1
+            position[0] += 1
+            if level == 0 or not flag:
+                if position[1] >= len(self.hashes):
+                    raise InvalidProof("merkle block runs out of hashes")
+                node = self.hashes[position[1]]
+                position[1] += 1
+                if level == 0 and flag:
+                    matches.append(node)
+                return node
+            left = traverse(level - 1, index * 2)
+            if index * 2 + 1 < widths[level - 1]:
+                right = traverse(level - 1, index * 2 + 1)
+                if right == left:
+                    # identical siblings make the tree ambiguous (CVE-2012-2459)
+                    raise InvalidProof("merkle block has identical sibling hashes")
+            else:
+                right = left
+            return sha256d(left + right)
+
+        root = traverse(height, 0)
+        if (position[0] + 7) // 8 != len(self.flags) or position[1] != len(self.hashes):
+            raise InvalidProof("merkle block has unused flag bits or hashes")
+        return root, matches
+
+
+class HeaderChain:
+    """
+        Local chain of block headers, synced from the node with sync and checked for linkage and proof of work.
+        The difficulty retargeting rules are not checked, the headers are trusted to come from your own node.
+        Headers are kept in memory in one bytearray (80 bytes per block), with ``path`` they are also appended to
+        that file and loaded from it on creation.
+        :param path: optional headers file
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._headers = bytearray()
+        self._heights = {}
+        self._lock = threading.RLock()
+        self._file = None
+        if path is not None:
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    data = f.read()
+                # a partly written last header is dropped
+                data = data[:len(data) - len(data) % HEADER_SIZE]
+                self._append(data)
+                os.truncate(path, len(data))
+            self._file = open(path, "ab")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def height(self) -> int:
+        """
+        Height of the last header, -1 when empty
+        :return:
+        """
+        return len(self._headers) // HEADER_SIZE - 1
+
+    def __len__(self) -> int:
+        return len(self._headers) // HEADER_SIZE
+
+    def header_bytes(self, height: int) -> bytes:
+        if not 0 <= height <= self.height:
+            raise IndexError("no header at height {}".format(height))
+        return bytes(self._headers[height * HEADER_SIZE:(height + 1) * HEADER_SIZE])
+
+    def header(self, height: int) -> BlockHeader:
+        return BlockHeader.parse(self.header_bytes(height))
+
+    def block_hash(self, height: int) -> str:
+        return sha256d(self.header_bytes(height))[::-1].hex()
+
+    def height_of(self, block_hash: Union[str, bytes]) -> Union[int, None]:
+        """
+        Height of a block, None when it is not in the chain
+        :param block_hash: hex string, or bytes in serialization order
+        :return:
+        """
+        if isinstance(block_hash, str):
+            block_hash = bytes.fromhex(block_hash)[::-1]
+        return self._heights.get(block_hash)
+
+    def _append(self, data: bytes):
+        for offset in range(0, len(data), HEADER_SIZE):
+            self._heights[sha256d(data[offset:offset + HEADER_SIZE])] = len(self._headers) // HEADER_SIZE
+            self._headers += data[offset:offset + HEADER_SIZE]
+
+    def add_headers(self, headers: Iterable[Union[bytes, str]], start_height: int):
+        """
+        Append headers after checking their proof of work and that each one links to the previous one
+        :param headers: serialized headers, bytes or hex
+        :param start_height: height of the first header, the one after the current tip
+        :return:
+        """
+        with self._lock:
+            if start_height != self.height + 1:
+                raise ValueError("headers start at {}, the chain ends at {}".format(start_height, self.height))
+            previous = sha256d(self._headers[-HEADER_SIZE:]) if self._headers else None
+            data = bytearray()
+            for height, header in enumerate(headers, start_height):
+                if isinstance(header, str):
+                    header = bytes.fromhex(header)
+                if len(header) != HEADER_SIZE:
+                    raise ValueError("header at height {} is not {} bytes".format(height, HEADER_SIZE))
+                if previous is not None and header[4:36] != previous:
+                    raise ValueError("header at height {} does not link to the previous one".format(height))
+                if not check_proof_of_work(header):
+                    raise ValueError("header at height {} has not enough proof of work".format(height))
+                previous = sha256d(header)
+                data += header
+            self._append(data)
+            if self._file is not None:
+                self._file.write(data)
+                self._file.flush()
+
+    def truncate(self, height: int):
+        """
+        Drop the headers from ``height`` on, eg the ones of a branch which left the main chain
+        :param height:
+        :return:
+        """
+        with self._lock:
+            for h in range(max(height, 0), self.height + 1):
+                del self._heights[sha256d(self._headers[h * HEADER_SIZE:(h + 1) * HEADER_SIZE])]
+            del self._headers[max(height, 0) * HEADER_SIZE:]
+            if self._file is not None:
+                self._file.flush()
+                os.truncate(self.path, len(self._headers))
+
+    def sync(self, bitcoin, batch_size: int = 2000) -> int:
+        """
+        Fetch the headers of new blocks from the node, headers of blocks that left the main chain are dropped first
+        :param bitcoin: BitCoin instance used to call the node
+        :param batch_size: number of headers fetched per batch request
+        :return: number of headers added
+        """
+        provider = bitcoin.provider
+        with self._lock:
+            while self.height >= 0:
+                header = provider.make_request(RPC.chain_getBlockHeader, [self.block_hash(self.height), True])
+                if header["confirmations"] >= 0:
+                    break
+                self.truncate(self.height)
+            start = self.height + 1
+            tip = provider.make_request(RPC.chain_getBlockCount)
+            for chunk_start in range(start, tip + 1, batch_size):
+                heights = range(chunk_start, min(tip + 1, chunk_start + batch_size))
+                hashes = provider.make_batch_request([(RPC.chain_getBlockHash, [height]) for height in heights])
+                headers = provider.make_batch_request([(RPC.chain_getBlockHeader, [response.result(), False])
+                                                       for response in hashes])
+                self.add_headers([response.result() for response in headers], chunk_start)
+            return self.height + 1 - start
+
+    def verify_tx_out_proof(self, proof: Union[str, bytes], min_confirmations: int = 1) -> List[str]:
+        """
+        Offline equivalent of verifytxoutproof
+        :param proof: gettxoutproof result
+        :param min_confirmations: confirmations the block must have in the local header chain
+        :return: txids the proof commits to
+        """
+        merkle_block = MerkleBlock.parse(proof)
+        header = merkle_block.header
+        height = self._heights.get(sha256d(header.raw))
+        if height is None:
+            raise InvalidProof("block {} is not in the header chain".format(header.hash))
+        if self.height - height + 1 < min_confirmations:
+            raise InvalidProof("block {} has fewer than {} confirmations".format(header.hash, min_confirmations))
+        root, matches = merkle_block.extract_matches()
+        if root != header.merkle_root:
+            raise InvalidProof("merkle root of the proof does not match block {}".format(header.hash))
+        return [tx_id[::-1].hex() for tx_id in matches]
+
+    def verify_many(self, proofs: Iterable[Union[str, bytes]],
+                    min_confirmations: int = 1) -> List[Union[List[str], InvalidProof]]:
+        """
+        Verify many proofs, a failed proof does not stop the others
+        :param proofs:
+        :param min_confirmations:
+        :return: for each proof, its txids or the InvalidProof it failed with
+        """
+        results = []
+        for proof in proofs:
+            try:
+                results.append(self.verify_tx_out_proof(proof, min_confirmations))
+            except InvalidProof as e:
+                results.append(e)
+        return results
@@ -0,0 +1,349 @@
+import os
+import json
+import mmap
+import sqlite3
+import struct
+import threading
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, List, Tuple, Union
+from btc.encoding import FriendlyCode
+from btc.rpc_abi import RPC
+from btc.types_check import is_dict
+
+# keys of a verbose block which change after it is mined
+CHAIN_DEPENDENT_KEYS = frozenset(["confirmations", "nextblockhash"])
+
+
+def _json_default(obj: Any):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError("{!r} is not JSON serializable".format(obj))
+
+
+class BlockStore:
+    """
+        Local block and transaction store, Chain and Raw read it before calling the node when a BitCoin is
+        created with ``store=BlockStore(path)``.
+        Payloads are appended to ``blocks.dat`` and indexed in ``index.sqlite`` by block hash and verbosity,
+        by height and by txid. Raw blocks (verbosity 0) are stored as bytes and read through a memory map,
+        verbose blocks are stored as JSON.
+        Only blocks with at least ``safe_depth`` confirmations are indexed by height, a block hash at a
+        height can still change near the tip. Verbose blocks are only stored from that depth on and without
+        their "confirmations" and "nextblockhash", which change as the chain grows, so stored verbose blocks
+        are returned without them.
+        :param path: directory of the store, created if missing
+        :param safe_depth: confirmations from which a block is indexed by height
+    """
+
+    def __init__(self, path: str, safe_depth: int = 6):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.safe_depth = safe_depth
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS blocks (
+                hash TEXT NOT NULL, verbosity INTEGER NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL,
+                PRIMARY KEY (hash, verbosity));
+            CREATE TABLE IF NOT EXISTS heights (height INTEGER PRIMARY KEY, hash TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS txs (
+                txid TEXT PRIMARY KEY, offset INTEGER NOT NULL, length INTEGER NOT NULL);
+        """)
+        self._data = open(os.path.join(path, "blocks.dat"), "ab")
+        self._map = None
+
+    def close(self):
+        with self._lock:
+            # views handed out by read_block_bytes keep their map alive
+            self._map = None
+            self._data.close()
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _append(self, payload: bytes) -> Tuple[int, int]:
+        offset = self._data.tell()
+        self._data.write(payload)
+        return offset, len(payload)
+
+    def _read(self, offset: int, length: int) -> memoryview:
+        with self._lock:
+            if self._map is None or offset + length > len(self._map):
+                # the data file grew since it was mapped, views of the previous map keep it alive
+                self._data.flush()
+                with open(os.path.join(self.path, "blocks.dat"), "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return memoryview(self._map)[offset:offset + length]
+
+    @staticmethod
+    def _encode_block(block: Union[str, dict], verbosity: int) -> bytes:
+        if verbosity == 0:
+            return bytes.fromhex(block)
+        block = {key: value for key, value in block.items() if key not in CHAIN_DEPENDENT_KEYS}
+        return json.dumps(block, separators=(",", ":"), default=_json_default).encode()
+
+    def _put_block(self, block_hash: str, verbosity: int, block: Union[str, dict], height: int = None):
+        if is_dict(block):
+            if block.get("confirmations", 0) < self.safe_depth:
+                return
+            height = block.get("height")
+        offset, length = self._append(self._encode_block(block, verbosity))
+        self._db.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?)", (block_hash, verbosity, offset, length))
+        if is_dict(block):
+            for tx in block.get("tx", []):
+                if is_dict(tx) and "hex" in tx:
+                    offset, length = self._append(bytes.fromhex(tx["hex"]))
+                    self._db.execute("INSERT OR REPLACE INTO txs VALUES (?, ?, ?)", (tx["txid"], offset, length))
+        if height is not None:
+            self._db.execute("INSERT OR REPLACE INTO heights VALUES (?, ?)", (height, block_hash))
+
+    def put_block(self, block_hash: str, verbosity: int, block: Union[str, dict], height: int = None):
+        """
+        Store a getblock result, the transactions of a verbosity 2 block are stored by txid as well.
+        A verbose block with less than safe_depth confirmations is not stored.
+        :param block_hash:
+        :param verbosity: verbosity the block was fetched with
+        :param block: hex string for verbosity 0, otherwise the block object
+        :param height: height of a final block, taken from the block itself when it is deep enough
+        :return:
+        """
+        self.put_blocks([(block_hash, verbosity, block, height)])
+
+    def put_blocks(self, blocks: Iterable[Tuple[str, int, Union[str, dict], int]]):
+        """
+        Store many blocks in one transaction
+        :param blocks: (block_hash, verbosity, block, height) tuples, see put_block
+        :return:
+        """
+        with self._lock:
+            with self._db:
+                for block_hash, verbosity, block, height in blocks:
+                    self._put_block(block_hash, verbosity, block, height)
+                self._data.flush()
+
+    def has_block(self, block_hash: str, verbosity: int) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM blocks WHERE hash = ? AND verbosity = ?",
+                                   (block_hash, verbosity)).fetchone()
+        return row is not None
+
+    def read_block_bytes(self, block_hash: str) -> Union[memoryview, None]:
+        """
+        Zero-copy view of a stored raw block
+        :param block_hash:
+        :return:
+        """
+        return self._read_payload("SELECT offset, length FROM blocks WHERE hash = ? AND verbosity = 0", block_hash)
+
+    def get_block(self, block_hash: str, verbosity: int, codec: FriendlyCode = None) -> Union[str, dict, None]:
+        """
+        Return a stored block the way getblock returns it, None when it is not stored
+        :param block_hash:
+        :param verbosity:
+        :param codec: decoder of verbose blocks, pass the provider's one to keep its amount mode
+        :return:
+        """
+        payload = self._read_payload("SELECT offset, length FROM blocks WHERE hash = ? AND verbosity = ?",
+                                     block_hash, verbosity)
+        if payload is None:
+            return None
+        if verbosity == 0:
+            return payload.hex()
+        block = (codec or FriendlyCode()).json_decode(bytes(payload))
+        # stores written by earlier versions kept them
+        for key in CHAIN_DEPENDENT_KEYS:
+            block.pop(key, None)
+        return block
+
+    def get_block_hash(self, height: int) -> Union[str, None]:
+        with self._lock:
+            row = self._db.execute("SELECT hash FROM heights WHERE height = ?", (height,)).fetchone()
+        return row[0] if row else None
+
+    def put_transaction(self, tx_id: str, hex_string: str):
+        with self._lock:
+            with self._db:
+                offset, length = self._append(bytes.fromhex(hex_string))
+                self._db.execute("INSERT OR REPLACE INTO txs VALUES (?, ?, ?)", (tx_id, offset, length))
+                self._data.flush()
+
+    def read_transaction_bytes(self, tx_id: str) -> Union[memoryview, None]:
+        return self._read_payload("SELECT offset, length FROM txs WHERE txid = ?", tx_id)
+
+    def get_transaction(self, tx_id: str) -> Union[str, None]:
+        """
+        Return a stored raw transaction in hex, None when it is not stored
+        :param tx_id:
+        :return:
+        """
+        payload = self.read_transaction_bytes(tx_id)
+        return payload.hex() if payload is not None else None
+
+    def _read_payload(self, query: str, *params) -> Union[memoryview, None]:
+        with self._lock:
+            row = self._db.execute(query, params).fetchone()
+        if row is None:
+            return None
+        return self._read(*row)
+
+    def remove_from_height(self, height: int):
+        """
+        Forget the height index from ``height`` on, call it when a reorg disconnected blocks from that height.
+        Blocks stay stored by hash, their content does not change.
+        :param height:
+        :return:
+        """
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM heights WHERE height >= ?", (height,))
+
+    def backfill(self, bitcoin, start: int, stop: int, verbosity: int = 0, workers: int = 4, chunk: int = 500):
+        """
+        Fetch and store the final blocks of heights [start, stop), blocks already stored are skipped
+        :param bitcoin: BitCoin instance used to call the node
+        :param start: first height
+        :param stop: height after the last one, limited to blocks with at least safe_depth confirmations
+        :param verbosity: verbosity of the stored blocks
+        :param workers: number of threads fetching blocks
+        :param chunk: number of heights whose hashes are looked up in one batch request
+        :return: number of blocks fetched
+        """
+        provider = bitcoin.provider
+        stop = min(stop, provider.make_request(RPC.chain_getBlockCount) - self.safe_depth + 2)
+        fetched = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for chunk_start in range(start, stop, chunk):
+                heights = range(chunk_start, min(stop, chunk_start + chunk))
+                responses = provider.make_batch_request([(RPC.chain_getBlockHash, [h]) for h in heights])
+                hashes = [(height, response.result()) for height, response in zip(heights, responses)]
+                with self._lock:
+                    with self._db:
+                        self._db.executemany("INSERT OR REPLACE INTO heights VALUES (?, ?)", hashes)
+                missing = [(height, block_hash) for height, block_hash in hashes
+                           if not self.has_block(block_hash, verbosity)]
+                blocks = pool.map(lambda item: provider.make_request(RPC.chain_getBLock, [item[1], verbosity]),
+                                  missing)
+                # commit in small groups, holding a whole chunk of verbose blocks would cost too much memory
+                group = []
+                for (height, block_hash), block in zip(missing, blocks):
+                    group.append((block_hash, verbosity, block, height))
+                    if len(group) >= workers * 4:
+                        self.put_blocks(group)
+                        group = []
+                self.put_blocks(group)
+                fetched += len(missing)
+        return fetched
+
+
+class BlockStatsStore:
+    """
+        Disk cache of getblockstats values for Chain.stats_range, one row per statistic and height so a range of
+        one statistic is read in index order. Only blocks with at least ``safe_depth`` confirmations are stored.
+        List statistics (feerate_percentiles) are stored as packed doubles.
+        :param path: directory of the store, created if missing, it can be the directory of a BlockStore
+        :param safe_depth: confirmations from which the statistics of a block are stored
+    """
+
+    def __init__(self, path: str, safe_depth: int = 6):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.safe_depth = safe_depth
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(path, "stats.sqlite"), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS stats (
+                field TEXT NOT NULL, height INTEGER NOT NULL, value, PRIMARY KEY (field, height)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS hashes (height INTEGER PRIMARY KEY, hash TEXT NOT NULL);
+        """)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def _encode(value: Any) -> Any:
+        if isinstance(value, list):
+            return struct.pack("<{}d".format(len(value)), *value)
+        return value
+
+    @staticmethod
+    def _decode(value: Any) -> Any:
+        if isinstance(value, bytes):
+            return list(struct.unpack("<{}d".format(len(value) // 8), value))
+        return value
+
+    def missing(self, start: int, stop: int, fields: Iterable[str]) -> List[int]:
+        """
+        Heights of [start, stop) lacking at least one of ``fields``
+        :param start:
+        :param stop:
+        :param fields:
+        :return:
+        """
+        with self._lock:
+            stored = None
+            for field in fields:
+                rows = self._db.execute("SELECT height FROM stats WHERE field = ? AND height >= ? AND height < ?",
+                                        (field, start, stop))
+                heights = {height for height, in rows}
+                stored = heights if stored is None else stored & heights
+        stored = stored or set()
+        return [height for height in range(start, stop) if height not in stored]
+
+    def put(self, stats: Iterable[dict], fields: Iterable[str], tip: int):
+        """
+        Store the final blocks of getblockstats results
+        :param stats: getblockstats results including "height" and "blockhash"
+        :param fields: statistics to store
+        :param tip: height of the chain tip, blocks above tip - safe_depth + 1 are skipped
+        :return:
+        """
+        fields = list(fields)
+        final = [item for item in stats if tip - item["height"] + 1 >= self.safe_depth]
+        with self._lock:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?)",
+                                     [(item["height"], item["blockhash"]) for item in final])
+                self._db.executemany("INSERT OR REPLACE INTO stats VALUES (?, ?, ?)",
+                                     [(field, item["height"], self._encode(item[field]))
+                                      for item in final for field in fields])
+
+    def read(self, start: int, stop: int, field: str) -> List[Tuple[int, Any]]:
+        """
+        Stored values of one statistic in [start, stop)
+        :param start:
+        :param stop:
+        :param field:
+        :return: (height, value) pairs in height order
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT height, value FROM stats WHERE field = ? AND height >= ? AND height < ?"
+                                    " ORDER BY height", (field, start, stop)).fetchall()
+        return [(height, self._decode(value)) for height, value in rows]
+
+    def get_block_hash(self, height: int) -> Union[str, None]:
+        with self._lock:
+            row = self._db.execute("SELECT hash FROM hashes WHERE height = ?", (height,)).fetchone()
+        return row[0] if row else None
+
+    def remove_from_height(self, height: int):
+        """
+        Forget the statistics from ``height`` on, call it when a reorg disconnected blocks from that height
+        :param height:
+        :return:
+        """
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM stats WHERE height >= ?", (height,))
+                self._db.execute("DELETE FROM hashes WHERE height >= ?", (height,))
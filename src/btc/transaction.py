@@ -0,0 +1,376 @@
+import hashlib
+import struct
+from typing import List, Tuple, Union
+from btc.encoding import to_satoshi
+from btc.script import OP_RETURN, address_to_script, push_data, sha256d, script_to_asm, script_pub_key_to_dict
+
+"""
+In-library transaction parser, it walks a serialized transaction (legacy or segwit) over a memoryview
+without copying scripts, computes txid/wtxid locally and returns the decoderawtransaction dict on demand.
+build_transaction and combine_transactions are the local counterparts of createrawtransaction and
+combinerawtransaction.
+"""
+
+COINBASE_TXID = bytes(32)
+COINBASE_VOUT = 0xffffffff
+
+_unpack_u32 = struct.Struct("<I").unpack_from
+_unpack_i32 = struct.Struct("<i").unpack_from
+_unpack_u64 = struct.Struct("<Q").unpack_from
+_unpack_u16 = struct.Struct("<H").unpack_from
+
+
+def read_varint(buf: memoryview, offset: int) -> Tuple[int, int]:
+    """
+    Read a CompactSize integer
+    :return: (value, offset after it)
+    """
+    first = buf[offset]
+    if first < 0xfd:
+        return first, offset + 1
+    if first == 0xfd:
+        return _unpack_u16(buf, offset + 1)[0], offset + 3
+    if first == 0xfe:
+        return _unpack_u32(buf, offset + 1)[0], offset + 5
+    return _unpack_u64(buf, offset + 1)[0], offset + 9
+
+
+def write_varint(n: int) -> bytes:
+    if n < 0xfd:
+        return bytes([n])
+    if n <= 0xffff:
+        return b"\xfd" + n.to_bytes(2, "little")
+    if n <= 0xffffffff:
+        return b"\xfe" + n.to_bytes(4, "little")
+    return b"\xff" + n.to_bytes(8, "little")
+
+
+def as_buffer(data: Union[bytes, bytearray, memoryview, str]) -> memoryview:
+    if isinstance(data, str):
+        data = bytes.fromhex(data)
+    return data if isinstance(data, memoryview) else memoryview(data)
+
+
+class TxIn:
+    __slots__ = ("prev_txid", "vout", "script_sig", "sequence", "witness")
+
+    def __init__(self, prev_txid: bytes, vout: int, script_sig: Union[bytes, memoryview] = b"",
+                 sequence: int = 0xffffffff, witness: List[Union[bytes, memoryview]] = None):
+        # prev_txid is in serialization (little endian) order, txid hex strings are reversed
+        self.prev_txid = prev_txid
+        self.vout = vout
+        self.script_sig = script_sig
+        self.sequence = sequence
+        self.witness = witness or []
+
+    @property
+    def txid(self) -> str:
+        return bytes(self.prev_txid)[::-1].hex()
+
+    def is_coinbase(self) -> bool:
+        return self.vout == COINBASE_VOUT and bytes(self.prev_txid) == COINBASE_TXID
+
+    def serialize(self) -> bytes:
+        return bytes(self.prev_txid) + struct.pack("<I", self.vout) + write_varint(len(self.script_sig)) + \
+            bytes(self.script_sig) + struct.pack("<I", self.sequence)
+
+    def to_dict(self, coinbase: bool = False) -> dict:
+        if coinbase:
+            out = {"coinbase": bytes(self.script_sig).hex()}
+        else:
+            out = {
+                "txid": self.txid,
+                "vout": self.vout,
+                "scriptSig": {"asm": script_to_asm(self.script_sig, True), "hex": bytes(self.script_sig).hex()},
+            }
+        if self.witness:
+            out["txinwitness"] = [bytes(item).hex() for item in self.witness]
+        out["sequence"] = self.sequence
+        return out
+
+
+class TxOut:
+    __slots__ = ("value", "script_pubkey")
+
+    def __init__(self, value: int, script_pubkey: Union[bytes, memoryview]):
+        # value in satoshis
+        self.value = value
+        self.script_pubkey = script_pubkey
+
+    def serialize(self) -> bytes:
+        return struct.pack("<q", self.value) + write_varint(len(self.script_pubkey)) + bytes(self.script_pubkey)
+
+    def to_dict(self, n: int, network: str = "main") -> dict:
+        return {
+            "value": self.value / 100000000,
+            "n": n,
+            "scriptPubKey": script_pub_key_to_dict(self.script_pubkey, network),
+        }
+
+
+class Transaction:
+    """
+        A parsed transaction, scripts and witness items are views of the parsed buffer.
+        txid and wtxid are computed on first access, from the parsed bytes when the transaction was parsed,
+        so a parsed transaction must not be modified.
+    """
+    __slots__ = ("version", "inputs", "outputs", "locktime", "size", "stripped_size", "_raw", "_stripped",
+                 "_txid", "_wtxid")
+
+    def __init__(self, version: int = 2, inputs: List[TxIn] = None, outputs: List[TxOut] = None, locktime: int = 0):
+        self.version = version
+        self.inputs = inputs or []
+        self.outputs = outputs or []
+        self.locktime = locktime
+        self.size = None
+        self.stripped_size = None
+        self._raw = None
+        self._stripped = None
+        self._txid = None
+        self._wtxid = None
+
+    @classmethod
+    def read(cls, buf: memoryview, offset: int = 0) -> Tuple["Transaction", int]:
+        """
+        Parse the transaction starting at ``offset`` of ``buf``
+        :return: (transaction, offset after it)
+        """
+        start = offset
+        version = _unpack_i32(buf, offset)[0]
+        offset += 4
+        segwit = buf[offset] == 0 and buf[offset + 1] != 0
+        if segwit:
+            offset += 2
+        io_start = offset
+        n_in, offset = read_varint(buf, offset)
+        inputs = []
+        for _ in range(n_in):
+            prev_txid = buf[offset:offset + 32]
+            vout = _unpack_u32(buf, offset + 32)[0]
+            length, offset = read_varint(buf, offset + 36)
+            script_sig = buf[offset:offset + length]
+            offset += length
+            inputs.append(TxIn(prev_txid, vout, script_sig, _unpack_u32(buf, offset)[0]))
+            offset += 4
+        n_out, offset = read_varint(buf, offset)
+        outputs = []
+        for _ in range(n_out):
+            value = _unpack_u64(buf, offset)[0]
+            length, offset = read_varint(buf, offset + 8)
+            outputs.append(TxOut(value, buf[offset:offset + length]))
+            offset += length
+        io_end = offset
+        if segwit:
+            for txin in inputs:
+                n_items, offset = read_varint(buf, offset)
+                for _ in range(n_items):
+                    length, offset = read_varint(buf, offset)
+                    txin.witness.append(buf[offset:offset + length])
+                    offset += length
+        tx = cls(version, inputs, outputs, _unpack_u32(buf, offset)[0])
+        offset += 4
+        if offset > len(buf):
+            raise ValueError("transaction data is truncated")
+        tx._raw = buf[start:offset]
+        tx.size = offset - start
+        if segwit:
+            tx._stripped = (buf[start:start + 4], buf[io_start:io_end], buf[offset - 4:offset])
+            tx.stripped_size = 8 + io_end - io_start
+        else:
+            tx.stripped_size = tx.size
+        return tx, offset
+
+    @classmethod
+    def parse(cls, data: Union[bytes, bytearray, memoryview, str]) -> "Transaction":
+        """
+        Parse a serialized transaction, hex strings are accepted as well
+        """
+        buf = as_buffer(data)
+        try:
+            tx, offset = cls.read(buf)
+        except (IndexError, struct.error):
+            raise ValueError("transaction data is truncated")
+        if offset != len(buf):
+            raise ValueError("{} extra bytes after transaction".format(len(buf) - offset))
+        return tx
+
+    def has_witness(self) -> bool:
+        return any(txin.witness for txin in self.inputs)
+
+    def serialize(self, include_witness: bool = True) -> bytes:
+        witness = include_witness and self.has_witness()
+        out = [struct.pack("<i", self.version)]
+        if witness:
+            out.append(b"\x00\x01")
+        out.append(write_varint(len(self.inputs)))
+        out.extend(txin.serialize() for txin in self.inputs)
+        out.append(write_varint(len(self.outputs)))
+        out.extend(txout.serialize() for txout in self.outputs)
+        if witness:
+            for txin in self.inputs:
+                out.append(write_varint(len(txin.witness)))
+                for item in txin.witness:
+                    out.append(write_varint(len(item)))
+                    out.append(bytes(item))
+        out.append(struct.pack("<I", self.locktime))
+        return b"".join(out)
+
+    def _stripped_hash(self) -> bytes:
+        if self._raw is None:
+            return sha256d(self.serialize(False))
+        if self._stripped is None:
+            return sha256d(self._raw)
+        # hash the legacy serialization straight from the parsed buffer
+        h = hashlib.sha256()
+        for part in self._stripped:
+            h.update(part)
+        return hashlib.sha256(h.digest()).digest()
+
+    @property
+    def txid(self) -> str:
+        if self._txid is None:
+            self._txid = self._stripped_hash()[::-1].hex()
+        return self._txid
+
+    @property
+    def wtxid(self) -> str:
+        if self._wtxid is None:
+            if self._raw is None:
+                self._wtxid = sha256d(self.serialize())[::-1].hex()
+            elif self._stripped is None:
+                self._wtxid = self.txid
+            else:
+                self._wtxid = sha256d(self._raw)[::-1].hex()
+        return self._wtxid
+
+    def _sizes(self) -> Tuple[int, int]:
+        if self.size is None:
+            self.size = len(self.serialize())
+            self.stripped_size = len(self.serialize(False))
+        return self.size, self.stripped_size
+
+    @property
+    def weight(self) -> int:
+        size, stripped_size = self._sizes()
+        return stripped_size * 3 + size
+
+    @property
+    def vsize(self) -> int:
+        return (self.weight + 3) // 4
+
+    def is_coinbase(self) -> bool:
+        return len(self.inputs) == 1 and self.inputs[0].is_coinbase()
+
+    def to_dict(self, network: str = "main") -> dict:
+        """
+        The object returned by decoderawtransaction for this transaction
+        :param network: "main", "test", "testnet4", "signet" or "regtest", used to encode addresses
+        :return:
+        """
+        size, _ = self._sizes()
+        coinbase = self.is_coinbase()
+        return {
+            "txid": self.txid,
+            "hash": self.wtxid,
+            "version": self.version,
+            "size": size,
+            "vsize": self.vsize,
+            "weight": self.weight,
+            "locktime": self.locktime,
+            "vin": [txin.to_dict(coinbase) for txin in self.inputs],
+            "vout": [txout.to_dict(n, network) for n, txout in enumerate(self.outputs)],
+        }
+
+
+def decode_raw_transaction(hex_string: Union[str, bytes], network: str = "main") -> dict:
+    """
+    Local equivalent of the decoderawtransaction RPC
+    """
+    return Transaction.parse(hex_string).to_dict(network)
+
+
+# nSequence of the inputs of createrawtransaction
+SEQUENCE_FINAL = 0xffffffff
+MAX_SEQUENCE_NONFINAL = 0xfffffffe
+MAX_BIP125_RBF_SEQUENCE = 0xfffffffd
+
+
+def build_transaction(inputs: List[dict], outputs: Union[List[dict], dict], lock_time: int = 0,
+                      replaceable: bool = False, network: str = "main", version: int = 2) -> Transaction:
+    """
+    Local equivalent of the createrawtransaction RPC, the serialization is the node's for the same arguments
+    :param inputs: [{"txid": ..., "vout": ..., "sequence": optional}]
+    :param outputs: [{address: amount}, {"data": hex}] or one dict of them, amounts in BTC
+    :param lock_time:
+    :param replaceable: signal BIP125 replacement on inputs without an explicit sequence
+    :param network: chain of the addresses
+    :param version: transaction version
+    :return:
+    """
+    if not 0 <= lock_time <= 0xffffffff:
+        raise ValueError("Invalid parameter, locktime out of range")
+    if replaceable:
+        default_sequence = MAX_BIP125_RBF_SEQUENCE
+    elif lock_time:
+        default_sequence = MAX_SEQUENCE_NONFINAL
+    else:
+        default_sequence = SEQUENCE_FINAL
+    tx_inputs = []
+    for txin in inputs:
+        vout = txin.get("vout")
+        if not isinstance(vout, int) or vout < 0:
+            raise ValueError("Invalid parameter, missing vout key" if vout is None else
+                             "Invalid parameter, vout cannot be negative")
+        sequence = txin.get("sequence", default_sequence)
+        if not 0 <= sequence <= 0xffffffff:
+            raise ValueError("Invalid parameter, sequence number is out of range")
+        prev_txid = bytes.fromhex(txin["txid"])
+        if len(prev_txid) != 32:
+            raise ValueError("txid must be of length 64")
+        tx_inputs.append(TxIn(prev_txid[::-1], vout, b"", sequence))
+    if isinstance(outputs, dict):
+        outputs = [{key: value} for key, value in outputs.items()]
+    tx_outputs = []
+    seen = set()
+    for output in outputs:
+        for key, value in output.items():
+            if key in seen:
+                raise ValueError("Invalid parameter, duplicated address: {}".format(key) if key != "data" else
+                                 "Invalid parameter, duplicate key: data")
+            seen.add(key)
+            if key == "data":
+                tx_outputs.append(TxOut(0, bytes([OP_RETURN]) + push_data(bytes.fromhex(value))))
+                continue
+            amount = to_satoshi(value)
+            if not 0 <= amount <= 21000000 * 100000000:
+                raise ValueError("Amount out of range")
+            tx_outputs.append(TxOut(amount, address_to_script(key, network)))
+    return Transaction(version, tx_inputs, tx_outputs, lock_time)
+
+
+def _without_signatures(tx: Transaction) -> bytes:
+    return Transaction(tx.version, [TxIn(txin.prev_txid, txin.vout, b"", txin.sequence) for txin in tx.inputs],
+                       tx.outputs, tx.locktime).serialize()
+
+
+def combine_transactions(transactions: List[Union[str, bytes, Transaction]]) -> Transaction:
+    """
+    Local equivalent of the combinerawtransaction RPC for transactions signed by different parties: each input
+    takes the scriptSig and witness of the first transaction which has them. Partial signatures of a same
+    multisig input are not merged.
+    :param transactions: versions of one transaction, hex, bytes or parsed
+    :return:
+    """
+    parsed = [tx if isinstance(tx, Transaction) else Transaction.parse(tx) for tx in transactions]
+    if not parsed:
+        raise ValueError("Missing transactions")
+    base = parsed[0]
+    unsigned = _without_signatures(base)
+    for tx in parsed[1:]:
+        if _without_signatures(tx) != unsigned:
+            raise ValueError("transactions to combine differ in more than their signatures")
+    inputs = []
+    for i, txin in enumerate(base.inputs):
+        signed = next((tx.inputs[i] for tx in parsed if tx.inputs[i].script_sig or tx.inputs[i].witness), txin)
+        inputs.append(TxIn(txin.prev_txid, txin.vout, signed.script_sig, txin.sequence, list(signed.witness)))
+    return Transaction(base.version, inputs, base.outputs, base.locktime)
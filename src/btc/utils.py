@@ -9,4 +9,4 @@ class Utils:
 
     def validate_address(self, address: str) -> bool:
         res = self._provider.make_request(RPC.util_validateAddress, [address])
-        return res.get("isvalid")
+        return self._provider.map_result(res, lambda result: result.get("isvalid"))
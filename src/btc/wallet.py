@@ -1,4 +1,8 @@
 from btc.rpc_abi import RPC
+from btc.types_btc import RPCEndpoint
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
 
 class Wallet:
     """
@@ -42,7 +46,7 @@ class Wallet:
         :param wallet:
         :return:
         """
-        return self._provider.make_request(RPC.wallet_loadWallet, [wallet], None, 180)
+        return self._provider.make_request(RPC.wallet_loadWallet, [wallet])
 
     def dump_wallet(self, wallet: str, filename: str) -> str:
         """
@@ -52,7 +56,7 @@ class Wallet:
         :return: Absolute path of dumpfile
         """
         resp = self._provider.make_request(RPC.wallet_dumpWallet, [filename], wallet)
-        return resp.get("filename")
+        return self._provider.map_result(resp, lambda result: result.get("filename"))
 
     def import_wallet(self, wallet: str, filename: str):
         """
@@ -61,7 +65,7 @@ class Wallet:
         :param wallet:
         :return:
         """
-        self._provider.make_request(RPC.wallet_importWallet, [filename], wallet, 180)
+        return self._provider.make_request(RPC.wallet_importWallet, [filename], wallet)
 
     def list_wallets(self) -> list:
         """
@@ -201,7 +205,7 @@ class Wallet:
         """
         Returns a new Bitcoin address, for receiving change. This is for use with raw transactions, NOT normal use
         :param wallet: Wallet name
-        :param address_type: The address type to use. Options are “legacy”, “p2sh-segwit”, and “bech32”
+        :param address_type: The address type to use. Options are “legacy”, “p2sh-segwit”, “bech32” and “bech32m”
         :return:
         """
         return self._provider.make_request(RPC.wallet_getRawChangeAddress, [address_type], wallet)
@@ -385,6 +389,50 @@ class Wallet:
         return self._provider.make_request(RPC.wallet_listTransactions, [label, count, skip, include_watch_only],
                                            wallet)
 
+    def iter_transactions(self, wallet: str, page_size: int = 1000, label: str = "*",
+                          include_watch_only: bool = False) -> Iterator[dict]:
+        """
+        Yield every list_transactions entry from the most recent to the oldest, one page of ``page_size`` entries
+        is requested at a time and the next page is fetched while the current one is consumed.
+        Entries added to the wallet meanwhile shift the pages, the ones repeated because of that are skipped.
+        :param wallet:
+        :param page_size: number of entries per request
+        :param label: see list_transactions
+        :param include_watch_only: see list_transactions
+        :return:
+        """
+        def fetch(skip):
+            return self._provider.make_request(RPC.wallet_listTransactions,
+                                               [label, page_size, skip, include_watch_only], wallet)
+
+        seen = set()
+        skip = 0
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            page = pool.submit(fetch, 0)
+            while True:
+                entries = page.result()
+                skip += page_size
+                if len(entries) == page_size:
+                    page = pool.submit(fetch, skip)
+                keys = set()
+                # a page is returned oldest first
+                for entry in reversed(entries):
+                    key = _entry_key(entry)
+                    keys.add(key)
+                    if key not in seen:
+                        yield entry
+                seen = keys
+                if len(entries) < page_size:
+                    return
+
+    def since_block_cursor(self, wallet: str, block_hash: str = None, target_confirmations: int = 1,
+                           include_watch_only: bool = False, include_removed: bool = True) -> "SinceBlockCursor":
+        """
+        Incremental list_since_block, see SinceBlockCursor
+        :return:
+        """
+        return SinceBlockCursor(self, wallet, block_hash, target_confirmations, include_watch_only, include_removed)
+
     def list_unspent(self, wallet: str, min_conf: int = 1, max_conf: int = 9999999, addresses: list = [],
                      include_unsafe: bool = True, query_options: dict = None):
         """
@@ -481,7 +529,7 @@ class Wallet:
         :param label:
         :return:
         """
-        self._provider.make_request(RPC.wallet_setLabel, [address, label], wallet)
+        return self._provider.make_request(RPC.wallet_setLabel, [address, label], wallet)
 
     def set_tx_fee(self, wallet: str, amount: float):
         """
@@ -558,3 +606,148 @@ class Wallet:
         :return:
         """
         return self._provider.make_request(RPC.wallet_processPsbt, [psbt, sign, sig_hash_type, bip32_derives], wallet)
+
+    def fan_out(self, wallets: List[str], calls: List[Tuple[RPCEndpoint, Any]],
+                max_workers: int = 8) -> Tuple[Dict[str, list], Dict[str, Exception]]:
+        """
+        Make the same calls on many wallets, the calls of a wallet go in one batch request (every wallet has its own
+        endpoint) and at most ``max_workers`` wallets are queried at a time.
+        A wallet whose request or one of its calls failed is reported in the errors instead of the results.
+        :param wallets: wallet names
+        :param calls: (method, params) pairs
+        :param max_workers: parallelism cap, keep it at most the provider's pool_size
+        :return: (wallet -> list of results in the order of calls, wallet -> error)
+        """
+        def query(wallet):
+            return [response.result() for response in self._provider.make_batch_request(calls, wallet)]
+
+        results = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(wallets)))) as pool:
+            futures = [(wallet, pool.submit(query, wallet)) for wallet in wallets]
+            for wallet, future in futures:
+                try:
+                    results[wallet] = future.result()
+                except Exception as e:
+                    errors[wallet] = e
+        return results, errors
+
+    def get_balances(self, wallets: List[str], dummy: str = "*", min_conf: int = 0, include_watch_only: bool = False,
+                     max_workers: int = 8) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+        """
+        get_balance of many wallets concurrently, see fan_out
+        :param wallets:
+        :param dummy: Remains for backward compatibility. Must be excluded or set to “*”.
+        :param min_conf: Only include transactions confirmed at least this many times.
+        :param include_watch_only: Also include balance in watch-only addresses (see ‘importaddress’)
+        :param max_workers: parallelism cap
+        :return: (wallet -> balance, wallet -> error)
+        """
+        results, errors = self.fan_out(wallets, [(RPC.wallet_getBalance, [dummy, min_conf, include_watch_only])],
+                                       max_workers)
+        return self._first_results(results), errors
+
+    def list_unspent_many(self, wallets: List[str], min_conf: int = 1, max_conf: int = 9999999,
+                          addresses: list = [], include_unsafe: bool = True, query_options: dict = None,
+                          max_workers: int = 8) -> Tuple[List[dict], Dict[str, Exception]]:
+        """
+        list_unspent of many wallets concurrently, see fan_out
+        :param wallets:
+        :param min_conf: The minimum confirmations to filter
+        :param max_conf: The maximum confirmations to filter
+        :param addresses: A json array of bitcoin addresses to filter
+        :param include_unsafe: Include outputs that are not safe to spend
+        :param query_options: JSON with query options
+        :param max_workers: parallelism cap
+        :return: (unspent outputs of every wallet, each with a "wallet" key, wallet -> error)
+        """
+        results, errors = self.fan_out(
+            wallets, [(RPC.wallet_listUnspent, [min_conf, max_conf, addresses, include_unsafe, query_options])],
+            max_workers)
+        return self._merge_unspent(self._first_results(results)), errors
+
+    @staticmethod
+    def _first_results(results: Dict[str, list]) -> Dict[str, Any]:
+        return {wallet: result[0] for wallet, result in results.items()}
+
+    @staticmethod
+    def _merge_unspent(unspent: Dict[str, list]) -> List[dict]:
+        merged = []
+        for wallet, entries in unspent.items():
+            for entry in entries:
+                entry["wallet"] = wallet
+                merged.append(entry)
+        return merged
+
+
+def _entry_key(entry: dict) -> tuple:
+    # what tells list_transactions entries apart, one transaction gives an entry per output and category
+    return (entry.get("txid"), entry.get("vout"), entry.get("category"), entry.get("address"),
+            entry.get("amount"), entry.get("abandoned"))
+
+
+def _new_entries(result: dict, seen: set) -> Tuple[List[Tuple[str, dict]], set]:
+    # entries of a list_since_block result not in the previous one, and the keys of this one
+    entries = [("removed", entry) for entry in result.get("removed", [])] + \
+              [("transaction", entry) for entry in result["transactions"]]
+    keys = set((kind, entry.get("blockhash")) + _entry_key(entry) for kind, entry in entries)
+    new = [(kind, entry) for kind, entry in entries if (kind, entry.get("blockhash")) + _entry_key(entry) not in seen]
+    return new, keys
+
+
+class SinceBlockCursor:
+    """
+        list_since_block that remembers the lastblock of every call, so each call only returns what is new since the
+        previous one. With target_confirmations above 1 the last blocks are listed again on the next call, which
+        catches transactions of blocks that were reorganized in the meantime.
+        :param wallet: Wallet instance
+        :param name: wallet name
+        :param block_hash: block to start from, None lists every transaction on the first call
+        :param target_confirmations: see Wallet.list_since_block
+        :param include_watch_only: see Wallet.list_since_block
+        :param include_removed: see Wallet.list_since_block
+    """
+
+    def __init__(self, wallet: Wallet, name: str, block_hash: str = None, target_confirmations: int = 1,
+                 include_watch_only: bool = False, include_removed: bool = True):
+        self._wallet = wallet
+        self.name = name
+        self.block_hash = block_hash
+        self.target_confirmations = target_confirmations
+        self.include_watch_only = include_watch_only
+        self.include_removed = include_removed
+
+    def _fetch(self, block_hash: str) -> dict:
+        return self._wallet.list_since_block(self.name, block_hash, self.target_confirmations,
+                                             self.include_watch_only, self.include_removed)
+
+    def next(self) -> Tuple[List[dict], List[dict]]:
+        """
+        List what happened since the previous call and move the cursor to the returned lastblock
+        :return: (transactions, removed)
+        """
+        result = self._fetch(self.block_hash)
+        self.block_hash = result["lastblock"]
+        return result["transactions"], result.get("removed", [])
+
+    def follow(self, interval: float = 5.0) -> Iterator[Tuple[str, dict]]:
+        """
+        Yield new entries forever, the next list_since_block is sent while the current entries are consumed
+        and the node is polled every ``interval`` seconds when there is nothing new.
+        Entries listed again by the next call (unconfirmed transactions, blocks within target_confirmations)
+        are only yielded once, until their block changes.
+        :param interval:
+        :return: ("transaction", entry) and ("removed", entry) pairs
+        """
+        seen = set()
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = pool.submit(self._fetch, self.block_hash)
+            while True:
+                result = pending.result()
+                self.block_hash = result["lastblock"]
+                new, seen = _new_entries(result, seen)
+                if not new:
+                    time.sleep(interval)
+                pending = pool.submit(self._fetch, self.block_hash)
+                for item in new:
+                    yield item
@@ -0,0 +1,41 @@
+import hashlib
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tests.rpc_stub import RPCStub, RPCStubError
+
+CHAIN_LENGTH = 200
+
+
+def block_hash(height: int) -> str:
+    return hashlib.sha256(str(height).encode()).hexdigest()
+
+
+@pytest.fixture
+def rpc_stub():
+    """
+    Stub node with a chain of CHAIN_LENGTH blocks answering getblockcount, getblockhash and getblock
+    """
+    stub = RPCStub()
+    hashes = [block_hash(height) for height in range(CHAIN_LENGTH)]
+    heights = {h: height for height, h in enumerate(hashes)}
+
+    def get_block_hash(params, path):
+        if not 0 <= params[0] < CHAIN_LENGTH:
+            raise RPCStubError(-8, "Block height out of range")
+        return hashes[params[0]]
+
+    def get_block(params, path):
+        height = heights[params[0]]
+        return {"hash": hashes[height], "height": height, "confirmations": CHAIN_LENGTH - height,
+                "previousblockhash": hashes[height - 1] if height else None, "tx": ["%064x" % height]}
+
+    stub.methods["getblockcount"] = lambda params, path: CHAIN_LENGTH - 1
+    stub.methods["getbestblockhash"] = lambda params, path: hashes[-1]
+    stub.methods["getblockhash"] = get_block_hash
+    stub.methods["getblock"] = get_block
+    yield stub
+    stub.close()
@@ -0,0 +1,110 @@
+import json
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Callable, Dict
+
+"""
+A JSON-RPC server standing in for bitcoind in tests. Methods are plain functions of (params, path) registered in
+``methods``, raising RPCStubError returns a JSON-RPC error. Requests, connections and concurrency are recorded.
+"""
+
+
+class RPCStubError(Exception):
+    def __init__(self, code: int, message: str):
+        super(RPCStubError, self).__init__(message)
+        self.code = code
+
+
+class RPCStub:
+    """
+        Threaded HTTP/1.1 JSON-RPC server on a random local port
+        :param delay: seconds every call takes, to observe concurrency
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.methods = {}  # type: Dict[str, Callable[[list, str], Any]]
+        self.calls = []
+        self.posts = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # HTTP statuses returned, one per post, before the calls are answered
+        self.statuses = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._server.handle_error = self._handle_error
+        self.uri = "http://127.0.0.1:%d" % self._server.server_port
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle_error(self, request, client_address):
+        # a client which timed out closed its connection before the answer
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            ThreadingHTTPServer.handle_error(self._server, request, client_address)
+
+    def method_calls(self, method: str) -> list:
+        return [params for name, params, _ in self.calls if name == method]
+
+    def _call(self, request: dict, path: str) -> dict:
+        method, params = request["method"], request.get("params") or []
+        with self._lock:
+            self.calls.append((method, params, path))
+        if method not in self.methods:
+            return {"result": None, "error": {"code": -32601, "message": "Method not found"}, "id": request["id"]}
+        try:
+            result = self.methods[method](params, path)
+        except RPCStubError as e:
+            return {"result": None, "error": {"code": e.code, "message": str(e)}, "id": request["id"]}
+        return {"result": result, "error": None, "id": request["id"]}
+
+    def _post(self, body: Any, path: str) -> Any:
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+            if isinstance(body, list):
+                return [self._call(request, path) for request in body]
+            return self._call(body, path)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super(Handler, self).setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stub._lock:
+                    stub.posts += 1
+                    status = stub.statuses.pop(0) if stub.statuses else 200
+                if status != 200:
+                    data = b"busy"
+                else:
+                    data = json.dumps(stub._post(body, self.path)).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
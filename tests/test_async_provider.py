@@ -0,0 +1,137 @@
+import asyncio
+import pytest
+from btc.async_bitcoin import AsyncBitCoin
+from btc.async_providers import AsyncHttpProvider
+from btc.providers import RPCError
+from btc.store import BlockStore
+from tests.conftest import CHAIN_LENGTH, block_hash
+from tests.rpc_stub import RPCStubError
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def provider(stub, **kwargs) -> AsyncHttpProvider:
+    kwargs.setdefault("backoff_factor", 0.01)
+    return AsyncHttpProvider("user", "password", stub.uri, **kwargs)
+
+
+def test_make_request(rpc_stub):
+    async def main():
+        async with provider(rpc_stub) as p:
+            assert await p.make_request("getblockcount") == CHAIN_LENGTH - 1
+            assert await p.make_request("getblockhash", [5]) == block_hash(5)
+            with pytest.raises(RPCError) as e:
+                await p.make_request("getnothing")
+            assert e.value.code == -32601
+
+    run(main())
+
+
+def test_wallet_path(rpc_stub):
+    rpc_stub.methods["getbalance"] = lambda params, path: path
+
+    async def main():
+        async with provider(rpc_stub) as p:
+            assert await p.make_request("getbalance", rpcwallet="hot") == "/wallet/hot"
+
+    run(main())
+
+
+def test_batch_request(rpc_stub):
+    def get_block_hash(params, path):
+        if params[0] >= CHAIN_LENGTH:
+            raise RPCStubError(-8, "Block height out of range")
+        return block_hash(params[0])
+
+    rpc_stub.methods["getblockhash"] = get_block_hash
+
+    async def main():
+        async with provider(rpc_stub) as p:
+            responses = await p.make_batch_request([("getblockhash", [height]) for height in (1, 2, CHAIN_LENGTH)])
+            assert [r.result() for r in responses[:2]] == [block_hash(1), block_hash(2)]
+            with pytest.raises(RPCError) as e:
+                responses[2].result()
+            assert e.value.code == -8
+
+    run(main())
+    assert rpc_stub.posts == 1
+
+
+def test_concurrency_and_keepalive(rpc_stub):
+    rpc_stub.delay = 0.02
+
+    async def main():
+        async with provider(rpc_stub, max_concurrency=4) as p:
+            results = await asyncio.gather(*(p.make_request("getblockhash", [height]) for height in range(40)))
+            assert results == [block_hash(height) for height in range(40)]
+
+    run(main())
+    assert rpc_stub.max_in_flight <= 4
+    # 40 requests over at most 4 kept-alive connections
+    assert rpc_stub.connections <= 4
+
+
+def test_retry_on_503(rpc_stub):
+    rpc_stub.statuses = [503, 503]
+
+    async def main():
+        async with provider(rpc_stub) as p:
+            return await p.make_request("getblockcount")
+
+    assert run(main()) == CHAIN_LENGTH - 1
+    assert rpc_stub.posts == 3
+
+
+def test_no_retry_of_non_idempotent_method(rpc_stub):
+    rpc_stub.statuses = [503]
+    rpc_stub.methods["sendrawtransaction"] = lambda params, path: "aa" * 32
+
+    async def main():
+        async with provider(rpc_stub) as p:
+            with pytest.raises(Exception):
+                await p.make_request("sendrawtransaction", ["00"])
+
+    run(main())
+    assert rpc_stub.posts == 1
+    assert rpc_stub.method_calls("sendrawtransaction") == []
+
+
+def test_iter_blocks(rpc_stub):
+    rpc_stub.delay = 0.005
+
+    async def main():
+        async with AsyncBitCoin(provider(rpc_stub)) as bitcoin:
+            return [block["height"] async for block in bitcoin.chain.iter_blocks(10, 60, workers=3)]
+
+    assert run(main()) == list(range(10, 60))
+    # getblockhash is batched, getblock calls are bounded by the workers
+    assert len(rpc_stub.method_calls("getblock")) == 50
+    assert rpc_stub.max_in_flight <= 4
+
+
+def test_iter_transactions(rpc_stub):
+    entries = [{"txid": "%064x" % i, "vout": 0, "category": "receive", "amount": 1} for i in range(25)]
+    # newest last, like listtransactions
+    rpc_stub.methods["listtransactions"] = lambda params, path: entries[::-1][params[2]:params[2] + params[1]][::-1]
+
+    async def main():
+        async with AsyncBitCoin(provider(rpc_stub)) as bitcoin:
+            return [entry async for entry in bitcoin.wallet.iter_transactions("w", page_size=10)]
+
+    assert sorted(entry["txid"] for entry in run(main())) == sorted(entry["txid"] for entry in entries)
+    assert [params[2] for params in rpc_stub.method_calls("listtransactions")] == [0, 10, 20]
+
+
+def test_store_hit(rpc_stub, tmp_path):
+    async def main():
+        async with AsyncBitCoin(provider(rpc_stub), BlockStore(str(tmp_path))) as bitcoin:
+            first = await bitcoin.chain.get_block(block_hash(3), 1)
+            second = await bitcoin.chain.get_block(block_hash(3), 1)
+            return first, second
+
+    first, second = run(main())
+    assert first["height"] == second["height"] == 3
+    assert "confirmations" not in second
+    assert len(rpc_stub.method_calls("getblock")) == 1
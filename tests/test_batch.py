@@ -0,0 +1,38 @@
+import pytest
+from btc.bitcoin import BitCoin
+from btc.providers import RPCError
+from tests.conftest import CHAIN_LENGTH, block_hash
+from tests.test_transaction import GENESIS_BLOCK
+
+
+def test_helpers_inside_a_batch(rpc_stub):
+    get_block = rpc_stub.methods["getblock"]
+    rpc_stub.methods["getblock"] = lambda params, path: GENESIS_BLOCK if params[1] == 0 else get_block(params, path)
+    rpc_stub.methods["dumpwallet"] = lambda params, path: {"filename": "/tmp/" + params[0]}
+    rpc_stub.methods["validateaddress"] = lambda params, path: {"isvalid": params[0].startswith("bc1"),
+                                                                 "address": params[0]}
+    bitcoin = BitCoin(BitCoin.HttpProvider("user", "password", rpc_stub.uri))
+    with bitcoin.provider.batch():
+        count = bitcoin.chain.get_block_count()
+        dump = bitcoin.wallet.dump_wallet("hot", "dump.txt")
+        valid = bitcoin.utils.validate_address("bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4")
+        invalid = bitcoin.utils.validate_address("nope")
+        raw_block = bitcoin.chain.get_raw_block(block_hash(0))
+        missing = bitcoin.chain.get_block_hash(CHAIN_LENGTH)
+    # one POST for the node wallet endpoint and one for the wallet
+    assert rpc_stub.posts == 2
+    assert count.result() == CHAIN_LENGTH - 1
+    assert dump.result() == "/tmp/dump.txt"
+    assert valid.result() is True
+    assert invalid.result() is False
+    assert raw_block.result().hash == "000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f"
+    with pytest.raises(RPCError):
+        missing.result()
+
+
+def test_helpers_outside_a_batch(rpc_stub):
+    rpc_stub.methods["dumpwallet"] = lambda params, path: {"filename": "/tmp/" + params[0]}
+    rpc_stub.methods["validateaddress"] = lambda params, path: {"isvalid": False}
+    bitcoin = BitCoin(BitCoin.HttpProvider("user", "password", rpc_stub.uri))
+    assert bitcoin.wallet.dump_wallet("hot", "dump.txt") == "/tmp/dump.txt"
+    assert bitcoin.utils.validate_address("nope") is False
@@ -0,0 +1,32 @@
+from btc.bitcoin import BitCoin
+from btc.cache import RPCCache
+from tests.conftest import CHAIN_LENGTH, block_hash
+
+
+def test_final_verbose_block_drops_chain_dependent_keys():
+    cache = RPCCache(ttl=60)
+    block = {"hash": block_hash(10), "height": 10, "confirmations": 100, "nextblockhash": block_hash(11)}
+    cache.store("getblock", [block_hash(10), 1], block, 100)
+    found, cached = cache.get("getblock", [block_hash(10), 1])
+    assert found
+    assert cached == {"hash": block_hash(10), "height": 10}
+    # the caller's result is left as the node returned it
+    assert block["confirmations"] == 100
+
+
+def test_near_tip_verbose_result_is_kept_whole():
+    cache = RPCCache(ttl=60)
+    tx = {"txid": "aa" * 32, "blockhash": block_hash(99), "confirmations": 2}
+    cache.store("getrawtransaction", ["aa" * 32, True], tx, 100)
+    assert cache.get("getrawtransaction", ["aa" * 32, True]) == (True, tx)
+
+
+def test_provider_cache(rpc_stub):
+    provider = BitCoin.HttpProvider("user", "password", rpc_stub.uri, cache=RPCCache())
+    bitcoin = BitCoin(provider)
+    first = bitcoin.chain.get_block(block_hash(3), 1)
+    second = bitcoin.chain.get_block(block_hash(3), 1)
+    assert first["confirmations"] == CHAIN_LENGTH - 3
+    assert "confirmations" not in second
+    assert second["height"] == 3
+    assert len(rpc_stub.method_calls("getblock")) == 1
@@ -0,0 +1,23 @@
+import pytest
+from btc.bitcoin import BitCoin
+from btc.fees import FeeEstimator, MAX_BLOCK_VSIZE
+
+
+@pytest.mark.parametrize("amount_mode", ["float", "decimal", "satoshi"])
+def test_mempool_histogram_amount_modes(rpc_stub, amount_mode):
+    # 2 blocks at 20 sat/vB, a child paying 50 sat/vB for a parent at 5 sat/vB is mined at 10 sat/vB with it
+    entries = {"%064x" % i: {"vsize": 1000, "fees": {"base": 0.0002}} for i in range(2 * MAX_BLOCK_VSIZE // 1000)}
+    entries["aa" * 32] = {"vsize": 1000, "ancestorsize": 2000, "fees": {"base": 0.0005, "ancestor": 0.0002}}
+    entries["bb" * 32] = {"vsize": 1000, "fees": {"base": 0.00005}}
+    rpc_stub.methods["getrawmempool"] = lambda params, path: entries
+    provider = BitCoin.HttpProvider("user", "password", rpc_stub.uri, amount_mode=amount_mode)
+    estimator = FeeEstimator(BitCoin(provider), blocks=6, max_target=6)
+    estimator.update_mempool()
+    histogram = estimator.mempool_histogram()
+    assert [vsize for _, vsize in histogram] == [2 * MAX_BLOCK_VSIZE, 1000, 1000]
+    assert 18 < histogram[0][0] <= 20
+    assert 9 < histogram[1][0] <= 10
+    assert 4.5 < histogram[2][0] <= 5
+    # 1 and 2 blocks must outbid the 20 sat/vB transactions
+    assert 20 < estimator.estimate(1) == estimator.estimate(2) < 22
+    assert estimator.estimate(3) == 1.0
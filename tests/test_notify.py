@@ -0,0 +1,218 @@
+import asyncio
+import struct
+import threading
+import time
+import pytest
+import zmq
+from btc.bitcoin import BitCoin
+from btc.mempool import MempoolMirror
+from btc.notify import BaseSubscriber, ZmqSubscriber, PollingSubscriber
+from tests.conftest import block_hash
+from tests.rpc_stub import RPCStubError
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in {} seconds".format(timeout))
+        time.sleep(0.01)
+
+
+def send(publisher, topic: str, body: bytes, sequence: int):
+    publisher.send_multipart([topic.encode(), body, struct.pack("<I", sequence)])
+
+
+@pytest.fixture
+def publisher():
+    """
+    ZMQ PUB socket standing in for bitcoind's notifications
+    """
+    context = zmq.Context()
+    socket = context.socket(zmq.PUB)
+    port = socket.bind_to_random_port("tcp://127.0.0.1")
+    yield socket, "tcp://127.0.0.1:%d" % port
+    socket.close(linger=0)
+    context.term()
+
+
+@pytest.fixture
+def subscriber(publisher):
+    socket, address = publisher
+    subscriber = ZmqSubscriber(address)
+    # a SUB socket misses what is published before it is connected, probe until a message gets through
+    deadline = time.monotonic() + 5
+    while subscriber.receive(0.05) is None:
+        assert time.monotonic() < deadline
+        socket.send_multipart([b"hashblock", bytes(32)])
+    while subscriber.receive(0.05) is not None:
+        pass
+    yield subscriber
+    subscriber.stop()
+    subscriber.close()
+
+
+@pytest.fixture
+def mempool_stub(rpc_stub):
+    """
+    rpc_stub with a mempool, getrawmempool, getmempoolentry and getrawtransaction read ``rpc_stub.mempool``
+    """
+    rpc_stub.mempool = {}
+
+    def get_mempool_entry(params, path):
+        if params[0] not in rpc_stub.mempool:
+            raise RPCStubError(-5, "Transaction not in mempool")
+        return {"vsize": 100, "fees": {"base": 0.00001}, "depends": [], "spentby": []}
+
+    def get_raw_transaction(params, path):
+        if params[0] not in rpc_stub.mempool:
+            raise RPCStubError(-5, "No such mempool transaction")
+        return rpc_stub.mempool[params[0]]
+
+    rpc_stub.methods["getrawmempool"] = lambda params, path: list(rpc_stub.mempool)
+    rpc_stub.methods["getmempoolentry"] = get_mempool_entry
+    rpc_stub.methods["getrawtransaction"] = get_raw_transaction
+    return rpc_stub
+
+
+def bitcoin(stub) -> BitCoin:
+    return BitCoin(BitCoin.HttpProvider("user", "password", stub.uri))
+
+
+def test_callbacks(publisher, subscriber):
+    socket, _ = publisher
+    blocks, transactions = [], []
+    subscriber.subscribe("hashblock", blocks.append)
+    subscriber.subscribe("rawtx", transactions.append)
+    subscriber.start()
+    send(socket, "hashblock", bytes.fromhex(block_hash(7)), 0)
+    send(socket, "rawtx", b"\x02\x00", 0)
+    wait_for(lambda: blocks and transactions)
+    assert blocks[0].hash == block_hash(7)
+    assert blocks[0].sequence == 0
+    assert transactions[0].body == b"\x02\x00"
+    assert subscriber.missed == 0
+
+
+def test_sequence_gap(publisher, subscriber):
+    socket, _ = publisher
+    received, gaps = [], []
+    subscriber.subscribe("rawtx", received.append)
+    subscriber.subscribe("gap", gaps.append)
+    subscriber.start()
+    for sequence in (0, 1, 4):
+        send(socket, "rawtx", bytes([sequence]), sequence)
+    wait_for(lambda: len(received) == 3)
+    assert subscriber.missed == 2
+    assert [notification.sequence for notification in gaps] == [4]
+
+
+def test_mempool_feed(publisher, subscriber, mempool_stub):
+    socket, _ = publisher
+    mempool = MempoolMirror(bitcoin(mempool_stub))
+    subscriber.attach(mempool=mempool)
+    subscriber.start()
+    tx_id = "11" * 32
+    mempool_stub.mempool[tx_id] = "0200"
+    send(socket, "sequence", bytes.fromhex(tx_id) + b"A" + struct.pack("<Q", 1), 0)
+    wait_for(lambda: tx_id in mempool)
+    del mempool_stub.mempool[tx_id]
+    send(socket, "sequence", bytes.fromhex(tx_id) + b"R" + struct.pack("<Q", 2), 1)
+    wait_for(lambda: tx_id not in mempool)
+    # a connected block, here after dropped messages, resyncs the mirror from getrawmempool
+    other = "22" * 32
+    mempool_stub.mempool[other] = "0200"
+    send(socket, "sequence", bytes.fromhex(block_hash(8)) + b"C", 5)
+    wait_for(lambda: other in mempool)
+    assert subscriber.missed == 3
+
+
+def test_callback_error_keeps_loop_alive(publisher, subscriber):
+    socket, _ = publisher
+    received, errors = [], []
+
+    def callback(notification):
+        if not received:
+            received.append(None)
+            raise RuntimeError("callback failed")
+        received.append(notification)
+
+    subscriber.subscribe("hashblock", callback)
+    subscriber.subscribe("error", errors.append)
+    subscriber.start()
+    send(socket, "hashblock", bytes.fromhex(block_hash(1)), 0)
+    send(socket, "hashblock", bytes.fromhex(block_hash(2)), 1)
+    wait_for(lambda: len(received) == 2)
+    assert received[1].hash == block_hash(2)
+    assert subscriber.errors == 1
+    assert isinstance(errors[0], RuntimeError)
+
+
+def test_polling_subscriber(mempool_stub):
+    tip = [block_hash(3)]
+    mempool_stub.methods["getbestblockhash"] = lambda params, path: tip[0]
+    subscriber = PollingSubscriber(bitcoin(mempool_stub), interval=0.01)
+    subscriber.poll()
+    assert subscriber.receive(0.05) is None
+    tip[0] = block_hash(4)
+    mempool_stub.mempool["33" * 32] = "0100"
+    notifications = [subscriber.receive(1) for _ in range(4)]
+    assert [(n.topic, n.hash, n.label) for n in notifications[:3]] == [
+        ("hashblock", block_hash(4), None),
+        ("sequence", block_hash(4), "C"),
+        ("sequence", "33" * 32, "A"),
+    ]
+    assert notifications[3].topic == "rawtx"
+    assert notifications[3].body == b"\x01\x00"
+    del mempool_stub.mempool["33" * 32]
+    removed = subscriber.receive(1)
+    assert (removed.topic, removed.hash, removed.label) == ("sequence", "33" * 32, "R")
+
+
+def test_polling_subscriber_async(mempool_stub):
+    subscriber = PollingSubscriber(bitcoin(mempool_stub), topics=("hashtx",), interval=0.01)
+    subscriber.poll()
+    mempool_stub.mempool["44" * 32] = "0100"
+
+    async def first():
+        async for notification in subscriber:
+            return notification
+
+    notification = asyncio.run(first())
+    assert (notification.topic, notification.hash) == ("hashtx", "44" * 32)
+
+
+def test_polling_receive_error_keeps_loop_alive(rpc_stub):
+    failures = [2]
+    tips = []
+
+    def get_best_block_hash(params, path):
+        if failures[0]:
+            failures[0] -= 1
+            raise RPCStubError(-28, "Loading block index")
+        return block_hash(len(rpc_stub.method_calls("getbestblockhash")))
+
+    rpc_stub.methods["getbestblockhash"] = get_best_block_hash
+    subscriber = PollingSubscriber(bitcoin(rpc_stub), topics=("hashblock",), interval=0.01)
+    subscriber.subscribe("hashblock", tips.append)
+    errors = []
+    subscriber.subscribe("error", errors.append)
+    thread = threading.Thread(target=subscriber.run_forever, args=(0.01, 0.05), daemon=True)
+    thread.start()
+    try:
+        wait_for(lambda: tips)
+    finally:
+        subscriber.stop()
+        thread.join(5)
+    assert subscriber.errors == 2
+    assert len(errors) == 2
+    assert not thread.is_alive()
+
+
+def test_subscriber_without_receive():
+    class Subscriber(BaseSubscriber):
+        pass
+
+    # fails on creation instead of in the loop of run_forever
+    with pytest.raises(TypeError):
+        Subscriber(["hashblock"])
@@ -0,0 +1,209 @@
+import hashlib
+import time
+import pytest
+from btc.bitcoin import BitCoin
+from btc.coinselect import CoinSelector
+from btc.models import UtxoSet
+from btc.payout import PayoutQueue, PENDING, SENT, FAILED, UNKNOWN, _payment_error
+from btc.providers import RPCError
+from btc.script import segwit_address
+from tests.rpc_stub import RPCStubError
+from tests.test_transaction import BIP143_P2WPKH
+
+
+def address(i: int) -> str:
+    return segwit_address("bc", 0, bytes([i]) * 20)
+
+
+class StubWallet:
+    """
+        sendmany and listtransactions of a wallet holding ``balance`` satoshis, on an RPCStub
+    """
+
+    def __init__(self, stub, balance: int):
+        self.balance = balance
+        self.rejected = {}
+        self.error = None
+        self.delay = 0
+        self.sends = []
+        self.transactions = []
+        stub.methods["sendmany"] = self.send_many
+        stub.methods["listtransactions"] = self.list_transactions
+
+    def send_many(self, params, path):
+        amounts, comment = params[1], params[3]
+        if self.error is not None:
+            raise self.error
+        for to, amount in amounts.items():
+            if to in self.rejected:
+                raise RPCStubError(*self.rejected[to])
+        total = round(sum(amounts.values()) * 1e8)
+        if total > self.balance:
+            raise RPCStubError(-6, "Insufficient funds")
+        self.balance -= total
+        tx_id = hashlib.sha256(comment.encode()).hexdigest()
+        self.sends.append(amounts)
+        self.transactions.append({"txid": tx_id, "comment": comment, "time": int(time.time()), "category": "send",
+                                  "vout": 0})
+        # the node sent the batch but the answer comes too late
+        time.sleep(self.delay)
+        return tx_id
+
+    def list_transactions(self, params, path):
+        count, skip = params[1], params[2]
+        return self.transactions[::-1][skip:skip + count][::-1]
+
+
+@pytest.fixture
+def wallet(rpc_stub):
+    return StubWallet(rpc_stub, 10 ** 8)
+
+
+def queue(stub, journal=None, selector=None, **kwargs) -> PayoutQueue:
+    bitcoin = BitCoin(BitCoin.HttpProvider("user", "password", stub.uri, **kwargs))
+    return PayoutQueue(bitcoin, "hot", max_payments=10, journal=journal, selector=selector)
+
+
+def test_submit_rejects_invalid_payments(rpc_stub, wallet, tmp_path):
+    journal = str(tmp_path / "payouts.log")
+    with queue(rpc_stub, journal) as payouts:
+        for amount, to in [(0, address(1)), (-5, address(1)), (293, address(1)), (1000, "bc1qinvalid"),
+                           (1000, "tb1qw508d6qejxtdg4y5r3zarvary0c5xw7kxpjzsx")]:
+            with pytest.raises(ValueError):
+                payouts.submit("withdrawal", to, amount)
+        assert len(payouts) == 0
+        # 294 satoshis is the dust threshold of a P2WPKH output
+        payouts.submit("withdrawal", address(1), 294)
+    with open(journal) as f:
+        assert len(f.readlines()) == 1
+
+
+def test_batch(rpc_stub, wallet):
+    with queue(rpc_stub) as payouts:
+        payments = [payouts.submit("w%d" % i, address(i), 1000 * i) for i in range(1, 4)]
+        tx_ids = payouts.flush()
+        assert len(tx_ids) == 1
+        assert wallet.sends == [{address(i): 1000 * i / 1e8 for i in range(1, 4)}]
+        assert [(p.status, p.txid) for p in payments] == [(SENT, tx_ids[0])] * 3
+        # a key is paid once
+        assert payouts.submit("w1", address(1), 1000) is payments[0]
+        assert payouts.flush() == []
+        with pytest.raises(ValueError):
+            payouts.submit("w1", address(1), 2000)
+
+
+def test_split_fails_the_rejected_payment(rpc_stub, wallet):
+    wallet.rejected[address(3)] = (-3, "Invalid amount for send")
+    with queue(rpc_stub) as payouts:
+        payments = [payouts.submit("w%d" % i, address(i), 1000) for i in range(1, 6)]
+        tx_ids = payouts.flush()
+        assert [p.status for p in payments] == [SENT, SENT, FAILED, SENT, SENT]
+        assert payments[2].error.code == -3
+        assert sorted(set(p.txid for p in payments if p.txid)) == sorted(tx_ids)
+        assert len(payouts) == 0
+        # nothing is left to block the next batches
+        payouts.submit("w6", address(6), 1000)
+        assert len(payouts.flush()) == 1
+
+
+def test_split_on_insufficient_funds(rpc_stub, wallet):
+    wallet.balance = 2500
+    with queue(rpc_stub) as payouts:
+        payments = [payouts.submit("w%d" % i, address(i), 1000) for i in range(1, 5)]
+        assert len(payouts.flush()) == 1
+        assert [p.status for p in payments] == [SENT, SENT, PENDING, PENDING]
+        assert payments[2].error.code == -6
+        assert len(payouts) == 2
+        # funds came in
+        wallet.balance = 10000
+        assert len(payouts.flush()) == 1
+        assert [p.status for p in payments[2:]] == [SENT, SENT]
+
+
+def test_batch_error_is_raised(rpc_stub, wallet):
+    wallet.error = RPCStubError(-13, "Please enter the wallet passphrase with walletpassphrase first.")
+    with queue(rpc_stub) as payouts:
+        payments = [payouts.submit("w%d" % i, address(i), 1000) for i in range(1, 5)]
+        with pytest.raises(RPCError) as e:
+            payouts.flush()
+        assert e.value.code == -13
+        # the batch is not split
+        assert len(rpc_stub.method_calls("sendmany")) == 1
+        assert [p.status for p in payments] == [PENDING] * 4
+        assert len(payouts) == 4
+
+
+def test_rejection_reasons():
+    assert _payment_error(RPCError({"code": -3, "message": "Invalid amount for send"}))
+    assert _payment_error(RPCError({"code": -26, "message": "dust"}))
+    assert not _payment_error(RPCError({"code": -26, "message": "min relay fee not met, 100 < 141"}))
+    assert not _payment_error(RPCError({"code": -26, "message": "mempool full"}))
+    assert not _payment_error(RPCError({"code": -13, "message": "locked"}))
+
+
+def test_journal_replay(rpc_stub, wallet, tmp_path):
+    journal = str(tmp_path / "payouts.log")
+    wallet.rejected[address(4)] = (-5, "Invalid Bitcoin address")
+    with queue(rpc_stub, journal) as payouts:
+        payouts.submit("w1", address(1), 1000)
+        payouts.submit("w2", address(2), 1000)
+        first = payouts.flush()
+        payouts.submit("w3", address(3), 1000)
+        payouts.submit("w4", address(4), 1000)
+        second = payouts.flush()
+        payouts.submit("w5", address(5), 1000)
+    with open(journal, "a") as f:
+        # a record cut by a crash
+        f.write('{"op": "submit", "key": "w6"')
+
+    with queue(rpc_stub, journal) as payouts:
+        assert [(payouts.get("w%d" % i).status, payouts.get("w%d" % i).txid) for i in range(1, 6)] == [
+            (SENT, first[0]), (SENT, first[0]), (SENT, second[0]), (FAILED, None), (PENDING, None)]
+        assert payouts.get("w4").error.code == -5
+        assert payouts.get("w6") is None
+        assert len(payouts) == 1
+        assert payouts.submit("w1", address(1), 1000).status == SENT
+        payouts.flush()
+        assert wallet.sends[-1] == {address(5): 1000 / 1e8}
+        assert len(wallet.sends) == 3
+
+
+def test_recover_unknown_batch(rpc_stub, wallet, tmp_path):
+    journal = str(tmp_path / "payouts.log")
+    wallet.delay = 1
+    with queue(rpc_stub, journal, timeout=0.2) as payouts:
+        payments = [payouts.submit("w%d" % i, address(i), 1000) for i in range(1, 3)]
+        with pytest.raises(Exception):
+            payouts.flush()
+        assert [p.status for p in payments] == [UNKNOWN] * 2
+    wallet.delay = 0
+
+    with queue(rpc_stub, journal) as payouts:
+        assert payouts.get("w1").status == UNKNOWN
+        assert len(payouts) == 0
+        found = payouts.recover()
+        tx_id = wallet.transactions[0]["txid"]
+        assert list(found.values()) == [tx_id]
+        assert [(payouts.get(key).status, payouts.get(key).txid) for key in ("w1", "w2")] == [(SENT, tx_id)] * 2
+        assert payouts.flush() == []
+    assert len(wallet.sends) == 1
+
+
+@pytest.mark.parametrize("change_type, address_type", [("witness_v1_taproot", "bech32m"), ("pubkeyhash", "legacy")])
+def test_psbt_change_type(rpc_stub, change_type, address_type):
+    utxos = UtxoSet([{"txid": "11" * 32, "vout": 0, "address": address(9), "amount": 1.0, "confirmations": 10,
+                      "scriptPubKey": "0014" + "09" * 20, "spendable": True, "solvable": True, "safe": True}])
+    selector = CoinSelector(utxos, 2.0, change_type=change_type)
+    rpc_stub.methods["getrawchangeaddress"] = lambda params, path: address(8)
+    rpc_stub.methods["createpsbt"] = lambda params, path: "psbt"
+    rpc_stub.methods["walletprocesspsbt"] = lambda params, path: {"psbt": "signed", "complete": True}
+    rpc_stub.methods["finalizepsbt"] = lambda params, path: {"hex": BIP143_P2WPKH, "complete": True}
+    rpc_stub.methods["sendrawtransaction"] = lambda params, path: "aa" * 32
+    with queue(rpc_stub, selector=selector) as payouts:
+        payment = payouts.submit("w1", address(1), 100000)
+        payouts.flush()
+        assert payment.status == SENT
+    assert rpc_stub.method_calls("getrawchangeaddress") == [[address_type]]
+    outputs = rpc_stub.method_calls("createpsbt")[0][1]
+    assert outputs[0] == {address(1): 0.001}
+    assert list(outputs[1]) == [address(8)]
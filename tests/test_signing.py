@@ -0,0 +1,180 @@
+import pytest
+from btc import ecc
+from btc.script import base58check_encode, push_data, script_address
+from btc.signing import SighashCache, p2pkh_script, sign_transaction, SIGHASH_ALL
+from btc.transaction import Transaction, TxOut
+from tests.test_transaction import BIP143_P2WPKH
+
+# native P2WPKH example of BIP143, input 0 spends a P2PK output, input 1 a P2WPKH output
+P2WPKH_UNSIGNED = (
+    "0100000002fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f0000000000eeffffffef51e1b804cc89d182"
+    "d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ffffffff02202cb206000000001976a9148280b37df378db99f66f"
+    "85c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42dbee7e4dbe6a21b2d50ce2f0167faa815988ac11000000"
+)
+P2WPKH_SPENT = [
+    {"txid": "9f96ade4b41d5433f4eda31e1738ec2b36f6e7d1420d94a6af99801a88f7f7ff", "vout": 0, "amount": 6.25,
+     "scriptPubKey": "2103c9f4836b9a4f77fc0d81f7bcb01b7f1b35916864b9476c241ce9fc198bd25432ac"},
+    {"txid": "8ac60eb9575db5b2d987e29f301b5b819ea83a5c6579d282d189cc04b8e151ef", "vout": 1, "amount": 6.0,
+     "scriptPubKey": "00141d0f172a0ecb48aee1be1f2687d2963ae33f71a1"},
+]
+P2PK_SECRET = "bbc27228ddcb9209d7fd6f36b02f7dfa6252af40bb2f1cbc7a557da8027ff866"
+P2WPKH_SECRET = "619c335025c7f4012e556c2a58b2506e30b8511b53ade95ea316fd8c3286feb9"
+P2WPKH_SIGHASH = "c37af31116d1b27caf68aae9e3ac82f1477929014d5b917657d0eb49478cb670"
+
+# P2SH-P2WPKH example of BIP143
+P2SH_P2WPKH_UNSIGNED = (
+    "0100000001db6b1b20aa0fd7b23880be2ecbd4a98130974cf4748fb66092ac4d3ceb1a54770100000000feffffff02b8b4eb0b00000000"
+    "1976a914a457b684d7f0d539a46a45bbc043f35b59d0d96388ac0008af2f000000001976a914fd270b1ee6abcaea97fea7ad0402e8bd8a"
+    "d6d77c88ac92040000"
+)
+P2SH_P2WPKH_SIGNED = (
+    "01000000000101db6b1b20aa0fd7b23880be2ecbd4a98130974cf4748fb66092ac4d3ceb1a5477010000001716001479091972186c449e"
+    "b1ded22b78e40d009bdf0089feffffff02b8b4eb0b000000001976a914a457b684d7f0d539a46a45bbc043f35b59d0d96388ac0008af2f"
+    "000000001976a914fd270b1ee6abcaea97fea7ad0402e8bd8ad6d77c88ac02473044022047ac8e878352d3ebbde1c94ce3a10d057c2417"
+    "5747116f8288e5d794d12d482f0220217f36a485cae903c713331d877c1f64677e3622ad4010726870540656fe9dcb012103ad1d8e8921"
+    "2f0b92c74d23bb710c00662ad1470198ac48c43f7d6f93a2a2687392040000"
+)
+P2SH_P2WPKH_SPENT = [
+    {"txid": "77541aeb3c4dac9260b68f74f44c973081a9d4cb2ebe8038b2d70faa201b6bdb", "vout": 1, "amount": 10,
+     "scriptPubKey": "a9144733f37cf4db86fbc2efed2500b4f4e49f31202387"},
+]
+P2SH_P2WPKH_SECRET = "eb696a065ef48a2192da5b28b694f87544b30fae8327c4510137a922f32c6dcf"
+P2SH_P2WPKH_SIGHASH = "64f3b0f4dd2bb3aa1ce8566d220cc74dda9df97d8490cc81d89d735c92e59fb6"
+
+# BIP340 test vectors 0 to 2: secret key, public key, aux_rand, message, signature
+BIP340_VECTORS = [
+    ("0000000000000000000000000000000000000000000000000000000000000003",
+     "f9308a019258c31049344f85f89d5229b531c845836f99b08601f113bce036f9",
+     "0000000000000000000000000000000000000000000000000000000000000000",
+     "0000000000000000000000000000000000000000000000000000000000000000",
+     "e907831f80848d1069a5371b402410364bdf1c5f8307b0084c55f1ce2dca821525f66a4a85ea8b71e482a74f382d2ce5ebeee8fdb2172f"
+     "477df4900d310536c0"),
+    ("b7e151628aed2a6abf7158809cf4f3c762e7160f38b4da56a784d9045190cfef",
+     "dff1d77f2a671c5f36183726db2341be58feae1da2deced843240f7b502ba659",
+     "0000000000000000000000000000000000000000000000000000000000000001",
+     "243f6a8885a308d313198a2e03707344a4093822299f31d0082efa98ec4e6c89",
+     "6896bd60eeae296db48a229ff71dfe071bde413e6d43f917dc8dcf8c78de33418906d11ac976abccb20b091292bff4ea897efcb639ea87"
+     "1cfa95f6de339e4b0a"),
+    ("c90fdaa22168c234c4c6628b80dc1cd129024e088a67cc74020bbea63b14e5c9",
+     "dd308afec5777e13121fa72b9cc1b7cc0139715309b086c960e18fd969774eb8",
+     "c87aa53824b4d7ae2eb035a2b5bbbccc080e76cdc6d1692c4b0b62d798e6d906",
+     "7e2d58d8b3bcdf1abadec7829054f90dda9805aab56c77333024b9d0a508b75c",
+     "5831aaeed7b44bb74e5eab94ba9d4294c49bcf2a60728d8b4c200f50dd313c1bab745879a5ad954a72c45a91c3a51d3c7adea98d82f848"
+     "1e0e1e03674a6f3fb7"),
+]
+
+
+def wif(secret: str) -> str:
+    return base58check_encode(b"\x80" + bytes.fromhex(secret) + b"\x01")
+
+
+def spent_outputs(prev_txs: list) -> list:
+    return [TxOut(round(prev["amount"] * 1e8), bytes.fromhex(prev["scriptPubKey"])) for prev in prev_txs]
+
+
+@pytest.fixture(params=["coincurve", "python"])
+def backend(request, monkeypatch):
+    """
+    Run a test with libsecp256k1 through coincurve and with the pure Python implementation
+    """
+    if request.param == "coincurve" and ecc.coincurve is None:
+        pytest.skip("coincurve is not installed")
+    if request.param == "python":
+        monkeypatch.setattr(ecc, "coincurve", None)
+    return request.param
+
+
+def test_bip143_sighashes():
+    tx = Transaction.parse(P2WPKH_UNSIGNED)
+    pub = ecc.public_key(bytes.fromhex(P2WPKH_SECRET))
+    script_code = p2pkh_script(ecc.hash160(pub))
+    sighash = SighashCache(tx, spent_outputs(P2WPKH_SPENT)).segwit_v0(1, script_code, 600000000, SIGHASH_ALL)
+    assert sighash.hex() == P2WPKH_SIGHASH
+
+    tx = Transaction.parse(P2SH_P2WPKH_UNSIGNED)
+    pub = ecc.public_key(bytes.fromhex(P2SH_P2WPKH_SECRET))
+    script_code = p2pkh_script(ecc.hash160(pub))
+    sighash = SighashCache(tx, spent_outputs(P2SH_P2WPKH_SPENT)).segwit_v0(0, script_code, 1000000000, SIGHASH_ALL)
+    assert sighash.hex() == P2SH_P2WPKH_SIGHASH
+
+
+def test_sign_p2wpkh(backend):
+    result = sign_transaction(P2WPKH_UNSIGNED, [wif(P2WPKH_SECRET)], P2WPKH_SPENT)
+    # the P2PK input 0 has no key
+    assert not result["complete"]
+    assert [error["vout"] for error in result["errors"]] == [0]
+    # BIP143 signed input 0 with a plain RFC6979 nonce, which is the node's signature without low R grinding
+    tx = Transaction.parse(result["hex"])
+    sighash = SighashCache(tx, spent_outputs(P2WPKH_SPENT)).legacy(
+        0, bytes.fromhex(P2WPKH_SPENT[0]["scriptPubKey"]), SIGHASH_ALL)
+    signature = ecc.sign_ecdsa(bytes.fromhex(P2PK_SECRET), sighash, grind=False)
+    tx.inputs[0].script_sig = push_data(signature + bytes([SIGHASH_ALL]))
+    assert tx.serialize().hex() == BIP143_P2WPKH
+
+
+def test_sign_p2sh_p2wpkh(backend):
+    result = sign_transaction(P2SH_P2WPKH_UNSIGNED, [wif(P2SH_P2WPKH_SECRET)], P2SH_P2WPKH_SPENT)
+    assert result == {"hex": P2SH_P2WPKH_SIGNED, "complete": True}
+
+
+def test_sign_p2pkh(backend):
+    # spend the P2WPKH example's outputs as if they were P2PKH outputs of the same key
+    secret = bytes.fromhex(P2WPKH_SECRET)
+    script = p2pkh_script(ecc.hash160(ecc.public_key(secret))).hex()
+    prev_txs = [dict(prev, scriptPubKey=script) for prev in P2WPKH_SPENT]
+    result = sign_transaction(P2WPKH_UNSIGNED, [wif(P2WPKH_SECRET)], prev_txs)
+    assert result["complete"]
+    tx = Transaction.parse(result["hex"])
+    assert not tx.has_witness()
+    cache = SighashCache(tx, spent_outputs(prev_txs))
+    for index, txin in enumerate(tx.inputs):
+        signature = ecc.sign_ecdsa(secret, cache.legacy(index, bytes.fromhex(script), SIGHASH_ALL))
+        # low R grinding keeps the DER signature at 70 bytes at most
+        assert len(signature) <= 70
+        assert bytes(txin.script_sig) == push_data(signature + bytes([SIGHASH_ALL])) + push_data(
+            ecc.public_key(secret))
+
+
+def test_sign_p2tr(backend):
+    secret = bytes.fromhex(P2WPKH_SECRET)
+    output_key = ecc.taproot_output_key(ecc.x_only_public_key(secret))
+    prev_txs = [dict(prev, scriptPubKey="5120" + output_key.hex()) for prev in P2WPKH_SPENT]
+    result = sign_transaction(P2WPKH_UNSIGNED, [wif(P2WPKH_SECRET)], prev_txs, "DEFAULT", aux=bytes(32))
+    assert result["complete"]
+    tx = Transaction.parse(result["hex"])
+    cache = SighashCache(tx, spent_outputs(prev_txs))
+    tweaked = ecc.taproot_tweak_secret(secret)
+    assert ecc.x_only_public_key(tweaked) == output_key
+    for index, txin in enumerate(tx.inputs):
+        # SIGHASH_DEFAULT signatures are 64 bytes, without a hash type
+        assert [bytes(item) for item in txin.witness] == [ecc.sign_schnorr(tweaked, cache.taproot(index), bytes(32))]
+
+
+def test_backends_are_identical():
+    secret = bytes.fromhex(P2WPKH_SECRET)
+    digest = bytes.fromhex(P2WPKH_SIGHASH)
+    if ecc.coincurve is None:
+        pytest.skip("coincurve is not installed")
+    signatures = [ecc.sign_ecdsa(secret, digest), ecc.sign_ecdsa(secret, digest, grind=False),
+                  ecc.sign_schnorr(secret, digest, bytes(32)), ecc.public_key(secret, False)]
+    coincurve, ecc.coincurve = ecc.coincurve, None
+    try:
+        assert signatures == [ecc.sign_ecdsa(secret, digest), ecc.sign_ecdsa(secret, digest, grind=False),
+                              ecc.sign_schnorr(secret, digest, bytes(32)), ecc.public_key(secret, False)]
+    finally:
+        ecc.coincurve = coincurve
+
+
+@pytest.mark.parametrize("secret, public, aux, message, signature", BIP340_VECTORS)
+def test_bip340(backend, secret, public, aux, message, signature):
+    secret = bytes.fromhex(secret)
+    assert ecc.x_only_public_key(secret).hex() == public
+    assert ecc.sign_schnorr(secret, bytes.fromhex(message), bytes.fromhex(aux)).hex() == signature
+
+
+def test_bip86_output_key():
+    # first receiving key of the BIP86 test vectors
+    internal_key = bytes.fromhex("cc8a4bc64d897bddc5fbc2f670f7a8ba0b386779106cf1223c6fc5d7cd6fc115")
+    output_key = ecc.taproot_output_key(internal_key)
+    assert output_key.hex() == "a60869f0dbcf1dc659c9cecbaf8050135ea9e8cdc487053f1dc6880949dc684c"
+    assert script_address(b"\x51\x20" + output_key) == "bc1p5cyxnuxmeuwuvkwfem96lqzszd02n6xdcjrs20cac6yqjjwudpxqkedrcr"
@@ -0,0 +1,32 @@
+from btc.bitcoin import BitCoin
+from btc.block import Block
+from btc.store import BlockStore
+from tests.conftest import block_hash
+from tests.test_transaction import GENESIS_BLOCK, GENESIS_COINBASE, GENESIS_COINBASE_DECODED
+
+
+def test_store_hits_inside_a_batch(rpc_stub, tmp_path):
+    tx_id = GENESIS_COINBASE_DECODED["txid"]
+    rpc_stub.methods["getrawtransaction"] = lambda params, path: GENESIS_COINBASE
+    bitcoin = BitCoin(BitCoin.HttpProvider("user", "password", rpc_stub.uri), BlockStore(str(tmp_path)))
+    store = bitcoin.store
+    store.put_block(block_hash(3), 1, bitcoin.chain.get_block(block_hash(3), 1), 3)
+    store.put_block(block_hash(0), 0, GENESIS_BLOCK, 0)
+    bitcoin.raw.get_raw_transaction(tx_id)
+    calls = len(rpc_stub.calls)
+
+    with bitcoin.provider.batch() as batch:
+        stored_hash = bitcoin.chain.get_block_hash(3)
+        new_hash = bitcoin.chain.get_block_hash(5)
+        block = bitcoin.chain.get_block(block_hash(3), 1)
+        raw_block = bitcoin.chain.get_raw_block(block_hash(0))
+        tx = bitcoin.raw.get_raw_transaction(tx_id)
+    assert stored_hash.result() == block_hash(3)
+    assert new_hash.result() == block_hash(5)
+    assert block.result()["height"] == 3
+    assert isinstance(raw_block.result(), Block)
+    assert raw_block.result().hash == "000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f"
+    assert tx.result() == GENESIS_COINBASE
+    # only the call the store could not answer reached the node
+    assert [call[:2] for call in rpc_stub.calls[calls:]] == [("getblockhash", [5])]
+    assert batch.responses == []
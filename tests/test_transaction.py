@@ -0,0 +1,139 @@
+import hashlib
+from btc.block import Block, block_transactions
+from btc.script import address_to_script, descriptor_checksum, script_address
+from btc.transaction import Transaction, decode_raw_transaction
+
+GENESIS_BLOCK = (
+    "0100000000000000000000000000000000000000000000000000000000000000000000003ba3edfd7a7b12b27ac72c3e67768f617fc81bc3"
+    "888a51323a9fb8aa4b1e5e4a29ab5f49ffff001d1dac2b7c01010000000100000000000000000000000000000000000000000000000000"
+    "00000000000000ffffffff4d04ffff001d0104455468652054696d65732030332f4a616e2f32303039204368616e63656c6c6f72206f6e"
+    "206272696e6b206f66207365636f6e64206261696c6f757420666f722062616e6b73ffffffff0100f2052a01000000434104678afdb0fe"
+    "5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b"
+    "6bf11d5fac00000000"
+)
+GENESIS_PUBKEY = (
+    "04678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d"
+    "578a4c702b6bf11d5f"
+)
+GENESIS_COINBASE = GENESIS_BLOCK[81 * 2:]
+
+# decoderawtransaction of the genesis coinbase
+GENESIS_COINBASE_DECODED = {
+    "txid": "4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b",
+    "hash": "4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b",
+    "version": 1,
+    "size": 204,
+    "vsize": 204,
+    "weight": 816,
+    "locktime": 0,
+    "vin": [{
+        "coinbase": "04ffff001d0104455468652054696d65732030332f4a616e2f32303039204368616e63656c6c6f72206f6e206272696e6b"
+                    "206f66207365636f6e64206261696c6f757420666f722062616e6b73",
+        "sequence": 4294967295,
+    }],
+    "vout": [{
+        "value": 50.0,
+        "n": 0,
+        "scriptPubKey": {
+            "asm": GENESIS_PUBKEY + " OP_CHECKSIG",
+            "desc": "pk(" + GENESIS_PUBKEY + ")#vlz6ztea",
+            "hex": "41" + GENESIS_PUBKEY + "ac",
+            "type": "pubkey",
+        },
+    }],
+}
+
+# signed transaction of the native P2WPKH example of BIP143
+BIP143_P2WPKH = (
+    "01000000000102fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f00000000494830450221008b9d1dc26ba6"
+    "a9cb62127b02742fa9d754cd3bebf337f7a55d114c8e5cdd30be022040529b194ba3f9281a99f2b1c0a19c0489bc22ede944ccf4ecbab4cc"
+    "618ef3ed01eeffffffef51e1b804cc89d182d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ffffffff02202cb20600"
+    "0000001976a9148280b37df378db99f66f85c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42dbee7e4dbe6a21b2d50ce2f0"
+    "167faa815988ac000247304402203609e17b84f6a7d30c80bfa610b5b4542f32a8a0d5447a12fb1366d7f01cc44a0220573a954c45183315"
+    "61406f90300e8f3358f51928d43c212a8caed02de67eebee0121025476c2e83188368da1ff3e292e7acafcdb3566bb0ad253f62fc70f07ae"
+    "ee635711000000"
+)
+BIP143_WITNESS = [
+    "304402203609e17b84f6a7d30c80bfa610b5b4542f32a8a0d5447a12fb1366d7f01cc44a0220573a954c4518331561406f90300e8f3358f5"
+    "1928d43c212a8caed02de67eebee01",
+    "025476c2e83188368da1ff3e292e7acafcdb3566bb0ad253f62fc70f07aeee6357",
+]
+
+
+def sha256d_hex(data: bytes) -> str:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()[::-1].hex()
+
+
+def test_genesis_block():
+    block = Block(GENESIS_BLOCK)
+    assert block.hash == "000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f"
+    assert block.tx_count == 1
+    assert block.size == 285
+    assert block.check_merkle_root()
+    header = block.header.to_dict()
+    assert header["time"] == 1231006505
+    assert header["nonce"] == 2083236893
+    assert header["bits"] == "1d00ffff"
+    assert header["difficulty"] == 1
+    assert "previousblockhash" not in header
+    assert block.txids() == [GENESIS_COINBASE_DECODED["txid"]]
+
+
+def test_genesis_coinbase_matches_node():
+    assert decode_raw_transaction(GENESIS_COINBASE) == GENESIS_COINBASE_DECODED
+    coinbase = Block(GENESIS_BLOCK).coinbase()
+    assert coinbase.is_coinbase()
+    assert coinbase.to_dict() == GENESIS_COINBASE_DECODED
+
+
+def test_segwit_transaction():
+    tx = Transaction.parse(BIP143_P2WPKH)
+    assert tx.has_witness()
+    assert tx.serialize().hex() == BIP143_P2WPKH
+    # the txid commits to the serialization without marker, flag and witness
+    witness_start = BIP143_P2WPKH.index("0002473044")
+    stripped = BIP143_P2WPKH[:8] + BIP143_P2WPKH[12:witness_start] + BIP143_P2WPKH[-8:]
+    assert tx.serialize(include_witness=False).hex() == stripped
+    assert tx.txid == sha256d_hex(bytes.fromhex(stripped))
+    assert tx.wtxid == sha256d_hex(bytes.fromhex(BIP143_P2WPKH))
+    assert tx.txid != tx.wtxid
+
+    decoded = decode_raw_transaction(BIP143_P2WPKH)
+    assert decoded["size"] == len(BIP143_P2WPKH) // 2
+    assert decoded["weight"] == len(stripped) // 2 * 3 + len(BIP143_P2WPKH) // 2
+    assert decoded["vsize"] == (decoded["weight"] + 3) // 4
+    assert decoded["locktime"] == 17
+    assert decoded["vin"][0]["sequence"] == 0xffffffee
+    assert "txinwitness" not in decoded["vin"][0]
+    assert decoded["vin"][1]["txinwitness"] == BIP143_WITNESS
+    assert decoded["vin"][1]["txid"] == "8ac60eb9575db5b2d987e29f301b5b819ea83a5c6579d282d189cc04b8e151ef"
+    assert [out["value"] for out in decoded["vout"]] == [1.1234, 2.2345]
+    assert [out["scriptPubKey"]["type"] for out in decoded["vout"]] == ["pubkeyhash", "pubkeyhash"]
+
+
+def test_descriptor_checksum():
+    # BIP380 test vectors
+    assert descriptor_checksum("raw(deadbeef)") == "89f8spxm"
+    assert descriptor_checksum("addr(mkmZxiEcEd8ZqjQWVZuC6so5dFMKEFpN2j)") == "02wpgw69"
+
+
+def test_addresses():
+    # address of the genesis public key and the P2WPKH example of BIP173
+    p2pkh = bytes.fromhex("76a91462e907b15cbf27d5425399ebf6f0fb50ebb88f1888ac")
+    p2wpkh = bytes.fromhex("0014751e76e8199196d454941c45d1b3a323f1433bd6")
+    assert script_address(p2pkh) == "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"
+    assert script_address(p2wpkh) == "bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4"
+    assert address_to_script("1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa") == p2pkh
+    assert address_to_script("bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4") == p2wpkh
+
+
+def test_block_transactions_amount_modes():
+    # the coinbase of the genesis block as getblock verbosity 2 returns it in float and satoshi amount mode
+    for value in (50.0, 5000000000):
+        vout = dict(GENESIS_COINBASE_DECODED["vout"][0], value=value)
+        block = {"hash": Block(GENESIS_BLOCK).hash, "height": 0, "tx": [dict(GENESIS_COINBASE_DECODED, vout=[vout])]}
+        _, _, height, txs = block_transactions(block)
+        assert height == 0
+        assert txs[0][1] == []
+        assert txs[0][2] == [(5000000000, bytes.fromhex(vout["scriptPubKey"]["hex"]))]
+    assert block_transactions(Block(GENESIS_BLOCK))[3][0][2][0][0] == 5000000000